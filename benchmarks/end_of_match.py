@@ -0,0 +1,118 @@
+'''
+    Counts the database round trips of a match-winning move and measures its latency
+    against a fake database that answers every call after a fixed network delay.
+
+    Usage: python -m benchmarks.end_of_match
+'''
+import asyncio
+import time
+from unittest.mock import patch
+
+from models.board_configuration import Match
+from services.game import check_winner
+from services.websocket import ConnectionManager
+
+ROUND_TRIP_SECONDS = 0.005
+RUNS = 20
+
+
+class FakeCursor:
+    def __init__(self, collection, documents):
+        self.collection = collection
+        self.documents = documents
+
+    async def to_list(self, length=None):
+        await self.collection.round_trip("find")
+        return self.documents
+
+
+class FakeCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+
+    async def round_trip(self, operation):
+        self.database.calls.append(f"{self.name}.{operation}")
+        await asyncio.sleep(ROUND_TRIP_SECONDS)
+
+    def find(self, *args, **kwargs):
+        documents = [{"username": "alice", "rating": 1500}, {"username": "bob", "rating": 1500}]
+        return FakeCursor(self, documents if self.name == "users" else [])
+
+    async def find_one(self, *args, **kwargs):
+        await self.round_trip("find_one")
+        return {"username": "alice", "rating": 1516, "stats": {"highest_rating": 1500}} if self.name == "users" else None
+
+    async def update_one(self, *args, **kwargs):
+        await self.round_trip("update_one")
+
+    async def bulk_write(self, *args, **kwargs):
+        await self.round_trip("bulk_write")
+
+    async def insert_many(self, *args, **kwargs):
+        await self.round_trip("insert_many")
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return FakeCollection(self, name)
+
+    def __getitem__(self, name):
+        return FakeCollection(self, name)
+
+
+def winning_match() -> Match:
+    match = Match(player1="alice", player2="bob", status="started", rounds_to_win=1, turn=0)
+    board = match.board_configuration.model_dump()
+    for point in board["points"]:
+        point["player1"] = 0
+    match.board_configuration = board
+    return match
+
+
+async def legacy_end_of_match(database: FakeDatabase):
+    # Sequence of calls made before the end-of-match writes were batched
+    users = database.users
+    await users.find_one()
+    await users.find_one()
+    await database.matches.update_one()
+    await users.update_one()
+    await users.update_one()
+    await users.find_one()
+    await users.update_one()
+    await database.tournaments.find_one()
+    await database.matches.update_one()
+
+
+async def current_end_of_match(database: FakeDatabase):
+    await check_winner(winning_match(), ConnectionManager())
+
+
+async def measure(name, end_of_match):
+    database = FakeDatabase()
+    modules = ["services.game", "services.rating_history", "services.tournament"]
+    patches = [patch(f"{module}.get_db", return_value=database) for module in modules]
+    for active in patches:
+        active.start()
+    try:
+        start = time.perf_counter()
+        for _ in range(RUNS):
+            await end_of_match(database)
+        elapsed = (time.perf_counter() - start) / RUNS
+    finally:
+        for active in patches:
+            active.stop()
+    print(f"{name}: {len(database.calls) // RUNS} round trips, {elapsed * 1000:.1f} ms "
+          f"with {ROUND_TRIP_SECONDS * 1000:.0f} ms per round trip")
+
+
+async def main():
+    await measure("before", legacy_end_of_match)
+    await measure("after", current_end_of_match)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
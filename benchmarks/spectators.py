@@ -0,0 +1,77 @@
+'''
+    Measures the latency of a move event sent to the players of a match watched by 10k spectators, and the time
+    until the last spectator received it. The events are serialized once per encoding whatever the audience size.
+
+    Usage: python -m benchmarks.spectators
+'''
+import asyncio
+import time
+
+from models.board_configuration import Match
+from services.event_bus import LocalEventBus
+from services.game import notify_players
+from services.match_events import diff_match, update_payload
+from services.spectators import SpectatorHub
+from services.websocket import ConnectionManager
+
+SPECTATORS = 10000
+RUNS = 20
+
+
+class NullWebSocket:
+    def __init__(self):
+        self.scope = {"subprotocols": ["backgammon.msgpack"]}
+        self.received = 0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_bytes(self, data):
+        self.received += 1
+
+    async def send_text(self, data):
+        self.received += 1
+
+
+async def measure(spectator_count: int):
+    manager = ConnectionManager(LocalEventBus())
+    await manager.start()
+    hub = SpectatorHub(manager, sample_interval=0)
+    match = Match(player1="alice", player2="bob", status="started", rounds_to_win=3, turn=5, dice=[3, 5])
+    players = [NullWebSocket(), NullWebSocket()]
+    await manager.connect(players[0], "alice")
+    await manager.connect(players[1], "bob")
+    spectators = [NullWebSocket() for _ in range(spectator_count)]
+    for i, websocket in enumerate(spectators):
+        await manager.connect(websocket, f"spectator{i}")
+        await hub.subscribe(match.id, websocket)
+
+    state = match.model_dump(by_alias=True)
+    player_latency = spectator_latency = 0.0
+    for run in range(RUNS):
+        match.turn += 1
+        previous, state = state, match.model_dump(by_alias=True)
+        payload = update_payload("move_piece", state, run + 1, diff_match(previous, state))
+        start = time.perf_counter()
+        await notify_players(manager, match, payload)
+        player_latency += time.perf_counter() - start
+        # notify_players publishes to the application hub, this one holds the benchmarked audience
+        await hub.publish(match.id, payload)
+        audience = hub.audiences.get(match.id)
+        if audience and audience.task:
+            await audience.task
+        spectator_latency += time.perf_counter() - start
+        encodings = len(payload.encoded)
+    await manager.stop()
+
+    print(f"{spectator_count} spectators: players {player_latency / RUNS * 1e3:.2f} ms, "
+          f"last spectator {spectator_latency / RUNS * 1e3:.2f} ms, {encodings} serialization(s) per event")
+
+
+def main():
+    asyncio.run(measure(0))
+    asyncio.run(measure(SPECTATORS))
+
+
+if __name__ == "__main__":
+    main()
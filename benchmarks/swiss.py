@@ -0,0 +1,31 @@
+'''
+    Measures the time to pair each round of a Swiss tournament of 1,000 players, with random results.
+
+    Usage: python -m benchmarks.swiss
+'''
+import random
+import time
+
+from services.swiss import BYE, swiss_pairings, swiss_rounds
+
+PARTICIPANTS = 1000
+
+
+def main():
+    rng = random.Random(0)
+    scores = [0] * PARTICIPANTS
+    rounds = []
+    for round_index in range(swiss_rounds(PARTICIPANTS)):
+        standings = sorted(range(PARTICIPANTS), key=lambda player: (-scores[player], player))
+        start = time.perf_counter()
+        pairings = swiss_pairings(standings, scores, rounds)
+        elapsed = time.perf_counter() - start
+        for i in range(0, len(pairings), 2):
+            player1, player2 = pairings[i], pairings[i + 1]
+            scores[player1 if player2 == BYE else rng.choice((player1, player2))] += 1
+        rounds.append(pairings)
+        print(f"round {round_index + 1}: {elapsed * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+'''
+    Compares the size and serialization time of a move event sent to both players of a match,
+    with the JSON encoding (serialized once per recipient before) and the MessagePack one.
+
+    Usage: python -m benchmarks.ws_encoding
+'''
+import json
+import time
+
+from models.board_configuration import Match
+from services.protocol import JSON, MSGPACK, Payload
+
+RUNS = 20000
+
+
+def move_event() -> dict:
+    match = Match(player1="alice", player2="bob", status="started", rounds_to_win=3, turn=5, dice=[3, 5])
+    return {"type": "move_piece", "match": match.dict(by_alias=True)}
+
+
+def measure(name, send):
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        size = send()
+    elapsed = (time.perf_counter() - start) / RUNS
+    print(f"{name}: {size} bytes per player, {elapsed * 1e6:.1f} us per event")
+
+
+def main():
+    event = move_event()
+    measure("json per recipient", lambda: [len(json.dumps(event, separators=(",", ":"))) for _ in range(2)][0])
+    measure("json shared", lambda: len(Payload(event).encode(JSON)))
+    measure("msgpack shared", lambda: len(Payload(event).encode(MSGPACK)))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,8 @@ load_dotenv()
 
 # MongoDB connection
 MONGODB_URL = os.getenv("MONGODB_URL")
+# Commit end-of-match writes in a transaction (requires a replica set)
+MONGODB_TRANSACTIONS = os.getenv("MONGODB_TRANSACTIONS", "false").lower() == "true"
 
 # OAuth2 setup
 SECRET_KEY = os.getenv("SECRET_KEY")
@@ -19,4 +21,29 @@ EMAIL_SUBJECT_PASSWORD_RESET = os.getenv("EMAIL_SUBJECT_PASSWORD_RESET")
 SITE_DOMAIN = os.getenv("SITE_DOMAIN")
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 TWITTER_CLIENT_ID = os.getenv("TWITTER_CLIENT_ID")
-TWITTER_CLIENT_SECRET = os.getenv("TWITTER_CLIENT_SECRET")
\ No newline at end of file
+TWITTER_CLIENT_SECRET = os.getenv("TWITTER_CLIENT_SECRET")
+
+# Leaderboard snapshot served to polling clients
+LEADERBOARD_SNAPSHOT_SIZE = int(os.getenv("LEADERBOARD_SNAPSHOT_SIZE", 100))
+LEADERBOARD_SNAPSHOT_INTERVAL = float(os.getenv("LEADERBOARD_SNAPSHOT_INTERVAL", 5))
+
+# Rating system used after each match: "elo" or "glicko2"
+RATING_SYSTEM = os.getenv("RATING_SYSTEM", "elo")
+# Length of a Glicko-2 rating period when ratings are recomputed from the match history
+RATING_PERIOD_DAYS = int(os.getenv("RATING_PERIOD_DAYS", 7))
+
+# Quick-play queue storage: "memory" (single worker) or "mongo" (shared by all the workers)
+MATCHMAKING_BACKEND = os.getenv("MATCHMAKING_BACKEND", "memory")
+# Delivery of websocket messages: "local" (single worker) or "mongo" (routed between workers, needs a replica set)
+EVENT_BUS = os.getenv("EVENT_BUS", "local")
+
+# Websocket heartbeat, for the clients that sent a ping: they are pinged every WS_PING_INTERVAL seconds, and closed
+# after WS_IDLE_TIMEOUT seconds of silence. Every socket also gets protocol-level pings at the same interval from
+# uvicorn, which closes it when the pong is late by WS_IDLE_TIMEOUT.
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", 20))
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", 60))
+
+# Spectators receive match events SPECTATOR_DELAY seconds late, and large audiences the latest state every
+# SPECTATOR_SAMPLE_INTERVAL seconds
+SPECTATOR_DELAY = float(os.getenv("SPECTATOR_DELAY", 0))
+SPECTATOR_SAMPLE_INTERVAL = float(os.getenv("SPECTATOR_SAMPLE_INTERVAL", 1))
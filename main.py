@@ -5,9 +5,13 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.websockets import WebSocket, WebSocketDisconnect
 
+from core.config import WS_IDLE_TIMEOUT, WS_PING_INTERVAL
 from middlewares.auth import AuthMiddleware
 from routes import routers
 from services.database import create_indexes, initialize_db_connection
+from services.leaderboard import leaderboard, start_leaderboard_snapshot
+from services.matchmaking import matchmaking_backend, start_matchmaking_sweeper
+from services.tournament import backfill_completed_games, backfill_tournament_slots
 from services.websocket import get_current_user, manager
 
 app = FastAPI()
@@ -26,8 +30,17 @@ async def lifespan(app: FastAPI):
     # Initialize the database connection
     initialize_db_connection()
     await create_indexes()
+    await backfill_tournament_slots()
+    await backfill_completed_games()
+    await leaderboard.load()
+    await manager.start()
+    snapshot_task = start_leaderboard_snapshot()
+    sweeper_task = start_matchmaking_sweeper()
     yield
     # Add any shutdown tasks here if needed
+    snapshot_task.cancel()
+    sweeper_task.cancel()
+    await manager.stop()
 
 
 app.router.lifespan_context = lifespan
@@ -44,11 +57,16 @@ async def websocket_endpoint(websocket: WebSocket, token: str):
     await manager.connect(websocket, username)
     try:
         while True:
-            data = await websocket.receive_text()
+            data = await manager.receive(websocket)
             await manager.handle_message(data, websocket, username)
     except WebSocketDisconnect:
-        manager.disconnect(websocket, username)
+        pass
+    finally:
+        await manager.disconnect(websocket, username)
+        if not await manager.is_online(username):
+            await matchmaking_backend.cancel(username)
 
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
+    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True, ws_ping_interval=WS_PING_INTERVAL,
+                ws_ping_timeout=WS_IDLE_TIMEOUT)
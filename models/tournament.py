@@ -1,7 +1,10 @@
 from pydantic import BaseModel, Field
-from typing import List
+from typing import Dict, List, Optional
 from services.database import default_id
 
+DEFAULT_TOURNAMENT_PARTICIPANTS = 4
+MAX_TOURNAMENT_PARTICIPANTS = 256
+
 
 class TournamentStats(BaseModel):
     username: str
@@ -22,6 +25,24 @@ class Tournament(BaseModel):
     status: str
     rounds_to_win: int
     stats: List[TournamentStats]
+    max_participants: int = DEFAULT_TOURNAMENT_PARTICIPANTS
+    # Maintained on join: the confirmed participants, and whether an open tournament has a free place
+    participant_count: int = 0
+    has_open_slot: bool = False
+    # Pairings per round, as the flat indices in confirmed_participants of the players of each match:
+    # [player1, player2, player1, player2, ...]. Fixed at start for a round robin, appended each round for a Swiss
+    # tournament, where a player sitting the round out is paired with -1
+    schedule: List[List[int]] = []
+    # Last round whose matches were created
+    round: int = 0
+    # Games recorded in the standings, and for a Swiss tournament the games of the rounds paired so far
+    completed_games: int = 0
+    scheduled_games: int = 0
+    # Elimination tournaments: the participants by seed, the slots of the bracket matches holding seeds (see
+    # services.bracket), and the bracket match of each created match
+    seeding: List[str] = []
+    bracket: List[Optional[int]] = []
+    bracket_matches: Dict[str, int] = {}
 
 class CreateTournamentRequest(BaseModel):
     name: str
@@ -29,6 +50,7 @@ class CreateTournamentRequest(BaseModel):
     open: bool
     rounds_to_win: int
     type: str
+    max_participants: int = Field(DEFAULT_TOURNAMENT_PARTICIPANTS, ge=2, le=MAX_TOURNAMENT_PARTICIPANTS)
 
 class JoinTournamentRequest(BaseModel):
     owner: str
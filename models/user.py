@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field, EmailStr
 from services.database import default_id
+from services.glicko import DEFAULT_RATING_DEVIATION, DEFAULT_VOLATILITY
 from services.rating import DEFAULT_RATING
 from typing import Optional
 
@@ -9,6 +10,8 @@ class UserInDB(BaseModel):
     email: EmailStr
     password: Optional[str] = None
     rating: int = DEFAULT_RATING
+    rating_deviation: float = DEFAULT_RATING_DEVIATION
+    volatility: float = DEFAULT_VOLATILITY
     stats: dict = { "matches_played": 0, "matches_won": 0, "tournaments_won": 0, "highest_rating": DEFAULT_RATING}
 
 class UserInLeaderboard(BaseModel):
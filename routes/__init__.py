@@ -3,5 +3,8 @@ from .users import router as users_router
 from .invites import router as invites_router
 from .game import router as game_router
 from .tournaments import router as tournaments_router
+from .matchmaking import router as matchmaking_router
+from .websocket import router as websocket_router
 
-routers = [auth_router, users_router, game_router, invites_router, tournaments_router]
\ No newline at end of file
+routers = [auth_router, users_router, game_router, invites_router, tournaments_router, matchmaking_router,
+           websocket_router]
\ No newline at end of file
@@ -11,6 +11,9 @@ from services.ai import is_ai
 from services.auth import get_password_hash, authenticate_user, create_access_token, get_user_by_email, \
     send_password_reset_email, create_reset_token, verify_reset_token, update_user_password
 from services.database import default_id, get_db
+from services.glicko import DEFAULT_RATING_DEVIATION, DEFAULT_VOLATILITY
+from services.leaderboard import leaderboard
+from services.user import normalize_username, invalidate_username_search
 
 router = APIRouter()
 
@@ -42,7 +45,10 @@ async def google_login(request: GoogleLoginRequest):
                 username = f"{base_username}{counter}"
                 counter += 1
             user = UserInDB(email=email, username=username, password=None).model_dump(by_alias=True)
+            user["username_lower"] = normalize_username(username)
             get_db().users.insert_one(user)
+            leaderboard.update(username, DEFAULT_RATING)
+            invalidate_username_search(username)
 
         access_token = create_access_token(data={"sub": user["username"]})
         return {"access_token": access_token, "username": user["username"]}
@@ -56,7 +62,10 @@ async def register_user(user: UserCreate):
     user_dict = user.dict(by_alias=True)
     user_dict["password"] = get_password_hash(user_dict.pop("password"))
     user_dict["_id"] = default_id()
+    user_dict["username_lower"] = normalize_username(user_dict["username"])
     user_dict["rating"] = DEFAULT_RATING
+    user_dict["rating_deviation"] = DEFAULT_RATING_DEVIATION
+    user_dict["volatility"] = DEFAULT_VOLATILITY
     user_dict["stats"] = {
         "matches_played": 0,
         "matches_won": 0,
@@ -77,6 +86,8 @@ async def register_user(user: UserCreate):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Username '{user_dict['username']}' or email '{user_dict['email']}' are already taken."
         )
+    leaderboard.update(user_dict["username"], DEFAULT_RATING)
+    invalidate_username_search(user_dict["username"])
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
@@ -60,12 +60,8 @@ async def create_invite_endpoint(request: CreateInviteRequest, token: str = Depe
 
 
 async def websocket_invite(user1, user):
-    inviter_websocket = await manager.get_user(user.username)
-    if inviter_websocket:
-        await manager.send_personal_message({"type": "invite-sent", "to": user1}, inviter_websocket)
-    invited_websocket = await manager.get_user(user1)
-    if invited_websocket:
-        await manager.send_personal_message({"type": "invite", "from": user.username}, invited_websocket)
+    await manager.send_to_user(user.username, {"type": "invite-sent", "to": user1})
+    await manager.send_to_user(user1, {"type": "invite", "from": user.username})
 
 
 @router.post("/invites/accept")
@@ -87,7 +83,5 @@ async def accept_invite_endpoint(request: AcceptInviteRequest, token: str = Depe
     if invite["player2"] != user.username:
         raise HTTPException(status_code=403, detail="You are not the recipient of this invite")
     await accept_invite(invite_id)
-    websocket = await manager.get_user(invite["player1"])
-    if websocket:
-        await manager.send_personal_message({"type": "invite-accepted", "from": user.username}, websocket)
+    await manager.send_to_user(invite["player1"], {"type": "invite-accepted", "from": user.username})
     return JSONResponse(status_code=200, content={"message": "Invite accepted successfully"})
@@ -0,0 +1,35 @@
+from fastapi import APIRouter, Depends, HTTPException
+from models.board_configuration import oauth2_scheme
+from services.auth import get_user_from_token
+from services.game import get_current_game
+from services.matchmaking import matchmaking_backend, start_quick_match
+
+router = APIRouter()
+
+
+@router.post("/matchmaking/queue")
+async def join_queue(token: str = Depends(oauth2_scheme)):
+    user = await get_user_from_token(token)
+    if await matchmaking_backend.is_queued(user.username):
+        raise HTTPException(status_code=400, detail="You are already in the queue")
+    if await get_current_game(user.username):
+        raise HTTPException(status_code=400, detail="You are already playing a match")
+
+    pair = await matchmaking_backend.enqueue(user.username, user.rating)
+    if pair is None:
+        return {"status": "queued"}
+    await start_quick_match(pair)
+    return {"status": "matched"}
+
+
+@router.delete("/matchmaking/queue")
+async def leave_queue(token: str = Depends(oauth2_scheme)):
+    user = await get_user_from_token(token)
+    if not await matchmaking_backend.cancel(user.username):
+        raise HTTPException(status_code=400, detail="You are not in the queue")
+    return {"status": "cancelled"}
+
+
+@router.get("/matchmaking/stats")
+async def queue_stats():
+    return await matchmaking_backend.stats()
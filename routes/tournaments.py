@@ -1,11 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
 from fastapi.responses import JSONResponse
 from services.auth import oauth2_scheme, get_user_from_token
 from models.tournament import CreateTournamentRequest, JoinTournamentRequest
-from services.tournament import get_current_tournament, get_available_tournaments, get_concluded_tournaments, create_new_tournament, get_tournament_id_from_owner_and_name, add_participant_to_tournament
+from services.tournament import get_current_tournament, get_concluded_tournaments, create_new_tournament, get_tournament_id_from_owner_and_name, add_participant_to_tournament
+from services.tournament_lobby import AVAILABLE_TOURNAMENTS_PAGE_SIZE, get_available_tournaments
 from routes.game import game_exists
 from fastapi.encoders import jsonable_encoder
 
+MAX_TOURNAMENTS_PAGE_SIZE = 200
+
 router = APIRouter()
 
 
@@ -55,9 +59,15 @@ async def concluded_tournaments(token: str = Depends(oauth2_scheme)):
 
 
 @router.get("/tournaments/available")
-async def available_tournaments(token: str = Depends(oauth2_scheme)):
+async def available_tournaments(after: Optional[str] = None,
+                                limit: int = Query(AVAILABLE_TOURNAMENTS_PAGE_SIZE, ge=1, le=MAX_TOURNAMENTS_PAGE_SIZE),
+                                token: str = Depends(oauth2_scheme)):
+    '''
+    Lists the pending tournaments the user can join, sorted by id. Pass the id of the last tournament received as
+    `after` to get the next page.
+    '''
     user = await get_user_from_token(token)
-    available_tournaments = await get_available_tournaments(user.username)
+    available_tournaments = await get_available_tournaments(user.username, after, limit)
     return [tournament.model_dump(by_alias=True) for tournament in available_tournaments]
 
 
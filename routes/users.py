@@ -1,14 +1,18 @@
-from typing import List
+from typing import List, Optional
 
 from core.config import SECRET_KEY, ALGORITHM
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Response, status
+from fastapi.responses import StreamingResponse
 from jose import JWTError, jwt
 from models.user import UserInDB, UserWithStats, UserOnline, UserInLeaderboard
 from pydantic import BaseModel
 from services.auth import get_user_from_token
 from services.auth import oauth2_scheme
 from services.database import get_db
-from services.user import get_all_users, get_all_users_leaderboard, get_user, get_usernames_starting_with
+from services.leaderboard import get_top_users, get_user_position, get_friends_leaderboard, leaderboard_snapshot
+from services.rating_history import get_rating_history
+from services.user import iter_users, iter_online_users, get_user, get_usernames_starting_with, batched, \
+    USER_BATCH_SIZE
 from services.websocket import manager
 
 router = APIRouter()
@@ -34,12 +38,30 @@ async def read_users_me(token: str = Depends(oauth2_scheme)):
     return UserWithStats(**user)
 
 
-@router.get("/users", response_model=list[UserOnline])
-async def get_users():
-    users = await get_all_users()
-    for user in users:
-        user.online = user.username in manager.online_users
-    return users
+@router.get("/users", responses={200: {"model": List[UserOnline]}})
+async def get_users(after: Optional[str] = None, limit: Optional[int] = Query(None, gt=0), online_only: bool = False):
+    '''
+    Streams users sorted by username. Pass the last username received as `after` to get the next page.
+    With `online_only` only the users connected to the websocket are listed.
+    '''
+    if online_only:
+        users = iter_online_users(manager.iter_online_usernames(after), limit)
+    else:
+        users = iter_users(after, limit)
+    return StreamingResponse(stream_users_json(users, online_only), media_type="application/json")
+
+
+async def stream_users_json(users, online_only: bool):
+    # The presence of each batch of users is looked up with the usernames of the batch only
+    separator = b""
+    yield b"["
+    async for batch in batched(users, USER_BATCH_SIZE):
+        online_usernames = None if online_only else await manager.online_among(user["username"] for user in batch)
+        for user in batch:
+            user_online = UserOnline(**user, online=online_only or user["username"] in online_usernames)
+            yield separator + user_online.model_dump_json(by_alias=True).encode()
+            separator = b","
+    yield b"]"
 
 
 @router.get("/users/search")
@@ -48,25 +70,30 @@ async def search_usernames(query: str):
     return usernames
 
 
+@router.get("/users/leaderboard")
+async def get_leaderboard(if_none_match: Optional[str] = Header(None)):
+    '''
+    Returns the top of the leaderboard (position, username, rating, highest_rating, matches_won).
+    Clients should send back the received ETag in If-None-Match: unchanged snapshots are answered with 304.
+    '''
+    body, etag = await leaderboard_snapshot.get()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 @router.get("/users/top5_and_me")
 async def get_top5_and_me(token: str = Depends(oauth2_scheme)):
     '''
     Returns data about the top 5 users (sorted by rating, descending) in the leaderboard + the user making the request. 
     The requester's data is ALWAYS the last element in the array.
     '''
-    username = (await get_user_from_token(token)).username
-    # Get top 5 users data, adding information about their position in the leaderboard we're creating
-    users = await get_all_users_leaderboard()
-    users = sorted(users, key=lambda u: u.rating, reverse=True)
-    my_position = [user for user in users if user.username == username][0].position
-    for user in users:
-        user.position = users.index(user) + 1  # Memorize for later, in case the user is not in the top 5
-        if user.username == username:
-            my_position = user.position
-    users = users[:5]
+    me = await get_user_from_token(token)
+    my_position = await get_user_position(me.username, me.rating)
+    users = await get_top_users(5)
 
     # Add info about the user making the request at the last position of the array
-    me = await get_user(username)
     users.append(UserInLeaderboard(**me.dict(), position=my_position))
 
     return users
@@ -78,28 +105,8 @@ class EmailList(BaseModel):
 
 @router.post("/users/top5_and_me_google")
 async def get_top5_and_me_google(email_list: EmailList, token: str = Depends(oauth2_scheme)):
-    my_user = (await get_user_from_token(token))
-    username = my_user.username
-    # Get all users data, adding information about their position in the leaderboard we're creating
-    users = await get_all_users_leaderboard()
-    users = sorted(users, key=lambda u: u.rating, reverse=True)
-
-    # Filter users by the provided emails
-    email_list.emails.append(my_user.email)
-    users = [user for user in users if user.email in email_list.emails]
-
-    my_position = [user for user in users if user.username == username][0].position
-    for user in users:
-        user.position = users.index(user) + 1  # Memorize for later, in case the user is not in the top 5
-        if user.username == username:
-            my_position = user.position
-    users = users[:5]
-
-    # Add info about the user making the request at the last position of the array
-    me = await get_user(username)
-    users.append(UserInLeaderboard(**me.dict(), position=my_position))
-
-    return users
+    me = await get_user_from_token(token)
+    return await get_friends_leaderboard(me, email_list.emails, 5)
 
 
 @router.get("/users/get_user_rating")
@@ -108,3 +115,11 @@ async def get_user_score(username: str):
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return user.rating
+
+
+@router.get("/users/rating_history")
+async def get_user_rating_history(username: str, points: int = Query(200, ge=1, le=1000)):
+    '''
+    Returns the rating curve of a user, downsampled server-side to at most `points` entries ordered by time.
+    '''
+    return await get_rating_history(username, points)
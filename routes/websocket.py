@@ -0,0 +1,13 @@
+from fastapi import APIRouter
+
+from services.websocket import manager
+
+router = APIRouter()
+
+
+@router.get("/ws/stats")
+async def websocket_stats():
+    '''
+    Connection-level counters of this worker: open sockets, messages and bytes in and out, send latency.
+    '''
+    return manager.stats()
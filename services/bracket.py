@@ -0,0 +1,164 @@
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+SINGLE_ELIMINATION = "single_elimination"
+DOUBLE_ELIMINATION = "double_elimination"
+
+# Value of an empty slot of the bracket, filled by a bye. Slots still waiting for a player are None.
+BYE = -1
+
+
+class BracketLayout:
+    '''
+        Shape of a bracket of size (a power of two) players, as matches numbered from 0 with two slots each.
+
+        The winners bracket is a heap: match 0 is its final, and match m is fed by matches 2m + 1 and 2m + 2, the
+        first round being the last size / 2 matches. A double elimination adds the losers bracket, where the losers
+        of each winners round drop, then the grand final and its reset, played when the losers bracket champion
+        wins the grand final.
+
+        winner_to[m] and loser_to[m] are the slots (2 * match + side) the players of match m move to, or None.
+    '''
+
+    __slots__ = ("size", "double", "winner_to", "loser_to", "grand_final")
+
+    def __init__(self, size: int, double: bool):
+        self.size = size
+        self.double = double
+        self.winner_to: List[Optional[int]] = [None if m == 0 else 2 * ((m - 1) // 2) + (m - 1) % 2
+                                               for m in range(size - 1)]
+        self.loser_to: List[Optional[int]] = [None] * (size - 1)
+        self.grand_final = None
+        if double:
+            self.build_losers_bracket()
+
+    def add_match(self) -> int:
+        self.winner_to.append(None)
+        self.loser_to.append(None)
+        return len(self.winner_to) - 1
+
+    def winners_round(self, round_index: int) -> List[int]:
+        '''
+            Matches of a winners bracket round (from 1), in bracket order.
+        '''
+
+        count = self.size >> round_index
+        return list(range(count - 1, 2 * count - 1))
+
+    def build_losers_bracket(self):
+        rounds = self.size.bit_length() - 1
+        self.grand_final = grand_final = self.add_match()
+        self.add_match()  # Reset of the grand final
+        self.winner_to[0] = 2 * grand_final
+        first_round = self.winners_round(1)
+        if rounds == 1:
+            self.loser_to[0] = 2 * grand_final + 1
+            return
+        previous = []
+        for j in range(len(first_round) // 2):
+            match = self.add_match()
+            self.loser_to[first_round[2 * j]] = 2 * match
+            self.loser_to[first_round[2 * j + 1]] = 2 * match + 1
+            previous.append(match)
+        for round_index in range(2, rounds + 1):
+            dropping = self.winners_round(round_index)
+            # Losers of every other round drop in reverse order, which delays rematches
+            if round_index % 2 == 0:
+                dropping.reverse()
+            major = []
+            for survivor, loser in zip(previous, dropping):
+                match = self.add_match()
+                self.winner_to[survivor] = 2 * match
+                self.loser_to[loser] = 2 * match + 1
+                major.append(match)
+            if round_index == rounds:
+                self.winner_to[major[0]] = 2 * grand_final + 1
+                return
+            previous = []
+            for j in range(len(major) // 2):
+                match = self.add_match()
+                self.winner_to[major[2 * j]] = 2 * match
+                self.winner_to[major[2 * j + 1]] = 2 * match + 1
+                previous.append(match)
+
+    @property
+    def match_count(self) -> int:
+        return len(self.winner_to)
+
+
+@lru_cache(maxsize=32)
+def bracket_layout(size: int, double: bool) -> BracketLayout:
+    return BracketLayout(size, double)
+
+
+def bracket_size(participant_count: int) -> int:
+    return 1 << max(participant_count - 1, 1).bit_length()
+
+
+def seed_order(size: int) -> List[int]:
+    '''
+        Seeds (from 0) in the order of the first round slots, so that seeds 0 and 1 can only meet in the final,
+        and the byes of a bracket that is not full go to the best seeds.
+    '''
+
+    order = [0]
+    while len(order) < size:
+        order = [seed for previous in order for seed in (previous, 2 * len(order) - 1 - previous)]
+    return order
+
+
+def advance(layout: BracketLayout, slots: List[Optional[int]], match: int,
+            winner: int) -> Tuple[Dict[int, int], Optional[int]]:
+    '''
+        Moves the players of a decided match to their next matches. Winning the grand final from the losers side
+        sends both players to its reset.
+
+        Returns:
+            (dict, int): The slot values to set, and the champion when the match was the last one.
+    '''
+
+    player1, player2 = slots[2 * match], slots[2 * match + 1]
+    loser = player2 if winner == player1 else player1
+    if match == layout.grand_final:
+        return ({2 * (match + 1): player1, 2 * (match + 1) + 1: player2}, None) if winner == player2 else ({}, winner)
+    if layout.winner_to[match] is None:
+        return {}, winner
+    writes = {layout.winner_to[match]: winner}
+    if layout.loser_to[match] is not None:
+        writes[layout.loser_to[match]] = loser
+    return writes, None
+
+
+def start_bracket(participant_count: int, double: bool) -> List[Optional[int]]:
+    '''
+        Places the participants, numbered by seed, in the first round of the bracket. The byes are then resolved
+        like any other written slot.
+    '''
+
+    size = bracket_size(participant_count)
+    slots: List[Optional[int]] = [None] * (2 * bracket_layout(size, double).match_count)
+    first_slot = 2 * (size // 2 - 1)
+    for i, seed in enumerate(seed_order(size)):
+        slots[first_slot + i] = seed if seed < participant_count else BYE
+    return slots
+
+
+def resolve(layout: BracketLayout, slots: List[Optional[int]], written) -> Tuple[Dict[int, int], List[int]]:
+    '''
+        Looks at the matches of the slots just written. A match against a bye is won without being played.
+
+        Returns:
+            (dict, list): The slot values set by the matches won against a bye, and the matches ready to be played.
+    '''
+
+    writes = {}
+    ready = []
+    for match in sorted({slot // 2 for slot in written}):
+        player1, player2 = slots[2 * match], slots[2 * match + 1]
+        if player1 is None or player2 is None:
+            continue
+        if player1 == BYE or player2 == BYE:
+            writes.update(advance(layout, slots, match, player2 if player1 == BYE else player1)[0])
+        else:
+            ready.append(match)
+    return writes, ready
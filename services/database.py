@@ -1,7 +1,25 @@
 from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import CollectionInvalid
 from core import config
 
+RATING_HISTORY_COLLECTION = "rating_history"
+MATCHMAKING_COLLECTION = "matchmaking_tickets"
+# Tickets not refreshed by a worker the player is connected to (players who never came back, or whose worker died)
+# are dropped after this many seconds
+MATCHMAKING_TICKET_TTL = 600
+PRESENCE_COLLECTION = "presence"
+# Users of a worker that stopped refreshing its presence are considered offline after this many seconds
+PRESENCE_TTL = 60
+# Topics the sockets of a worker subscribed to, refreshed and expired like the presence
+TOPIC_SUBSCRIPTIONS_COLLECTION = "topic_subscriptions"
+EVENTS_COLLECTION = "events"
+EVENTS_TTL = 60
+MATCH_EVENTS_COLLECTION = "match_events"
+# Logs of the matches without updates for this many seconds are dropped, their next update is sent as a snapshot
+MATCH_EVENTS_TTL = 3600
+
 def default_id():
     return str(ObjectId())
 
@@ -9,6 +27,36 @@ def default_id():
 async def create_indexes():
     await db.users.create_index("username", unique=True)
     await db.users.create_index("email", unique=True)
+    # Leaderboard queries sort users by descending rating, ties by username
+    await db.users.create_index([("rating", DESCENDING), ("username", ASCENDING)])
+    # Case-insensitive username search runs range queries on a lowercase copy of the username
+    await db.users.update_many({"username_lower": {"$exists": False}},
+                               [{"$set": {"username_lower": {"$toLower": "$username"}}}])
+    await db.users.create_index("username_lower")
+    # Finished matches are replayed in chronological order when ratings are recomputed
+    await db.matches.create_index([("status", ASCENDING), ("last_updated", ASCENDING)])
+    # Time-series collection: rating points are bucketed per username instead of stored one document each
+    if RATING_HISTORY_COLLECTION not in await db.list_collection_names():
+        try:
+            await db.create_collection(RATING_HISTORY_COLLECTION, timeseries={
+                "timeField": "timestamp", "metaField": "username", "granularity": "hours"})
+        except CollectionInvalid:
+            pass  # Created meanwhile by another worker
+    await db[RATING_HISTORY_COLLECTION].create_index([("username", ASCENDING), ("timestamp", ASCENDING)])
+    await db[MATCHMAKING_COLLECTION].create_index("created_at", expireAfterSeconds=MATCHMAKING_TICKET_TTL)
+    await db[MATCHMAKING_COLLECTION].create_index([("status", ASCENDING), ("rating", ASCENDING)])
+    await db[MATCHMAKING_COLLECTION].create_index([("status", ASCENDING), ("enqueued_at", ASCENDING)])
+    await db[PRESENCE_COLLECTION].create_index("updated_at", expireAfterSeconds=PRESENCE_TTL)
+    await db[PRESENCE_COLLECTION].create_index([("username", ASCENDING), ("worker", ASCENDING)], unique=True)
+    await db[PRESENCE_COLLECTION].create_index("worker")
+    await db[TOPIC_SUBSCRIPTIONS_COLLECTION].create_index("updated_at", expireAfterSeconds=PRESENCE_TTL)
+    await db[TOPIC_SUBSCRIPTIONS_COLLECTION].create_index([("topic", ASCENDING), ("worker", ASCENDING)], unique=True)
+    await db[TOPIC_SUBSCRIPTIONS_COLLECTION].create_index("worker")
+    await db[EVENTS_COLLECTION].create_index("created_at", expireAfterSeconds=EVENTS_TTL)
+    await db[MATCH_EVENTS_COLLECTION].create_index("updated_at", expireAfterSeconds=MATCH_EVENTS_TTL)
+    # Available tournaments: the pending ones the user is invited to, or open with a free place, paged by id
+    await db.tournaments.create_index([("participants", ASCENDING), ("status", ASCENDING), ("_id", ASCENDING)])
+    await db.tournaments.create_index([("status", ASCENDING), ("has_open_slot", ASCENDING), ("_id", ASCENDING)])
 
 # Initialize the database connection
 client = None
@@ -21,4 +69,7 @@ def initialize_db_connection():
     print("Database connection initialized.")
 
 def get_db():
-    return db
\ No newline at end of file
+    return db
+
+def get_client():
+    return client
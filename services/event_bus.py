@@ -0,0 +1,328 @@
+import asyncio
+import uuid
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+
+from core.config import EVENT_BUS
+from services.database import EVENTS_COLLECTION, PRESENCE_COLLECTION, TOPIC_SUBSCRIPTIONS_COLLECTION, get_db
+from services.protocol import Payload, as_payload
+
+# Called with the username, or the topic, and the message to deliver to the sockets of this worker
+Deliver = Callable[[str, dict], Awaitable[None]]
+
+# Recipient fields of a message: a user, or a topic the sockets of the workers subscribe to
+USER = "username"
+TOPIC = "topic"
+
+# Messages published within this window are sent to each destination worker in one document
+BATCH_WINDOW = 0.005
+MAX_BATCH_SIZE = 500
+# Presence of the users of a worker is refreshed at this interval, see PRESENCE_TTL in services/database.py
+PRESENCE_REFRESH_INTERVAL = 20
+# Delays in seconds before watching the events collection again after the change stream failed, doubled each attempt
+CONSUME_RETRY_DELAY = 0.5
+MAX_CONSUME_RETRY_DELAY = 30
+
+
+class EventBus(ABC):
+    '''
+        Routes the messages addressed to a user to the worker holding their websocket, and shares which users are
+        online between the workers. Messages published on a topic reach every worker subscribed to it.
+    '''
+
+    @abstractmethod
+    async def start(self, deliver: Deliver, deliver_topic: Deliver):
+        pass
+
+    async def stop(self):
+        pass
+
+    @abstractmethod
+    async def publish(self, username: str, message: dict):
+        pass
+
+    @abstractmethod
+    async def publish_topic(self, topic: str, message: dict):
+        pass
+
+    @abstractmethod
+    async def subscribe(self, topic: str):
+        pass
+
+    @abstractmethod
+    async def unsubscribe(self, topic: str):
+        pass
+
+    @abstractmethod
+    async def set_online(self, username: str):
+        pass
+
+    @abstractmethod
+    async def set_offline(self, username: str):
+        pass
+
+    @abstractmethod
+    async def is_online(self, username: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def online_usernames(self) -> List[str]:
+        pass
+
+    @abstractmethod
+    async def online_among(self, usernames: Iterable[str]) -> Set[str]:
+        pass
+
+    @abstractmethod
+    def iter_online_usernames(self, after: Optional[str] = None) -> AsyncIterator[str]:
+        '''
+            Yields the online usernames in order, from the one after the given username.
+        '''
+
+
+class LocalEventBus(EventBus):
+    '''
+        Single worker bus: every connected user is local, messages are delivered directly.
+    '''
+
+    def __init__(self):
+        self.deliver: Optional[Deliver] = None
+        self.deliver_topic: Optional[Deliver] = None
+        self.online: Set[str] = set()
+        self.topics: Set[str] = set()
+
+    async def start(self, deliver: Deliver, deliver_topic: Deliver):
+        self.deliver = deliver
+        self.deliver_topic = deliver_topic
+
+    async def publish(self, username: str, message: dict):
+        if username in self.online:
+            await self.deliver(username, message)
+
+    async def publish_topic(self, topic: str, message: dict):
+        if topic in self.topics:
+            await self.deliver_topic(topic, message)
+
+    async def subscribe(self, topic: str):
+        self.topics.add(topic)
+
+    async def unsubscribe(self, topic: str):
+        self.topics.discard(topic)
+
+    async def set_online(self, username: str):
+        self.online.add(username)
+
+    async def set_offline(self, username: str):
+        self.online.discard(username)
+
+    async def is_online(self, username: str) -> bool:
+        return username in self.online
+
+    async def online_usernames(self) -> List[str]:
+        return list(self.online)
+
+    async def online_among(self, usernames: Iterable[str]) -> Set[str]:
+        return self.online.intersection(usernames)
+
+    async def iter_online_usernames(self, after: Optional[str] = None) -> AsyncIterator[str]:
+        for username in sorted(self.online):
+            if after is None or username > after:
+                yield username
+
+
+class MongoEventBus(EventBus):
+    '''
+        Bus shared by the workers through MongoDB.
+
+        The presence collection holds one document per online user and worker holding one of their websockets, the
+        topic subscriptions collection one per topic and subscribed worker. Messages are delivered directly to the
+        sockets of this worker, and buffered for BATCH_WINDOW for the other workers of their user or topic, then
+        written as one document per destination worker in the events collection, which every worker tails with a
+        change stream filtered on its own id. Change streams need a replica set, a single-node one is enough to run
+        it locally.
+    '''
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex
+        self.deliver: Optional[Deliver] = None
+        self.deliver_topic: Optional[Deliver] = None
+        self.local: Set[str] = set()
+        self.topics: Set[str] = set()
+        self.pending: List[tuple] = []
+        self.pending_event: Optional[asyncio.Event] = None
+        self.tasks: List[asyncio.Task] = []
+
+    async def start(self, deliver: Deliver, deliver_topic: Deliver):
+        self.deliver = deliver
+        self.deliver_topic = deliver_topic
+        self.pending_event = asyncio.Event()
+        ready = asyncio.get_running_loop().create_future()
+        self.tasks = [asyncio.create_task(self.consume(ready)), asyncio.create_task(self.flush_pending()),
+                      asyncio.create_task(self.refresh_presence())]
+        await ready
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        if self.local:
+            await get_db()[PRESENCE_COLLECTION].delete_many({"worker": self.worker_id})
+        if self.topics:
+            await get_db()[TOPIC_SUBSCRIPTIONS_COLLECTION].delete_many({"worker": self.worker_id})
+
+    async def publish(self, username: str, message: dict):
+        delivered = username in self.local
+        if delivered:
+            await self.deliver(username, message)
+        # The user may also be connected to other workers, the batched presence lookup finds them, and writes nothing
+        # when this worker holds all their sockets
+        self.pending.append((USER, username, message, delivered))
+        self.pending_event.set()
+
+    async def publish_topic(self, topic: str, message: dict):
+        delivered = topic in self.topics
+        if delivered:
+            await self.deliver_topic(topic, message)
+        self.pending.append((TOPIC, topic, message, delivered))
+        self.pending_event.set()
+
+    async def subscribe(self, topic: str):
+        self.topics.add(topic)
+        await get_db()[TOPIC_SUBSCRIPTIONS_COLLECTION].update_one(
+            {"topic": topic, "worker": self.worker_id},
+            {"$set": {"updated_at": datetime.now(timezone.utc)}}, upsert=True)
+
+    async def unsubscribe(self, topic: str):
+        self.topics.discard(topic)
+        await get_db()[TOPIC_SUBSCRIPTIONS_COLLECTION].delete_one({"topic": topic, "worker": self.worker_id})
+
+    async def set_online(self, username: str):
+        self.local.add(username)
+        await get_db()[PRESENCE_COLLECTION].update_one(
+            {"username": username, "worker": self.worker_id},
+            {"$set": {"updated_at": datetime.now(timezone.utc)}}, upsert=True)
+
+    async def set_offline(self, username: str):
+        self.local.discard(username)
+        await get_db()[PRESENCE_COLLECTION].delete_one({"username": username, "worker": self.worker_id})
+
+    async def is_online(self, username: str) -> bool:
+        if username in self.local:
+            return True
+        return await get_db()[PRESENCE_COLLECTION].count_documents({"username": username}, limit=1) > 0
+
+    async def online_usernames(self) -> List[str]:
+        return await get_db()[PRESENCE_COLLECTION].distinct("username")
+
+    async def online_among(self, usernames: Iterable[str]) -> Set[str]:
+        usernames = set(usernames)
+        online = usernames & self.local
+        remote = list(usernames - online)
+        if remote:
+            online.update(await get_db()[PRESENCE_COLLECTION].distinct("username", {"username": {"$in": remote}}))
+        return online
+
+    async def iter_online_usernames(self, after: Optional[str] = None) -> AsyncIterator[str]:
+        # Served by the (username, worker) index, a user connected to several workers is listed once
+        query = {"username": {"$gt": after}} if after else {}
+        last = None
+        async for presence in get_db()[PRESENCE_COLLECTION].find(query, {"_id": 0, "username": 1}) \
+                .sort("username", ASCENDING):
+            if presence["username"] != last:
+                last = presence["username"]
+                yield last
+
+    async def flush_pending(self):
+        while True:
+            await self.pending_event.wait()
+            await asyncio.sleep(BATCH_WINDOW)
+            self.pending_event.clear()
+            batch, self.pending = self.pending[:MAX_BATCH_SIZE], self.pending[MAX_BATCH_SIZE:]
+            if self.pending:
+                self.pending_event.set()
+            try:
+                await self.send_batch(batch)
+            except Exception as error:
+                print(f"Event bus flush failed: {error}")
+
+    async def send_batch(self, batch: List[tuple]):
+        workers: Dict[tuple, List[str]] = defaultdict(list)
+        for field, collection in ((USER, PRESENCE_COLLECTION), (TOPIC, TOPIC_SUBSCRIPTIONS_COLLECTION)):
+            keys = list({key for recipient, key, _, _ in batch if recipient == field})
+            if not keys:
+                continue
+            async for document in get_db()[collection].find({field: {"$in": keys}}, {"_id": 0, field: 1, "worker": 1}):
+                workers[field, document[field]].append(document["worker"])
+        by_worker: Dict[str, list] = defaultdict(list)
+        for field, key, message, delivered in batch:
+            for worker in workers.get((field, key), ()):
+                if worker != self.worker_id:
+                    by_worker[worker].append({field: key, "payload": as_payload(message).to_document()})
+                elif not delivered:
+                    # Connected or subscribed here since the message was published
+                    await self.deliver_local(field, key, message)
+        if by_worker:
+            created_at = datetime.now(timezone.utc)
+            await get_db()[EVENTS_COLLECTION].insert_many(
+                [{"worker": worker, "messages": messages, "created_at": created_at}
+                 for worker, messages in by_worker.items()], ordered=False)
+
+    async def deliver_local(self, field: str, key: str, message: dict):
+        if field == TOPIC:
+            await self.deliver_topic(key, message)
+        else:
+            await self.deliver(key, message)
+
+    async def consume(self, ready: asyncio.Future):
+        pipeline = [{"$match": {"operationType": "insert", "fullDocument.worker": self.worker_id}}]
+        resume_token = None
+        backoff = CONSUME_RETRY_DELAY
+        while True:
+            try:
+                async with get_db()[EVENTS_COLLECTION].watch(pipeline, resume_after=resume_token) as stream:
+                    if not ready.done():
+                        ready.set_result(None)
+                    backoff = CONSUME_RETRY_DELAY
+                    resume_token = stream.resume_token
+                    async for change in stream:
+                        for event in change["fullDocument"]["messages"]:
+                            field = TOPIC if TOPIC in event else USER
+                            try:
+                                await self.deliver_local(field, event[field], Payload.from_document(event["payload"]))
+                            except Exception as error:
+                                print(f"Event delivery to {event[field]} failed: {error}")
+                        resume_token = stream.resume_token
+                    # Closed by the server, after an invalidate event
+                    resume_token = None
+            except Exception as error:
+                if not ready.done():
+                    ready.set_exception(error)
+                    return
+                print(f"Event bus change stream failed, reconnecting in {backoff}s: {error}")
+                if isinstance(error, OperationFailure):
+                    # The token may not be resumable anymore (history lost): the stream restarts from now
+                    resume_token = None
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, MAX_CONSUME_RETRY_DELAY)
+
+    async def refresh_presence(self):
+        while True:
+            await asyncio.sleep(PRESENCE_REFRESH_INTERVAL)
+            for collection, keys in ((PRESENCE_COLLECTION, self.local), (TOPIC_SUBSCRIPTIONS_COLLECTION, self.topics)):
+                if not keys:
+                    continue
+                try:
+                    await get_db()[collection].update_many(
+                        {"worker": self.worker_id}, {"$set": {"updated_at": datetime.now(timezone.utc)}})
+                except Exception as error:
+                    print(f"Presence refresh failed: {error}")
+
+
+def create_event_bus(name: str = EVENT_BUS) -> EventBus:
+    if name == "mongo":
+        return MongoEventBus()
+    return LocalEventBus()
@@ -1,12 +1,22 @@
+import asyncio
 import random
 from datetime import datetime, timedelta
 from time import strptime
+from typing import List, Tuple, Union
 
+from core.config import RATING_SYSTEM, MONGODB_TRANSACTIONS
 from models.board_configuration import Match, BoardConfiguration, StartDice, DoublingCube
+from pymongo import UpdateOne
 from services.ai import ai_names, ai_rating
 from services.board import is_gammon, is_backgammon
-from services.database import get_db
+from services.database import get_client, get_db
+from services.leaderboard import leaderboard, leaderboard_snapshot
+from services.glicko import new_glicko_ratings_after_match, DEFAULT_RATING_DEVIATION, DEFAULT_VOLATILITY, \
+    AI_RATING_DEVIATION
 from services.rating import new_ratings_after_match
+from services.protocol import Payload, as_payload
+from services.rating_history import record_rating_changes
+from services.spectators import spectators
 from services.websocket import ConnectionManager
 
 
@@ -35,6 +45,15 @@ async def create_started_match(player1: str, player2: str, rounds_to_win: int =
     new_match = Match(player1=player1, player2=player2, status="started", rounds_to_win=rounds_to_win)
     match_data = new_match.dict(by_alias=True)
     await get_db().matches.insert_one(match_data)
+    return new_match
+
+
+async def create_started_matches(pairs: List[Tuple[str, str]], rounds_to_win: int = 1) -> List[Match]:
+    new_matches = [Match(player1=player1, player2=player2, status="started", rounds_to_win=rounds_to_win)
+                   for player1, player2 in pairs]
+    if new_matches:
+        await get_db().matches.insert_many([new_match.model_dump(by_alias=True) for new_match in new_matches])
+    return new_matches
 
 
 async def check_timeout_condition(match: Match):
@@ -77,10 +96,9 @@ async def check_winner(current_game: Match, manager: ConnectionManager, winner:i
         winner = check_win_condition(current_game)
         winner = winner.get("winner")
 
-    p1_data, p2_data = await get_players_data(current_game)
-
     # Check if someone won the current round
     if winner != 0:
+        p1_data, p2_data = await get_players_data(current_game)
         loser_username, old_loser_rating, old_winner_rating, winner_username, gained_points = await update_rating(
             current_game,
             p1_data, p2_data,
@@ -90,11 +108,13 @@ async def check_winner(current_game: Match, manager: ConnectionManager, winner:i
         if current_game.winsP1 >= current_game.rounds_to_win or current_game.winsP2 >= current_game.rounds_to_win:
             current_game.doublingCube.proposed = False
             current_game.doublingCube.proposer = 0
+            # Also writes the final state of the match
             await update_on_match_win(current_game, loser_username, manager, old_loser_rating, old_winner_rating,
-                                      winner, winner_username)
+                                      winner, winner_username, p1_data, p2_data)
 
             from services.tournament import update_tournament_of_game
             await update_tournament_of_game(current_game, winner_username, loser_username, gained_points)
+            return
         else:
             # Message for round end (gammon/backgammon/normal win)
             info_str = get_winning_info_str(current_game, winner) if not is_timeout else " due to timeout"
@@ -106,19 +126,21 @@ async def check_winner(current_game: Match, manager: ConnectionManager, winner:i
             # Message for round end
             await notify_players_of_round_end(manager, current_game, winner_username, info_str)
 
-    current_game = game_fields_to_dict(current_game)
+    await update_match({"_id": current_game.id}, {"$set": match_state_fields(current_game)})
+
 
-    await update_match({"_id": current_game.id},
-                       {"$set": {"board_configuration": current_game.board_configuration,
-                                 "status": current_game.status,
-                                 "available": current_game.available,
-                                 "dice": current_game.dice,
-                                 "turn": current_game.turn,
-                                 "startDice": current_game.startDice,
-                                 "doublingCube": current_game.doublingCube,
-                                 "winsP1": current_game.winsP1,
-                                 "winsP2": current_game.winsP2,
-                                 "ai_suggestions": current_game.ai_suggestions}})
+def match_state_fields(current_game: Match) -> dict:
+    current_game = game_fields_to_dict(current_game)
+    return {"board_configuration": current_game.board_configuration,
+            "status": current_game.status,
+            "available": current_game.available,
+            "dice": current_game.dice,
+            "turn": current_game.turn,
+            "startDice": current_game.startDice,
+            "doublingCube": current_game.doublingCube,
+            "winsP1": current_game.winsP1,
+            "winsP2": current_game.winsP2,
+            "ai_suggestions": current_game.ai_suggestions}
 
 
 def reset_match_for_new_tournament(match: Match, winner_username: str):
@@ -133,29 +155,31 @@ def reset_match_for_new_tournament(match: Match, winner_username: str):
     return match
 
 
+async def notify_players(manager: ConnectionManager, current_game: Match, message: Union[dict, Payload]):
+    payload = as_payload(message)
+    await asyncio.gather(manager.send_to_user(current_game.player1, payload),
+                         manager.send_to_user(current_game.player2, payload),
+                         spectators.publish(current_game.id, payload))
+
+
 async def notify_players_of_round_end(manager: ConnectionManager, current_game: Match, winner_username: str, info_str: str):
-    websocket_player1 = await manager.get_user(current_game.player1)
-    if websocket_player1:
-        await manager.send_personal_message({"type": "round_over", "winner": winner_username, "info": info_str}, websocket_player1)
-    
-    websocket_player2 = await manager.get_user(current_game.player2)
-    if websocket_player2:
-        await manager.send_personal_message({"type": "round_over", "winner": winner_username, "info": info_str}, websocket_player2)
+    await notify_players(manager, current_game, {"type": "round_over", "winner": winner_username, "info": info_str})
 
 
 async def get_players_data(current_game):
-    p1_data = await get_db().users.find_one({
-        "username": current_game.player1
-    }) or {}
-    p2_data = await get_db().users.find_one({
-        "username": current_game.player2
-    }) or {}
+    users = await get_db().users.find(
+        {"username": {"$in": [current_game.player1, current_game.player2]}}).to_list(length=None)
+    users_by_name = {user["username"]: user for user in users}
+    p1_data = users_by_name.get(current_game.player1, {})
+    p2_data = users_by_name.get(current_game.player2, {})
     if current_game.player2 in ai_names:
         p2_data["username"] = current_game.player2
         p2_data["rating"] = ai_rating[ai_names.index(current_game.player2)]
+        p2_data["rating_deviation"] = AI_RATING_DEVIATION
     elif current_game.player1 in ai_names:
         p1_data["username"] = current_game.player1
         p1_data["rating"] = ai_rating[ai_names.index(current_game.player1)]
+        p1_data["rating_deviation"] = AI_RATING_DEVIATION
     return p1_data, p2_data
 
 
@@ -229,47 +253,73 @@ def get_winning_info_str(current_game: Match, winner: int):
         return ""
 
 
+def ratings_after_match(winner_data: dict, loser_data: dict):
+    if RATING_SYSTEM == "glicko2":
+        winner_values, loser_values = new_glicko_ratings_after_match(
+            glicko_values(winner_data), glicko_values(loser_data),
+            winner_fixed=winner_data["username"] in ai_names, loser_fixed=loser_data["username"] in ai_names)
+        return ({"rating": winner_values[0], "rating_deviation": winner_values[1], "volatility": winner_values[2]},
+                {"rating": loser_values[0], "rating_deviation": loser_values[1], "volatility": loser_values[2]})
+
+    new_winner_rating, new_loser_rating = new_ratings_after_match(winner_data["rating"], loser_data["rating"])
+    return {"rating": new_winner_rating}, {"rating": new_loser_rating}
+
+
+def glicko_values(player_data: dict):
+    return (player_data["rating"], player_data.get("rating_deviation", DEFAULT_RATING_DEVIATION),
+            player_data.get("volatility", DEFAULT_VOLATILITY))
+
+
 async def update_on_match_win(current_game, loser_username, manager, old_loser_rating, old_winner_rating, winner,
-                              winner_username):
+                              winner_username, p1_data, p2_data):
     current_game.status = "player_" + str(winner) + "_won"
 
-    await get_db().matches.update_one({"_id": current_game.id},
-                                      {"$set": {"status": current_game.status}}
-                                      )
-    
     # Logic for player ratings & stats update and match end
-    (new_winner_rating, new_loser_rating) = new_ratings_after_match(old_winner_rating, old_loser_rating)
-    await get_db().users.update_one(
-        {"username": winner_username},
-        {"$set": {"rating": new_winner_rating}, "$inc": {"stats.matches_played": 1, "stats.matches_won": 1}}
-    )
-    await get_db().users.update_one(
-        {"username": loser_username},
-        {"$set": {"rating": new_loser_rating}, "$inc": {"stats.matches_played": 1}}
-    )
-    
-    #Update highest rating for winner if applicable
-    if(winner_username not in ai_names):
-        winner_data = await get_db().users.find_one({"username": winner_username})
-        winner_highest_rating = winner_data.get("stats", {}).get("highest_rating", 1500) # Default value is provided solely for the sake of test users
-        if new_winner_rating > winner_highest_rating:
-            await get_db().users.update_one({"username": winner_username},
-                                            {"$set": {"stats.highest_rating": new_winner_rating}})
+    winner_update, loser_update = ratings_after_match(*((p1_data, p2_data) if winner == 1 else (p2_data, p1_data)))
+    new_winner_rating, new_loser_rating = winner_update["rating"], loser_update["rating"]
+    user_updates = [
+        UpdateOne({"username": winner_username},
+                  {"$set": winner_update, "$inc": {"stats.matches_played": 1, "stats.matches_won": 1},
+                   "$max": {"stats.highest_rating": new_winner_rating}}),
+        UpdateOne({"username": loser_username},
+                  {"$set": loser_update, "$inc": {"stats.matches_played": 1}}),
+    ]
+    match_update = {"$set": {**match_state_fields(current_game),
+                             "last_updated": datetime.now().replace(microsecond=0).isoformat()}}
+    rating_changes = [(username, rating) for username, rating in
+                      ((winner_username, new_winner_rating), (loser_username, new_loser_rating))
+                      if username not in ai_names]
+    await commit_match_end(current_game.id, match_update, user_updates, rating_changes)
+
+    for username, rating in rating_changes:
+        leaderboard.update(username, rating)
+    leaderboard_snapshot.mark_stale()
 
     # Message for match end, US #103
-    websocket_player1 = await manager.get_user(current_game.player1)
-    if websocket_player1:
-        await manager.send_personal_message(
-            {"type": "match_over", "winner": winner_username, "loser": loser_username,
-             "old_winner_rating": old_winner_rating, "new_winner_rating": new_winner_rating,
-             "old_loser_rating": old_loser_rating, "new_loser_rating": new_loser_rating},
-            websocket_player1)
-    websocket_player2 = await manager.get_user(current_game.player2)
-    if websocket_player2:
-        await manager.send_personal_message(
-            {"type": "match_over", "winner": winner_username, "loser": loser_username,
-             "old_winner_rating": old_winner_rating, "new_winner_rating": new_winner_rating,
-             "old_loser_rating": old_loser_rating, "new_loser_rating": new_loser_rating}, websocket_player2)
+    await notify_players(manager, current_game, {
+        "type": "match_over", "winner": winner_username, "loser": loser_username,
+        "old_winner_rating": old_winner_rating, "new_winner_rating": new_winner_rating,
+        "old_loser_rating": old_loser_rating, "new_loser_rating": new_loser_rating})
+
+
+async def commit_match_end(match_id: str, match_update: dict, user_updates: list, rating_changes: list):
+    '''
+        Writes the end of a match: final match state and both players' ratings and stats.
+
+        With MONGODB_TRANSACTIONS the match and user writes are committed atomically (replica set required),
+        otherwise the independent writes are sent concurrently so the whole commit costs one round trip of latency.
+        Rating history goes to a time-series collection, which cannot be written inside a transaction.
+    '''
+    if MONGODB_TRANSACTIONS:
+        async with await get_client().start_session() as session:
+            async with session.start_transaction():
+                await get_db().matches.update_one({"_id": match_id}, match_update, session=session)
+                await get_db().users.bulk_write(user_updates, ordered=False, session=session)
+        await record_rating_changes(rating_changes)
+    else:
+        await asyncio.gather(get_db().matches.update_one({"_id": match_id}, match_update),
+                             get_db().users.bulk_write(user_updates, ordered=False),
+                             record_rating_changes(rating_changes))
 
 
 async def quit_the_game(current_game: Match, manager, winner):
@@ -289,10 +339,12 @@ async def quit_the_game(current_game: Match, manager, winner):
             winner)
 
     if current_game.winsP1 == current_game.rounds_to_win or current_game.winsP2 == current_game.rounds_to_win:
+        # Also writes the final state of the match
         await update_on_match_win(current_game, loser_username, manager, old_loser_rating, old_winner_rating,
-                                  winner, winner_username)
+                                  winner, winner_username, p1_data, p2_data)
         from services.tournament import update_tournament_of_game
         await update_tournament_of_game(current_game, winner_username, loser_username, gained_points)
+        return
 
     await get_db().matches.update_one({"_id": current_game.id},
                                       {"$set": {"board_configuration": current_game.board_configuration,
@@ -0,0 +1,320 @@
+from typing import Optional
+
+from fastapi import HTTPException, WebSocket
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, ValidationError
+
+from models.board_configuration import BoardConfiguration, Match
+from services.ai import ai_names
+from services.database import get_db
+from services.game import throw_dice, get_current_game, check_winner, quit_the_game, check_timeout_condition, \
+    update_match, notify_players
+from services.match_events import match_events
+from services.websocket import manager
+
+NOT_YOUR_TURN = "It's not your turn"
+
+NO_ONGOING_GAME_FOUND = "No ongoing game found"
+
+
+class MoveCommand(BaseModel):
+    board: BoardConfiguration
+    dice: Optional[int] = None
+
+
+class InGameMessageCommand(BaseModel):
+    msg: str
+
+
+def game_command(command_type: str, model: type = None):
+    '''
+        Registers a game action as a websocket command.
+
+        Commands are {"type": ..., "id": ..., **fields}. The fields are validated with the given model, then the action
+        runs for the user authenticated when the socket connected. The reply is {"type": "ack", "id": ...}, or
+        {"type": "error", "id": ..., "status": ..., "msg": ...} with the error the HTTP endpoint would have returned,
+        status 500 for unexpected failures, which leave the socket open.
+    '''
+
+    def register(action):
+        @manager.on(command_type)
+        async def handle(message: dict, websocket: WebSocket, username: str):
+            reply = {"id": message["id"]} if "id" in message else {}
+            try:
+                if model is None:
+                    await action(username)
+                else:
+                    fields = model.model_validate(message).model_dump()
+                    await action(username, *fields.values())
+            except ValidationError as error:
+                reply.update(type="error", status=422, msg=error.errors(include_url=False, include_context=False))
+            except HTTPException as error:
+                reply.update(type="error", status=error.status_code, msg=error.detail)
+            except Exception as error:
+                print(f"Command {command_type} of {username} failed: {error!r}")
+                reply.update(type="error", status=500, msg="Internal server error")
+            else:
+                reply.update(type="ack", command=command_type)
+            await manager.send_personal_message(reply, websocket)
+
+        return action
+
+    return register
+
+
+async def get_started_game(username: str) -> Match:
+    current_game = await get_current_game(username)
+    if not current_game or current_game.status != "started":
+        raise HTTPException(status_code=400, detail=NO_ONGOING_GAME_FOUND)
+    return current_game
+
+
+def is_turn_of(current_game: Match, username: str) -> bool:
+    return (current_game.turn % 2 == 0 and current_game.player1 == username) or \
+        (current_game.turn % 2 == 1 and current_game.player2 == username)
+
+
+async def get_game_on_turn(username: str) -> Match:
+    current_game = await get_started_game(username)
+    if not is_turn_of(current_game, username) or current_game.doublingCube.proposed:
+        raise HTTPException(status_code=400, detail=NOT_YOUR_TURN)
+    return current_game
+
+
+@game_command("move", MoveCommand)
+async def move_piece(username: str, board: dict, dice: Optional[int]):
+    current_game = await get_game_on_turn(username)
+
+    current_game.board_configuration = board
+    if dice in current_game.available:
+        current_game.available.remove(dice)
+
+    if len(current_game.available) <= 0:
+        current_game.turn += 1
+        current_game.dice = []
+        current_game.available = []
+
+    await check_winner(current_game, manager)
+
+    await update_match({"_id": current_game.id}, {
+        "$set": {"board_configuration": current_game.board_configuration, "available": current_game.available,
+                 "dice": current_game.dice,
+                 "turn": current_game.turn}})
+
+    await notify_players(manager, current_game, await match_events.update("move_piece", current_game))
+
+
+async def move_ai(username: str, board: dict):
+    current_game = await get_started_game(username)
+
+    if current_game.player1 not in ai_names and current_game.player2 not in ai_names:
+        raise HTTPException(status_code=400, detail=NOT_YOUR_TURN)
+
+    current_game.board_configuration = board
+
+    current_game.turn += 1
+    current_game.dice = []
+    current_game.available = []
+
+    await check_winner(current_game, manager)
+
+    await update_match({"_id": current_game.id}, {
+        "$set": {"board_configuration": current_game.board_configuration, "available": current_game.available,
+                 "dice": current_game.dice,
+                 "turn": current_game.turn}})
+
+    await notify_players(manager, current_game, await match_events.update("move_piece", current_game))
+
+
+@game_command("throw_start_dice")
+async def throw_start_dice(username: str):
+    current_game = await get_current_game(username)
+
+    if not current_game or current_game.status != "started":
+        raise HTTPException(status_code=400, detail="No pending game found")
+
+    if current_game.starter > 0:
+        raise HTTPException(status_code=400, detail="Start dice already thrown")
+
+    is_player1 = current_game.player1 == username
+    old_start_dice = current_game.startDice
+    if is_player1 and old_start_dice.count1 > old_start_dice.count2 or \
+            not is_player1 and old_start_dice.count2 > old_start_dice.count1:
+        raise HTTPException(status_code=400, detail="You have already thrown the start dice. Wait for the other player")
+
+    result = throw_dice()
+    starter, turn, old_start_dice = await get_dices(current_game, is_player1, old_start_dice, result)
+
+    await update_match({"_id": current_game.id},
+                       {"$set": {"startDice": jsonable_encoder(old_start_dice), "starter": starter, "turn": turn}})
+    await notify_players(manager, current_game, {"type": "start_dice_roll", "result": jsonable_encoder(old_start_dice),
+                                                 "starter": starter, "turn": turn})
+
+
+async def get_dices(current_game, is_player1, old_start_dice, result):
+    if is_player1:
+        old_start_dice.roll1, old_start_dice.count1 = result[0], old_start_dice.count1 + 1
+        if current_game.player2 in ai_names:
+            old_start_dice.roll2, old_start_dice.count2 = result[1], old_start_dice.count2 + 1
+    else:
+        old_start_dice.roll2, old_start_dice.count2 = result[0], old_start_dice.count2 + 1
+        if current_game.player1 in ai_names:
+            old_start_dice.roll1, old_start_dice.count1 = result[1], old_start_dice.count1 + 1
+
+    starter, turn = 0, -1
+    if old_start_dice.count1 == old_start_dice.count2:
+        if old_start_dice.roll1 > old_start_dice.roll2:
+            starter, turn = 1, 0
+        elif old_start_dice.roll2 > old_start_dice.roll1:
+            starter, turn = 2, 1
+    return starter, turn, old_start_dice
+
+
+@game_command("throw_dice")
+async def roll_dice(username: str):
+    current_game = await get_game_on_turn(username)
+
+    if current_game.dice:
+        raise HTTPException(status_code=400, detail="Dice already thrown")
+
+    result = throw_dice()
+    current_game.dice = result
+    if result[0] == result[1]:
+        current_game.available = [result[0]] * 4
+    else:
+        current_game.available = result
+
+    await update_match({"_id": current_game.id},
+                       {"$set": {"dice": result, "available": current_game.available}})
+    await notify_players(manager, current_game,
+                         {"type": "dice_roll", "result": result, "available": current_game.available})
+
+
+@game_command("in_game_msg", InGameMessageCommand)
+async def send_in_game_message(username: str, message: str):
+    current_game = await get_started_game(username)
+    await notify_players(manager, current_game, {"type": "in_game_msg", "msg": message, "user": username})
+
+
+@game_command("pass_turn")
+async def pass_turn(username: str):
+    current_game = await get_game_on_turn(username)
+
+    current_game.turn += 1
+    current_game.dice = []
+    current_game.available = []
+
+    await update_match({"_id": current_game.id}, {
+        "$set": {"dice": current_game.dice, "available": current_game.available, "turn": current_game.turn}})
+
+    await send_move_with_ws(current_game)
+
+
+async def send_move_with_ws(current_game):
+    await notify_players(manager, current_game, await match_events.update("pass_turn", current_game))
+
+
+@game_command("request_timeout")
+async def request_timeout(username: str):
+    current_game = await get_started_game(username)
+
+    if is_turn_of(current_game, username):
+        raise HTTPException(status_code=400, detail="It's not your opponent's turn")
+
+    is_timeout = await check_timeout_condition(current_game)
+
+    if not is_timeout:
+        raise HTTPException(status_code=400, detail="Timeout condition not met")
+    else:
+        await check_winner(current_game, manager, is_timeout=True)
+
+    new_current_game = await get_db().matches.find_one({"_id": current_game.id})
+    await send_move_with_ws(Match(**new_current_game))
+
+
+@game_command("ai_suggestion")
+async def use_ai_suggestion(username: str):
+    current_game = await get_started_game(username)
+
+    if not is_turn_of(current_game, username):
+        raise HTTPException(status_code=400, detail=NOT_YOUR_TURN)
+
+    is_player_1 = current_game.player1 == username
+    if current_game.ai_suggestions[is_player_1] >= 3:
+        raise HTTPException(status_code=400, detail="You have already used all your suggestions")
+
+    current_game.ai_suggestions[is_player_1] += 1
+
+    await get_db().matches.update_one({"_id": current_game.id}, {
+        "$set": {"ai_suggestions": current_game.ai_suggestions}})
+
+
+@game_command("quit")
+async def quit_game(username: str):
+    current_game = await get_started_game(username)
+
+    if current_game.player1 == username:
+        winner = 2
+    else:
+        winner = 1
+
+    await quit_the_game(current_game, manager, winner)
+
+    await notify_players(manager, current_game,
+                         await match_events.update("quit_game", current_game, winner=winner, user=username))
+
+
+@game_command("double_propose")
+async def propose_double(username: str):
+    current_game = await get_started_game(username)
+    player_number = 1 if current_game.player1 == username else 2
+
+    if not is_turn_of(current_game, username):
+        raise HTTPException(status_code=400, detail=NOT_YOUR_TURN)
+
+    if current_game.doublingCube.proposed or current_game.doublingCube.last_usage == player_number:
+        raise HTTPException(status_code=400, detail="Doubling already proposed or cube in posses of the other player")
+
+    if current_game.doublingCube.count >= 3:
+        raise HTTPException(status_code=400, detail="Doubling cube already reached maximum value")
+
+    current_game.doublingCube.proposed = True
+    current_game.doublingCube.proposer = player_number
+
+    await get_db().matches.update_one({"_id": current_game.id}, {
+        "$set": {"doublingCube": current_game.doublingCube.model_dump(by_alias=True)}})
+
+    await notify_players(manager, current_game, await match_events.update("double_proposed", current_game))
+
+
+@game_command("double_accept")
+async def accept_double(username: str):
+    current_game = await get_started_game(username)
+    player_number = 1 if current_game.player1 == username else 2
+
+    if not current_game.doublingCube.proposed or current_game.doublingCube.proposer == player_number:
+        raise HTTPException(status_code=400, detail="No doubling cube proposed to you")
+
+    current_game.doublingCube.count += 1
+    current_game.doublingCube.proposed = False
+    current_game.doublingCube.last_usage = current_game.doublingCube.proposer
+    current_game.doublingCube.proposer = 0
+
+    await get_db().matches.update_one({"_id": current_game.id}, {
+        "$set": {"doublingCube": current_game.doublingCube.model_dump(by_alias=True)}})
+
+    await notify_players(manager, current_game, await match_events.update("double_accepted", current_game))
+
+
+@game_command("double_reject")
+async def reject_double(username: str):
+    current_game = await get_started_game(username)
+    player_number = 1 if current_game.player1 == username else 2
+
+    if not current_game.doublingCube.proposed or current_game.doublingCube.proposer == player_number:
+        raise HTTPException(status_code=400, detail="No doubling cube proposed to you")
+
+    winner = 1 if player_number == 2 else 2
+    await check_winner(current_game, manager, winner=winner)
+
+    await notify_players(manager, current_game, await match_events.update("double_rejected", current_game))
@@ -0,0 +1,116 @@
+import math
+from typing import Tuple
+
+import numpy as np
+
+from services.rating import DEFAULT_RATING, MINIMUM_RATING
+
+DEFAULT_RATING_DEVIATION = 350.0
+DEFAULT_VOLATILITY = 0.06
+# AI strength is a hand-picked number, so AI opponents are treated as loosely calibrated
+AI_RATING_DEVIATION = 150.0
+TAU = 0.5
+GLICKO_SCALE = 173.7178
+CONVERGENCE_TOLERANCE = 1e-6
+
+
+def g(phi: np.ndarray) -> np.ndarray:
+    return 1 / np.sqrt(1 + 3 * phi ** 2 / math.pi ** 2)
+
+
+def new_volatilities(phi: np.ndarray, sigma: np.ndarray, v: np.ndarray, delta: np.ndarray) -> np.ndarray:
+    '''
+        Solves for the new volatility of every player at once (step 5 of Glickman's Glicko-2 paper),
+        running the Illinois algorithm on all the players that have not converged yet.
+    '''
+
+    a = np.log(sigma ** 2)
+
+    def f(x, active):
+        exp_x = np.exp(x)
+        return exp_x * (delta[active] ** 2 - phi[active] ** 2 - v[active] - exp_x) / \
+            (2 * (phi[active] ** 2 + v[active] + exp_x) ** 2) - (x - a[active]) / TAU ** 2
+
+    everyone = np.ones(len(a), dtype=bool)
+    big_delta = delta ** 2 > phi ** 2 + v
+    upper = np.where(big_delta, np.log(np.where(big_delta, delta ** 2 - phi ** 2 - v, 1)), a - TAU)
+    below = ~big_delta & (f(upper, everyone) < 0)
+    while below.any():
+        upper[below] -= TAU
+        below[below] = f(upper[below], below) < 0
+
+    lower, f_lower, f_upper = a.copy(), f(a, everyone), f(upper, everyone)
+    active = np.abs(upper - lower) > CONVERGENCE_TOLERANCE
+    while active.any():
+        low, high, f_low, f_high = lower[active], upper[active], f_lower[active], f_upper[active]
+        middle = low + (low - high) * f_low / (f_high - f_low)
+        f_middle = f(middle, active)
+        crossed = f_middle * f_high <= 0
+        lower[active] = np.where(crossed, high, low)
+        f_lower[active] = np.where(crossed, f_high, f_low / 2)
+        upper[active], f_upper[active] = middle, f_middle
+        active = np.abs(upper - lower) > CONVERGENCE_TOLERANCE
+
+    return np.exp(lower / 2)
+
+
+def rating_period_update(ratings: np.ndarray, deviations: np.ndarray, volatilities: np.ndarray,
+                         players: np.ndarray, opponents: np.ndarray, scores: np.ndarray, fixed: np.ndarray):
+    '''
+        Applies one Glicko-2 rating period to every player, vectorized over the games of the period.
+
+        Args:
+            ratings (np.ndarray): Rating of every player. Updated in place.
+            deviations (np.ndarray): Rating deviation of every player. Updated in place.
+            volatilities (np.ndarray): Volatility of every player. Updated in place.
+            players (np.ndarray): Player index of each game result, one row per player per match.
+            opponents (np.ndarray): Opponent index of each game result.
+            scores (np.ndarray): 1 for a win, 0 for a loss.
+            fixed (np.ndarray): Boolean mask of the players whose values never change (AI opponents).
+    '''
+
+    mu = (ratings - DEFAULT_RATING) / GLICKO_SCALE
+    phi = deviations / GLICKO_SCALE
+
+    g_opponent = g(phi[opponents])
+    expected = 1 / (1 + np.exp(-g_opponent * (mu[players] - mu[opponents])))
+    count = len(ratings)
+    played = np.bincount(players, minlength=count) > 0
+    inverse_v = np.bincount(players, weights=g_opponent ** 2 * expected * (1 - expected), minlength=count)
+    improvement = np.bincount(players, weights=g_opponent * (scores - expected), minlength=count)
+
+    # Players without games only see their deviation grow (step 6 applied to the untouched rating)
+    idle = ~played & ~fixed
+    deviations[idle] = np.minimum(np.sqrt(phi[idle] ** 2 + volatilities[idle] ** 2) * GLICKO_SCALE,
+                                  DEFAULT_RATING_DEVIATION)
+
+    update = played & ~fixed
+    v = 1 / inverse_v[update]
+    delta = v * improvement[update]
+    sigma = new_volatilities(phi[update], volatilities[update], v, delta)
+    phi_star = np.sqrt(phi[update] ** 2 + sigma ** 2)
+    new_phi = 1 / np.sqrt(1 / phi_star ** 2 + 1 / v)
+    new_mu = mu[update] + new_phi ** 2 * improvement[update]
+
+    ratings[update] = np.maximum(new_mu * GLICKO_SCALE + DEFAULT_RATING, MINIMUM_RATING)
+    deviations[update] = new_phi * GLICKO_SCALE
+    volatilities[update] = sigma
+
+
+def new_glicko_ratings_after_match(winner: Tuple[float, float, float], loser: Tuple[float, float, float],
+                                   winner_fixed: bool = False, loser_fixed: bool = False):
+    '''
+        Online update for a single match, treated as a rating period of one game for both players.
+
+        Args:
+            winner (tuple): (rating, rating deviation, volatility) of the winner.
+            loser (tuple): (rating, rating deviation, volatility) of the loser.
+        Returns:
+            (tuple, tuple): The new (rating, rating deviation, volatility) of the winner and of the loser.
+    '''
+
+    ratings, deviations, volatilities = (np.array(values, dtype=np.float64) for values in zip(winner, loser))
+    rating_period_update(ratings, deviations, volatilities, np.array([0, 1]), np.array([1, 0]),
+                         np.array([1.0, 0.0]), np.array([winner_fixed, loser_fixed]))
+    return ((int(round(ratings[0])), float(deviations[0]), float(volatilities[0])),
+            (int(round(ratings[1])), float(deviations[1]), float(volatilities[1])))
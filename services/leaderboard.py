@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import heapq
+import json
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Tuple
+
+from cachetools import TTLCache
+from core.config import LEADERBOARD_SNAPSHOT_SIZE, LEADERBOARD_SNAPSHOT_INTERVAL
+from models.user import UserInDB, UserInLeaderboard
+from pymongo import ASCENDING, DESCENDING
+from services.database import get_db
+from services.rating import DEFAULT_RATING
+
+LEADERBOARD_PROJECTION = {"_id": 1, "username": 1, "email": 1, "rating": 1}
+SNAPSHOT_PROJECTION = {"_id": 0, "username": 1, "rating": 1, "stats.highest_rating": 1, "stats.matches_won": 1}
+# Minimum delay between two refreshes triggered by rating changes, so bursts of finished matches coalesce
+SNAPSHOT_MIN_REFRESH_DELAY = 1
+FRIENDS_QUERY_CHUNK_SIZE = 1000
+
+# Keyed by (username, hash of the contact set)
+friends_leaderboard_cache = TTLCache(maxsize=1024, ttl=10)
+
+
+class Leaderboard:
+    '''
+        In-memory order-statistic index of user ratings.
+
+        Entries are kept in a sorted array of (-rating, username) tuples, so the position of a user
+        is a binary search (O(log n)) and the top-K users are a slice of the array.
+        Ties on rating are broken by username.
+    '''
+
+    def __init__(self):
+        self.ratings: Dict[str, int] = {}
+        self.ranking: List[Tuple[int, str]] = []
+        self.loaded = False
+
+    async def load(self):
+        ratings = {}
+        async for user in get_db().users.find({}, {"_id": 0, "username": 1, "rating": 1}):
+            ratings[user["username"]] = user.get("rating", DEFAULT_RATING)
+        self.ratings = ratings
+        self.ranking = sorted((-rating, username) for username, rating in ratings.items())
+        self.loaded = True
+
+    async def ensure_loaded(self):
+        if not self.loaded:
+            await self.load()
+
+    def update(self, username: str, rating: int):
+        if not self.loaded:
+            return
+        old_rating = self.ratings.get(username)
+        if old_rating == rating:
+            return
+        if old_rating is not None:
+            del self.ranking[bisect_left(self.ranking, (-old_rating, username))]
+        self.ratings[username] = rating
+        insort(self.ranking, (-rating, username))
+
+    def position(self, username: str) -> int:
+        rating = self.ratings.get(username)
+        if rating is None:
+            return 0
+        return bisect_left(self.ranking, (-rating, username)) + 1
+
+    def top(self, k: int) -> List[str]:
+        return [username for _, username in self.ranking[:k]]
+
+
+class LeaderboardSnapshot:
+    '''
+        Pre-serialized top-N leaderboard, rebuilt in the background every few seconds and after rating changes.
+        Polls are answered with the cached bytes and its ETag without touching the database.
+    '''
+
+    def __init__(self, size: int):
+        self.size = size
+        self.current: Optional[Tuple[bytes, str]] = None
+        self.stale: Optional[asyncio.Event] = None
+
+    async def refresh(self):
+        users = await get_db().users.find({}, SNAPSHOT_PROJECTION) \
+            .sort([("rating", DESCENDING), ("username", ASCENDING)]).limit(self.size).to_list(length=None)
+        entries = [{
+            "position": position,
+            "username": user["username"],
+            "rating": user.get("rating", DEFAULT_RATING),
+            "highest_rating": user.get("stats", {}).get("highest_rating", DEFAULT_RATING),
+            "matches_won": user.get("stats", {}).get("matches_won", 0),
+        } for position, user in enumerate(users, start=1)]
+        body = json.dumps(entries, separators=(",", ":")).encode()
+        # Body and ETag are swapped in together so readers never see a mismatched pair
+        self.current = (body, f'"{hashlib.sha1(body).hexdigest()}"')
+
+    async def get(self) -> Tuple[bytes, str]:
+        if self.current is None:
+            await self.refresh()
+        return self.current
+
+    def mark_stale(self):
+        if self.stale is not None:
+            self.stale.set()
+
+    async def run(self, interval: float):
+        self.stale = asyncio.Event()
+        while True:
+            try:
+                await self.refresh()
+            except Exception as error:
+                print(f"Leaderboard snapshot refresh failed: {error}")
+            try:
+                await asyncio.wait_for(self.stale.wait(), timeout=interval)
+                await asyncio.sleep(SNAPSHOT_MIN_REFRESH_DELAY)
+            except asyncio.TimeoutError:
+                pass
+            self.stale.clear()
+
+
+leaderboard = Leaderboard()
+leaderboard_snapshot = LeaderboardSnapshot(LEADERBOARD_SNAPSHOT_SIZE)
+
+
+def start_leaderboard_snapshot() -> asyncio.Task:
+    return asyncio.create_task(leaderboard_snapshot.run(LEADERBOARD_SNAPSHOT_INTERVAL))
+
+
+async def get_top_users(k: int) -> List[UserInLeaderboard]:
+    await leaderboard.ensure_loaded()
+    usernames = leaderboard.top(k)
+    users = await get_db().users.find({"username": {"$in": usernames}}, LEADERBOARD_PROJECTION).to_list(length=None)
+    users_by_name = {user["username"]: user for user in users}
+    return [UserInLeaderboard(**users_by_name[username], position=position)
+            for position, username in enumerate(usernames, start=1) if username in users_by_name]
+
+
+async def get_user_position(username: str, rating: int) -> int:
+    await leaderboard.ensure_loaded()
+    # Keeps the index correct for users created or updated by another worker
+    leaderboard.update(username, rating)
+    return leaderboard.position(username)
+
+
+def leaderboard_order(user: dict):
+    return -user.get("rating", DEFAULT_RATING), user["username"]
+
+
+async def find_users_by_email(emails: List[str]) -> List[dict]:
+    return await get_db().users.find({"email": {"$in": emails}}, LEADERBOARD_PROJECTION) \
+        .sort([("rating", DESCENDING), ("username", ASCENDING)]).to_list(length=None)
+
+
+async def get_friends_leaderboard(me: UserInDB, emails: List[str], k: int) -> List[UserInLeaderboard]:
+    '''
+        Returns the top k users among the given e-mail contacts (plus the requester), followed by the requester.
+
+        Large contact lists are split in chunks of indexed $in queries, each sorted by rating, and the sorted
+        chunks are merged so positions are computed in a single pass.
+    '''
+    contacts = sorted(set(emails) | {me.email})
+    cache_key = (me.username, hashlib.sha1("\n".join(contacts).encode()).hexdigest())
+    cached = friends_leaderboard_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    chunks = await asyncio.gather(*(find_users_by_email(contacts[start:start + FRIENDS_QUERY_CHUNK_SIZE])
+                                    for start in range(0, len(contacts), FRIENDS_QUERY_CHUNK_SIZE)))
+    users, my_position = [], 0
+    for position, user in enumerate(heapq.merge(*chunks, key=leaderboard_order), start=1):
+        if position <= k:
+            users.append(UserInLeaderboard(**user, position=position))
+        if user["username"] == me.username:
+            my_position = position
+        if my_position and position >= k:
+            break
+
+    users.append(UserInLeaderboard(**me.dict(), position=my_position))
+    friends_leaderboard_cache[cache_key] = users
+    return users
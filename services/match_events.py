@@ -0,0 +1,142 @@
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from fastapi import WebSocket
+from pymongo import ReturnDocument
+
+from models.board_configuration import Match
+from services.database import MATCH_EVENTS_COLLECTION, get_db
+from services.protocol import Payload
+from services.websocket import manager
+
+# Versions kept per match for clients catching up after a gap, changes are None for the versions sent as snapshots
+HISTORY_SIZE = 64
+
+
+def diff_board(old: dict, new: dict) -> Optional[dict]:
+    changes = {}
+    points = [[index, point["player1"], point["player2"]]
+              for index, (old_point, point) in enumerate(zip(old["points"], new["points"])) if old_point != point]
+    if points:
+        changes["points"] = points
+    if old["bar"] != new["bar"]:
+        changes["bar"] = new["bar"]
+    return changes or None
+
+
+def diff_match(old: dict, new: dict) -> dict:
+    '''
+        Returns the fields of the match that changed, the board as a list of [index, player1, player2] changed points.
+    '''
+
+    changes = {}
+    for field, value in new.items():
+        if old.get(field) == value:
+            continue
+        if field == "board_configuration":
+            board_changes = diff_board(old[field], value)
+            if board_changes:
+                changes[field] = board_changes
+        else:
+            changes[field] = value
+    return changes
+
+
+class MatchEvents:
+    '''
+        Versions the match updates sent to the players.
+
+        Every update gets the next version of its match, and is sent both as the whole match and as the changes
+        since the previous version. Clients receiving deltas apply them in order and send a resync request when
+        they notice a gap. The log is shared by the workers in the match events collection: the version is
+        incremented and the state replaced in one atomic update, which returns the state the changes are computed
+        from, whichever worker sent it. A match without updates for MATCH_EVENTS_TTL is forgotten, and starts again from a
+        snapshot, which clients take as a new baseline.
+    '''
+
+    @staticmethod
+    def collection():
+        return get_db()[MATCH_EVENTS_COLLECTION]
+
+    async def record(self, match: dict) -> Tuple[int, Optional[dict]]:
+        previous = await self.collection().find_one_and_update(
+            {"_id": match["_id"]},
+            {"$inc": {"version": 1}, "$set": {"state": match, "updated_at": datetime.now(timezone.utc)}},
+            projection={"version": 1, "state": 1}, upsert=True, return_document=ReturnDocument.BEFORE)
+        if previous is None:
+            version, changes = 1, None
+        else:
+            version, changes = previous["version"] + 1, diff_match(previous["state"], match)
+        # Sorted by version: the updates of two workers can be pushed out of order
+        await self.collection().update_one({"_id": match["_id"]}, {"$push": {"history": {
+            "$each": [{"version": version, "changes": changes}], "$sort": {"version": 1}, "$slice": -HISTORY_SIZE}}})
+        return version, changes
+
+    async def log(self, match_id: str) -> Optional[dict]:
+        return await self.collection().find_one({"_id": match_id})
+
+    async def snapshot(self, match_id: str) -> Optional[Tuple[int, dict]]:
+        log = await self.collection().find_one({"_id": match_id}, {"version": 1, "state": 1})
+        return (log["version"], log["state"]) if log else None
+
+    async def update(self, event_type: str, match: Match, **fields) -> Payload:
+        '''
+            Builds the update message of a match, in full and as a delta.
+        '''
+
+        state = match.model_dump(by_alias=True)
+        version, changes = await self.record(state)
+        return update_payload(event_type, state, version, changes, **fields)
+
+
+def changes_since(log: Optional[dict], version: int) -> Optional[List[dict]]:
+    '''
+        Returns the changes of the versions of a log after the given one, or None when they are not all in its history.
+    '''
+
+    if log is None or version > log["version"]:
+        return None
+    events = [event for event in log.get("history", ()) if event["version"] > version]
+    if [event["version"] for event in events] != list(range(version + 1, log["version"] + 1)):
+        return None
+    if any(event["changes"] is None for event in events):
+        return None
+    return events
+
+
+def update_payload(event_type: str, state: dict, version: int, changes: Optional[dict], **fields) -> Payload:
+    header = {"type": event_type, **fields, "match_id": state["_id"], "version": version}
+    message = {**header, "match": state}
+    return Payload(message, None if changes is None else {**header, "changes": changes})
+
+
+match_events = MatchEvents()
+
+
+@manager.on("resync")
+async def resync(message: dict, websocket: WebSocket, username: str):
+    '''
+        Answers {"type": "resync", "match_id": ..., "version": last version received} with the missed changes, or
+        with the current match when they are no longer available. Open to the players and the spectators of the match.
+    '''
+
+    match_id = message.get("match_id")
+    version = message.get("version")
+    log = await match_events.log(match_id)
+    if log is None:
+        match = await get_db().matches.find_one({"_id": match_id})
+        current_version, state = 0, Match(**match).model_dump(by_alias=True) if match else None
+    else:
+        current_version, state = log["version"], log["state"]
+    connection = manager.active_connections.get(websocket)
+    watching = connection is not None and connection.watching == match_id
+    if state is None or not watching and username not in (state["player1"], state["player2"]):
+        await manager.send_personal_message({"type": "error", "msg": "Match not found"}, websocket)
+        return
+
+    events = changes_since(log, version) if isinstance(version, int) else None
+    if events is None:
+        reply = {"type": "resync", "match_id": match_id, "version": current_version, "match": state}
+    else:
+        reply = {"type": "resync", "match_id": match_id, "version": current_version, "events": events}
+    await manager.send_personal_message(reply, websocket)
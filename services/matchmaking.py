@@ -0,0 +1,378 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from core.config import MATCHMAKING_BACKEND
+from services.database import MATCHMAKING_COLLECTION, get_db
+from services.game import create_started_match
+from services.websocket import manager
+
+RATING_BAND_WIDTH = 50
+# A new ticket looks for opponents in its own band and the neighbouring ones
+INITIAL_SEARCH_BANDS = 1
+# The search widens by one band on each side every WIDEN_INTERVAL seconds of waiting
+WIDEN_INTERVAL = 5
+MAX_SEARCH_BANDS = 20
+SWEEP_INTERVAL = 1
+QUICK_PLAY_ROUNDS_TO_WIN = 1
+# Tickets claimed by a worker that died before pairing or releasing them become waiting again after this delay
+CLAIM_TIMEOUT = 30
+SWEEP_BATCH_SIZE = 100
+# The tickets of the players still connected are kept from expiring at this interval, see MATCHMAKING_TICKET_TTL
+TICKET_REFRESH_INTERVAL = 60
+
+
+class Ticket:
+    __slots__ = ("username", "rating", "enqueued_at", "searched_bands")
+
+    def __init__(self, username: str, rating: int, enqueued_at: float):
+        self.username = username
+        self.rating = rating
+        self.enqueued_at = enqueued_at
+        self.searched_bands = -1
+
+    @property
+    def band(self) -> int:
+        return self.rating // RATING_BAND_WIDTH
+
+    def search_bands(self, now: float) -> int:
+        return min(INITIAL_SEARCH_BANDS + int((now - self.enqueued_at) // WIDEN_INTERVAL), MAX_SEARCH_BANDS)
+
+
+class MatchmakingQueue:
+    '''
+        Quick-play queue bucketed by rating band.
+
+        Waiting tickets are kept per band in insertion order, and the non-empty bands in a sorted list, so finding
+        the bands within reach of a rating is a binary search and only the oldest ticket of each band is compared.
+    '''
+
+    def __init__(self):
+        self.bands: Dict[int, OrderedDict] = {}
+        self.band_keys: List[int] = []
+        self.tickets: Dict[str, Ticket] = {}
+        self.matches_made = 0
+        self.total_matched_wait = 0.0
+
+    def __contains__(self, username: str) -> bool:
+        return username in self.tickets
+
+    def enqueue(self, username: str, rating: int, now: Optional[float] = None) -> Optional[Tuple[Ticket, Ticket]]:
+        '''
+            Adds a player to the queue, or pairs them straight away with a waiting opponent.
+
+            Returns:
+                (Ticket, Ticket): The waiting opponent and the new ticket when a pair is found, None otherwise.
+        '''
+
+        now = time.monotonic() if now is None else now
+        ticket = Ticket(username, rating, now)
+        opponent = self.find_opponent(ticket, ticket.search_bands(now))
+        if opponent is not None:
+            return self.pair(opponent, ticket, now)
+        self.add(ticket)
+        return None
+
+    def cancel(self, username: str) -> bool:
+        ticket = self.tickets.pop(username, None)
+        if ticket is None:
+            return False
+        band = self.bands[ticket.band]
+        del band[username]
+        if not band:
+            del self.bands[ticket.band]
+            del self.band_keys[bisect_left(self.band_keys, ticket.band)]
+        return True
+
+    def sweep(self, now: Optional[float] = None) -> List[Tuple[Ticket, Ticket]]:
+        '''
+            Retries the waiting tickets whose search range widened since their last attempt, oldest first.
+        '''
+
+        now = time.monotonic() if now is None else now
+        pairs = []
+        # Tickets are stored in enqueue order
+        for ticket in list(self.tickets.values()):
+            if ticket.username not in self.tickets:
+                continue  # Paired earlier in this sweep
+            search_bands = ticket.search_bands(now)
+            if search_bands <= ticket.searched_bands:
+                continue
+            ticket.searched_bands = search_bands
+            opponent = self.find_opponent(ticket, search_bands)
+            if opponent is not None:
+                pairs.append(self.pair(ticket, opponent, now))
+        return pairs
+
+    def find_opponent(self, ticket: Ticket, search_bands: int) -> Optional[Ticket]:
+        start = bisect_left(self.band_keys, ticket.band - search_bands)
+        end = bisect_right(self.band_keys, ticket.band + search_bands)
+        best = None
+        for key in self.band_keys[start:end]:
+            for candidate in self.bands[key].values():
+                if candidate.username != ticket.username:
+                    if best is None or abs(candidate.rating - ticket.rating) < abs(best.rating - ticket.rating):
+                        best = candidate
+                    break
+        return best
+
+    def add(self, ticket: Ticket):
+        ticket.searched_bands = ticket.search_bands(ticket.enqueued_at)
+        self.tickets[ticket.username] = ticket
+        band = self.bands.get(ticket.band)
+        if band is None:
+            band = self.bands[ticket.band] = OrderedDict()
+            insort(self.band_keys, ticket.band)
+        band[ticket.username] = ticket
+
+    def pair(self, waiting: Ticket, other: Ticket, now: float) -> Tuple[Ticket, Ticket]:
+        self.cancel(waiting.username)
+        self.cancel(other.username)
+        self.matches_made += 1
+        self.total_matched_wait += (now - waiting.enqueued_at) + (now - other.enqueued_at)
+        return waiting, other
+
+    def stats(self, now: Optional[float] = None) -> dict:
+        now = time.monotonic() if now is None else now
+        return {
+            "queue_depth": len(self.tickets),
+            "bands": {key * RATING_BAND_WIDTH: len(self.bands[key]) for key in self.band_keys},
+            "longest_wait": max((now - ticket.enqueued_at for ticket in self.tickets.values()), default=0),
+            "matches_made": self.matches_made,
+            "average_wait": self.total_matched_wait / (2 * self.matches_made) if self.matches_made else 0,
+        }
+
+
+class MatchmakingBackend(ABC):
+    '''
+        Storage of the quick-play tickets. The in-memory backend only pairs players connected to the same worker,
+        the Mongo backend shares the queue between all the workers.
+    '''
+
+    @abstractmethod
+    async def enqueue(self, username: str, rating: int) -> Optional[Tuple[Ticket, Ticket]]:
+        pass
+
+    @abstractmethod
+    async def cancel(self, username: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def is_queued(self, username: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def sweep(self) -> List[Tuple[Ticket, Ticket]]:
+        pass
+
+    @abstractmethod
+    async def stats(self) -> dict:
+        pass
+
+    async def refresh(self, usernames: Iterable[str]):
+        '''
+            Keeps the tickets of the given players, still connected, from expiring.
+        '''
+
+        pass
+
+
+class InMemoryMatchmakingBackend(MatchmakingBackend):
+    def __init__(self, queue: MatchmakingQueue):
+        self.queue = queue
+
+    async def enqueue(self, username: str, rating: int) -> Optional[Tuple[Ticket, Ticket]]:
+        return self.queue.enqueue(username, rating)
+
+    async def cancel(self, username: str) -> bool:
+        return self.queue.cancel(username)
+
+    async def is_queued(self, username: str) -> bool:
+        return username in self.queue
+
+    async def sweep(self) -> List[Tuple[Ticket, Ticket]]:
+        return self.queue.sweep()
+
+    async def stats(self) -> dict:
+        return self.queue.stats()
+
+
+class MongoMatchmakingBackend(MatchmakingBackend):
+    '''
+        Queue shared by all the workers through the matchmaking collection, one document per waiting player.
+
+        A waiting ticket is only ever taken with an atomic findOneAndDelete or findOneAndUpdate conditioned on
+        its status, so two workers can never hand the same player to two matches. Abandoned tickets are removed
+        by the TTL index on created_at, which the workers refresh while the player is connected to them. The waiting ticket picked is the oldest one in reach rather than the
+        closest in rating, which Mongo cannot sort on.
+    '''
+
+    def __init__(self):
+        # Counters of the matches made by this worker
+        self.matches_made = 0
+        self.total_matched_wait = 0.0
+
+    @staticmethod
+    def collection():
+        return get_db()[MATCHMAKING_COLLECTION]
+
+    @staticmethod
+    def rating_range(ticket: Ticket, search_bands: int) -> dict:
+        return {"$gte": (ticket.band - search_bands) * RATING_BAND_WIDTH,
+                "$lt": (ticket.band + search_bands + 1) * RATING_BAND_WIDTH}
+
+    @staticmethod
+    def to_ticket(document: dict) -> Ticket:
+        return Ticket(document["_id"], document["rating"], document["enqueued_at"])
+
+    async def claim_opponent(self, ticket: Ticket, search_bands: int) -> Optional[dict]:
+        return await self.collection().find_one_and_delete(
+            {"status": "waiting", "rating": self.rating_range(ticket, search_bands), "_id": {"$ne": ticket.username}},
+            sort=[("enqueued_at", ASCENDING)])
+
+    async def release(self, opponent: dict):
+        try:
+            await self.collection().insert_one(opponent)
+        except DuplicateKeyError:
+            pass  # Queued again meanwhile
+
+    def pair(self, waiting: Ticket, other: Ticket, now: float) -> Tuple[Ticket, Ticket]:
+        self.matches_made += 1
+        self.total_matched_wait += (now - waiting.enqueued_at) + (now - other.enqueued_at)
+        return waiting, other
+
+    async def enqueue(self, username: str, rating: int) -> Optional[Tuple[Ticket, Ticket]]:
+        now = time.time()
+        ticket = Ticket(username, rating, now)
+        search_bands = ticket.search_bands(now)
+        opponent = await self.claim_opponent(ticket, search_bands)
+        if opponent is not None:
+            return self.pair(self.to_ticket(opponent), ticket, now)
+        try:
+            await self.collection().insert_one({
+                "_id": username, "rating": rating, "status": "waiting", "enqueued_at": now,
+                "searched_bands": search_bands, "created_at": datetime.now(timezone.utc)})
+        except DuplicateKeyError:
+            pass  # Already queued from another connection
+        return None
+
+    async def cancel(self, username: str) -> bool:
+        result = await self.collection().delete_one({"_id": username})
+        return result.deleted_count > 0
+
+    async def is_queued(self, username: str) -> bool:
+        return await self.collection().count_documents({"_id": username}, limit=1) > 0
+
+    async def sweep(self) -> List[Tuple[Ticket, Ticket]]:
+        collection = self.collection()
+        now = time.time()
+        stale_claim = datetime.now(timezone.utc) - timedelta(seconds=CLAIM_TIMEOUT)
+        available = {"$or": [{"status": "waiting"}, {"status": "claimed", "claimed_at": {"$lt": stale_claim}}]}
+        documents = await collection.find(available).sort("enqueued_at", ASCENDING) \
+            .to_list(length=SWEEP_BATCH_SIZE)
+
+        pairs = []
+        for document in documents:
+            ticket = self.to_ticket(document)
+            search_bands = ticket.search_bands(now)
+            if search_bands <= document["searched_bands"] and document["status"] == "waiting":
+                continue
+            # Take the ticket out of reach of the other workers while looking for its opponent
+            claimed = await collection.find_one_and_update(
+                {"_id": ticket.username, "status": document["status"], "searched_bands": document["searched_bands"],
+                 "claimed_at": document.get("claimed_at")},
+                {"$set": {"status": "claimed", "searched_bands": search_bands,
+                          "claimed_at": datetime.now(timezone.utc)}},
+                return_document=ReturnDocument.AFTER)
+            if claimed is None:
+                continue  # Paired, cancelled or claimed by another worker meanwhile
+            opponent = await self.claim_opponent(ticket, search_bands)
+            if opponent is None:
+                # Does nothing when the player cancelled while the ticket was claimed
+                await collection.update_one({"_id": ticket.username, "status": "claimed"},
+                                            {"$set": {"status": "waiting"}})
+                continue
+            # Only the ticket claimed above: the player may have cancelled, or cancelled and queued again, meanwhile
+            result = await collection.delete_one({"_id": ticket.username, "status": "claimed",
+                                                  "claimed_at": claimed["claimed_at"]})
+            if result.deleted_count == 0:
+                await self.release(opponent)
+                continue
+            pairs.append(self.pair(ticket, self.to_ticket(opponent), now))
+        return pairs
+
+    async def refresh(self, usernames: Iterable[str]):
+        usernames = set(usernames)
+        if not usernames:
+            return
+        # The queue is much smaller than the connected players: only the tickets of this worker's players are updated
+        queued = [document["_id"] async for document in self.collection().find({}, {"_id": 1})
+                  if document["_id"] in usernames]
+        if queued:
+            await self.collection().update_many({"_id": {"$in": queued}},
+                                                {"$set": {"created_at": datetime.now(timezone.utc)}})
+
+    async def stats(self) -> dict:
+        now = time.time()
+        bands = await self.collection().aggregate([
+            {"$group": {"_id": {"$floor": {"$divide": ["$rating", RATING_BAND_WIDTH]}},
+                        "count": {"$sum": 1}, "oldest": {"$min": "$enqueued_at"}}},
+            {"$sort": {"_id": 1}},
+        ]).to_list(length=None)
+        return {
+            "queue_depth": sum(band["count"] for band in bands),
+            "bands": {int(band["_id"]) * RATING_BAND_WIDTH: band["count"] for band in bands},
+            "longest_wait": max((now - band["oldest"] for band in bands), default=0),
+            "matches_made": self.matches_made,
+            "average_wait": self.total_matched_wait / (2 * self.matches_made) if self.matches_made else 0,
+        }
+
+
+def create_matchmaking_backend(name: str = MATCHMAKING_BACKEND) -> MatchmakingBackend:
+    if name == "mongo":
+        return MongoMatchmakingBackend()
+    return InMemoryMatchmakingBackend(MatchmakingQueue())
+
+
+matchmaking_backend = create_matchmaking_backend()
+
+
+async def start_quick_match(pair: Tuple[Ticket, Ticket]):
+    player1, player2 = pair
+    match = await create_started_match(player1.username, player2.username, QUICK_PLAY_ROUNDS_TO_WIN)
+    for ticket, opponent in ((player1, player2), (player2, player1)):
+        await manager.send_to_user(ticket.username, {"type": "match_found", "opponent": opponent.username,
+                                                     "match": match.dict(by_alias=True)})
+
+
+async def run_matchmaking_sweeper(backend: MatchmakingBackend, interval: float = SWEEP_INTERVAL):
+    refreshed_at = time.monotonic()
+    while True:
+        await asyncio.sleep(interval)
+        if time.monotonic() - refreshed_at >= TICKET_REFRESH_INTERVAL:
+            refreshed_at = time.monotonic()
+            try:
+                await backend.refresh(list(manager.online_users))
+            except Exception as error:
+                print(f"Matchmaking ticket refresh failed: {error}")
+        try:
+            pairs = await backend.sweep()
+        except Exception as error:
+            print(f"Matchmaking sweep failed: {error}")
+            continue
+        for pair in pairs:
+            try:
+                await start_quick_match(pair)
+            except Exception as error:
+                print(f"Quick match creation failed: {error}")
+
+
+def start_matchmaking_sweeper() -> asyncio.Task:
+    return asyncio.create_task(run_matchmaking_sweeper(matchmaking_backend))
@@ -0,0 +1,167 @@
+import json
+import struct
+from typing import Dict, Optional, Union
+
+import msgpack
+
+JSON = "json"
+MSGPACK = "msgpack"
+# Offered by clients in the Sec-WebSocket-Protocol header, in order of preference. The delta variants receive
+# match updates as the fields changed since the previous version instead of the whole match.
+SUBPROTOCOLS = {
+    "backgammon.delta.msgpack": (MSGPACK, True),
+    "backgammon.delta.json": (JSON, True),
+    "backgammon.msgpack": (MSGPACK, False),
+    "backgammon.json": (JSON, False),
+}
+
+POINTS = 24
+# Signed count per point (positive for player 1, negative for player 2), then the bar of each player
+BOARD_FORMAT = struct.Struct(f"{POINTS}b2B")
+
+
+def negotiate_subprotocol(offered) -> tuple:
+    '''
+        Picks the first subprotocol offered by the client that the server supports.
+
+        Returns:
+            (str, str, bool): The accepted subprotocol (None when the client offered none), the encoding it selects
+                              and whether the client receives match updates as deltas.
+    '''
+
+    for subprotocol in offered or ():
+        if subprotocol in SUBPROTOCOLS:
+            return (subprotocol, *SUBPROTOCOLS[subprotocol])
+    return None, JSON, False
+
+
+def encode_board(board: dict) -> bytes:
+    points = [point["player1"] - point["player2"] for point in board["points"]]
+    return BOARD_FORMAT.pack(*points, board["bar"]["player1"], board["bar"]["player2"])
+
+
+def decode_board(packed: bytes) -> dict:
+    *points, bar1, bar2 = BOARD_FORMAT.unpack(packed)
+    return {"points": [{"player1": max(count, 0), "player2": max(-count, 0)} for count in points],
+            "bar": {"player1": bar1, "player2": bar2}}
+
+
+# MessagePack messages carry the match as an array of its field values in this order, and the board packed as bytes
+MATCH_FIELDS = ("_id", "player1", "player2", "board_configuration", "dice", "available", "turn", "last_updated",
+                "status", "rounds_to_win", "winsP1", "winsP2", "starter", "startDice", "ai_suggestions",
+                "doublingCube")
+NESTED_FIELDS = {
+    "startDice": ("roll1", "count1", "roll2", "count2"),
+    "doublingCube": ("count", "last_usage", "proposed", "proposer"),
+}
+
+
+def encode_match(match: dict) -> list:
+    values = []
+    for field in MATCH_FIELDS:
+        value = match[field]
+        if field == "board_configuration":
+            value = encode_board(value)
+        elif field in NESTED_FIELDS:
+            value = [value[nested] for nested in NESTED_FIELDS[field]]
+        values.append(value)
+    return values
+
+
+def decode_match(values: list) -> dict:
+    match = dict(zip(MATCH_FIELDS, values))
+    match["board_configuration"] = decode_board(match["board_configuration"])
+    for field, nested_fields in NESTED_FIELDS.items():
+        match[field] = dict(zip(nested_fields, match[field]))
+    return match
+
+
+def encode_changes(changes: dict) -> dict:
+    '''
+        Keys the changed fields by their index in MATCH_FIELDS. A board change becomes [[index, signed count, ...],
+        [bar player 1, bar player 2] or None].
+    '''
+
+    encoded = {}
+    for field, value in changes.items():
+        if field == "board_configuration":
+            points = [item for index, player1, player2 in value.get("points", ())
+                      for item in (index, player1 - player2)]
+            bar = value.get("bar")
+            value = [points, [bar["player1"], bar["player2"]] if bar else None]
+        elif field in NESTED_FIELDS:
+            value = [value[nested] for nested in NESTED_FIELDS[field]]
+        encoded[MATCH_FIELDS.index(field)] = value
+    return encoded
+
+
+def compact(message: dict) -> dict:
+    '''
+        Replaces the match, or the match changes, carried by a message with their positional form.
+    '''
+
+    match = message.get("match")
+    if isinstance(match, dict) and isinstance(match.get("board_configuration"), dict):
+        return {**message, "match": encode_match(match)}
+    changes = message.get("changes")
+    if isinstance(changes, dict):
+        return {**message, "changes": encode_changes(changes)}
+    return message
+
+
+class Payload:
+    '''
+        A message sent to several sockets, serialized at most once per encoding. Match updates also carry a delta
+        form, sent instead of the full message to the sockets that negotiated it.
+    '''
+
+    __slots__ = ("message", "delta", "encoded")
+
+    def __init__(self, message: dict, delta: Optional[dict] = None):
+        self.message = message
+        self.delta = delta
+        self.encoded: Dict[tuple, Union[str, bytes]] = {}
+
+    def encode(self, encoding: str, deltas: bool = False) -> Union[str, bytes]:
+        deltas = deltas and self.delta is not None
+        encoded = self.encoded.get((encoding, deltas))
+        if encoded is None:
+            message = self.delta if deltas else self.message
+            if encoding == MSGPACK:
+                encoded = msgpack.packb(compact(message))
+            else:
+                encoded = json.dumps(message, separators=(",", ":"))
+            self.encoded[(encoding, deltas)] = encoded
+        return encoded
+
+    def to_document(self) -> dict:
+        return {"message": self.message, "delta": self.delta}
+
+    @classmethod
+    def from_document(cls, document: dict) -> "Payload":
+        return cls(document["message"], document.get("delta"))
+
+
+def as_payload(message: Union[dict, Payload]) -> Payload:
+    return message if isinstance(message, Payload) else Payload(message)
+
+
+def decode_message(data: Union[str, bytes], encoding: str) -> dict:
+    '''
+        Raises:
+            ValueError: When the data is not a valid message in the encoding of the socket.
+    '''
+
+    if encoding == MSGPACK and isinstance(data, bytes):
+        try:
+            message = msgpack.unpackb(data)
+        except Exception as error:
+            raise ValueError("Invalid MessagePack format") from error
+    else:
+        try:
+            message = json.loads(data)
+        except json.JSONDecodeError as error:
+            raise ValueError("Invalid JSON format") from error
+    if not isinstance(message, dict):
+        raise ValueError("Message must be an object")
+    return message
@@ -1,14 +1,75 @@
+import numpy as np
+
 DEFAULT_RATING = 1500
 MINIMUM_RATING = 200
+K_FACTOR = 32
 
 def new_ratings_after_match(winner_rating, loser_rating):
     expected_win = 1 / (1 + 10 ** ((loser_rating - winner_rating) / 400))
     expected_lose = 1 / (1 + 10 ** ((winner_rating - loser_rating) / 400))
 
-    new_winner_rating = int(winner_rating + 32 * (1 - expected_win))
-    new_loser_rating = int(loser_rating + 32 * (0 - expected_lose))
+    new_winner_rating = int(winner_rating + K_FACTOR * (1 - expected_win))
+    new_loser_rating = int(loser_rating + K_FACTOR * (0 - expected_lose))
 
     if new_loser_rating < MINIMUM_RATING:
         new_loser_rating = MINIMUM_RATING
 
-    return new_winner_rating, new_loser_rating
\ No newline at end of file
+    return new_winner_rating, new_loser_rating
+
+
+def independent_match_layers(winners: np.ndarray, losers: np.ndarray, fixed: np.ndarray) -> list:
+    '''
+        Splits a chronological list of matches into consecutive layers in which no player appears twice.
+
+        Every player's matches land in strictly increasing layers, so applying the layers one after the
+        other gives the same result as applying the matches one by one. Players with a fixed rating
+        do not create dependencies between matches.
+
+        Args:
+            winners (np.ndarray): Player index of the winner of each match.
+            losers (np.ndarray): Player index of the loser of each match.
+            fixed (np.ndarray): Boolean mask of the players whose rating never changes.
+        Returns:
+            list: One array of match indices per layer.
+    '''
+
+    last_layer = np.full(len(fixed), -1, dtype=np.int64)
+    layers = np.empty(len(winners), dtype=np.int64)
+    for match, (winner, loser) in enumerate(zip(winners.tolist(), losers.tolist())):
+        layer = max(-1 if fixed[winner] else last_layer[winner], -1 if fixed[loser] else last_layer[loser]) + 1
+        last_layer[winner] = last_layer[loser] = layers[match] = layer
+
+    order = np.argsort(layers, kind="stable")
+    boundaries = np.flatnonzero(np.diff(layers[order])) + 1
+    return np.split(order, boundaries) if len(order) else []
+
+
+def batch_ratings_after_matches(winners: np.ndarray, losers: np.ndarray, ratings: np.ndarray, fixed: np.ndarray):
+    '''
+        Replays matches in chronological order with the same Elo formula as new_ratings_after_match,
+        vectorized over the matches of each independent layer.
+
+        Args:
+            winners (np.ndarray): Player index of the winner of each match.
+            losers (np.ndarray): Player index of the loser of each match.
+            ratings (np.ndarray): Starting rating of every player. Updated in place.
+            fixed (np.ndarray): Boolean mask of the players whose rating never changes (AI opponents).
+        Returns:
+            np.ndarray: The highest rating reached by every player, starting ratings included.
+    '''
+
+    highest = ratings.copy()
+    for layer in independent_match_layers(winners, losers, fixed):
+        layer_winners, layer_losers = winners[layer], losers[layer]
+        winner_ratings, loser_ratings = ratings[layer_winners], ratings[layer_losers]
+
+        expected_win = 1 / (1 + 10 ** ((loser_ratings - winner_ratings) / 400))
+        expected_lose = 1 / (1 + 10 ** ((winner_ratings - loser_ratings) / 400))
+        new_winner_ratings = np.trunc(winner_ratings + K_FACTOR * (1 - expected_win))
+        new_loser_ratings = np.maximum(np.trunc(loser_ratings + K_FACTOR * (0 - expected_lose)), MINIMUM_RATING)
+
+        ratings[layer_winners] = np.where(fixed[layer_winners], winner_ratings, new_winner_ratings)
+        ratings[layer_losers] = np.where(fixed[layer_losers], loser_ratings, new_loser_ratings)
+        highest[layer_winners] = np.maximum(highest[layer_winners], ratings[layer_winners])
+
+    return highest
@@ -0,0 +1,147 @@
+import asyncio
+import sys
+from datetime import datetime
+from typing import Dict
+
+import numpy as np
+from pymongo import ASCENDING, UpdateOne
+
+from core.config import RATING_SYSTEM, RATING_PERIOD_DAYS
+from services.ai import ai_names, ai_rating
+from services.database import get_db, initialize_db_connection
+from services.glicko import rating_period_update, DEFAULT_RATING_DEVIATION, DEFAULT_VOLATILITY, AI_RATING_DEVIATION
+from services.leaderboard import leaderboard, leaderboard_snapshot
+from services.rating import DEFAULT_RATING, batch_ratings_after_matches
+
+FINISHED_MATCH_STATUSES = ["player_1_won", "player_2_won"]
+REPORTED_DIFFERENCES = 100
+
+
+def glicko_ratings_after_matches(winners: np.ndarray, losers: np.ndarray, periods: np.ndarray, ratings: np.ndarray,
+                                 fixed: np.ndarray):
+    '''
+        Replays matches grouped in consecutive Glicko-2 rating periods.
+
+        Args:
+            periods (np.ndarray): Rating period of each match, non-decreasing.
+            ratings (np.ndarray): Starting rating of every player. Updated in place.
+        Returns:
+            (np.ndarray, np.ndarray, np.ndarray): Highest rating, rating deviation and volatility of every player.
+    '''
+
+    deviations = np.where(fixed, AI_RATING_DEVIATION, DEFAULT_RATING_DEVIATION)
+    volatilities = np.full(len(ratings), DEFAULT_VOLATILITY)
+    highest = ratings.copy()
+    players, opponents = np.concatenate([winners, losers]), np.concatenate([losers, winners])
+    scores = np.concatenate([np.ones(len(winners)), np.zeros(len(losers))])
+    row_periods = np.concatenate([periods, periods])
+    order = np.argsort(row_periods, kind="stable")
+    boundaries = np.searchsorted(row_periods[order], np.arange(periods[-1] + 2 if len(periods) else 0))
+
+    # Empty periods are replayed too: they only grow the rating deviation of every player
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        rows = order[start:end]
+        rating_period_update(ratings, deviations, volatilities, players[rows], opponents[rows], scores[rows], fixed)
+        np.maximum(highest, ratings, out=highest)
+
+    return np.round(highest), deviations, volatilities
+
+
+async def recompute_ratings(dry_run: bool = True, rating_system: str = RATING_SYSTEM) -> Dict:
+    '''
+        Recomputes every user's rating by replaying all finished matches in chronological order.
+
+        Args:
+            dry_run (bool): When True nothing is written and the differences with the current ratings are reported.
+            rating_system (str): "elo" replays match by match, "glicko2" replays rating periods of RATING_PERIOD_DAYS.
+        Returns:
+            dict: Number of users and matches replayed, number of changed ratings and the largest differences.
+    '''
+
+    players: Dict[str, int] = {}
+    current_ratings = []
+
+    def player_index(username: str, rating: int = DEFAULT_RATING) -> int:
+        index = players.get(username)
+        if index is None:
+            index = players[username] = len(players)
+            current_ratings.append(rating)
+        return index
+
+    for username, rating in zip(ai_names, ai_rating):
+        player_index(username, rating)
+    async for user in get_db().users.find({}, {"_id": 0, "username": 1, "rating": 1}):
+        player_index(user["username"], user.get("rating", DEFAULT_RATING))
+    known_users = len(players)
+
+    winners, losers, finish_times = [], [], []
+    cursor = get_db().matches.find({"status": {"$in": FINISHED_MATCH_STATUSES}},
+                                   {"_id": 0, "player1": 1, "player2": 1, "status": 1, "last_updated": 1}) \
+        .sort([("last_updated", ASCENDING), ("_id", ASCENDING)])
+    async for match in cursor:
+        player1, player2 = player_index(match["player1"]), player_index(match["player2"])
+        winner_is_player1 = match["status"] == "player_1_won"
+        winners.append(player1 if winner_is_player1 else player2)
+        losers.append(player2 if winner_is_player1 else player1)
+        finish_times.append(datetime.fromisoformat(match["last_updated"]).timestamp())
+
+    fixed = np.zeros(len(players), dtype=bool)
+    fixed[:len(ai_names)] = True
+    ratings = np.full(len(players), DEFAULT_RATING, dtype=np.float64)
+    ratings[:len(ai_names)] = ai_rating
+    winners, losers = np.array(winners, dtype=np.int64), np.array(losers, dtype=np.int64)
+    if rating_system == "glicko2":
+        finish_times = np.array(finish_times)
+        periods = ((finish_times - finish_times[0]) // (RATING_PERIOD_DAYS * 86400)).astype(np.int64) \
+            if len(finish_times) else np.array([], dtype=np.int64)
+        highest, deviations, volatilities = glicko_ratings_after_matches(winners, losers, periods, ratings, fixed)
+        ratings = np.round(ratings)
+    else:
+        highest = batch_ratings_after_matches(winners, losers, ratings, fixed)
+
+    # Only registered users are reported and written: AI players and deleted accounts have no document
+    usernames = list(players)[len(ai_names):known_users]
+    current = np.array(current_ratings[len(ai_names):known_users], dtype=np.float64)
+    recomputed = ratings[len(ai_names):known_users]
+    recomputed_highest = highest[len(ai_names):known_users]
+    changed = np.flatnonzero(current != recomputed)
+
+    largest = changed[np.argsort(-np.abs(recomputed[changed] - current[changed]), kind="stable")][:REPORTED_DIFFERENCES]
+    report = {
+        "users": len(usernames),
+        "matches": len(winners),
+        "changed": len(changed),
+        "differences": [{"username": usernames[i], "current": int(current[i]), "recomputed": int(recomputed[i])}
+                        for i in largest],
+    }
+
+    # Glicko-2 deviations evolve even for players whose rating did not move
+    written = changed if rating_system != "glicko2" else np.arange(len(usernames))
+    if not dry_run and len(written):
+        first_user = len(ai_names)
+        updates = []
+        for i in written:
+            values = {"rating": int(recomputed[i]), "stats.highest_rating": int(recomputed_highest[i])}
+            if rating_system == "glicko2":
+                values["rating_deviation"] = float(deviations[first_user + i])
+                values["volatility"] = float(volatilities[first_user + i])
+            updates.append(UpdateOne({"username": usernames[i]}, {"$set": values}))
+        await get_db().users.bulk_write(updates, ordered=False)
+        await leaderboard.load()
+        leaderboard_snapshot.mark_stale()
+
+    return report
+
+
+async def main(dry_run: bool):
+    initialize_db_connection()
+    report = await recompute_ratings(dry_run=dry_run)
+    print(f"Replayed {report['matches']} matches for {report['users']} users, {report['changed']} ratings differ")
+    for difference in report["differences"]:
+        print(f"{difference['username']}: {difference['current']} -> {difference['recomputed']}")
+    if dry_run:
+        print("Dry run, nothing written. Pass --apply to write the recomputed ratings.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(dry_run="--apply" not in sys.argv))
@@ -0,0 +1,35 @@
+from datetime import datetime, timezone
+from typing import Iterable, List, Tuple
+
+from services.database import get_db, RATING_HISTORY_COLLECTION
+
+
+async def record_rating_changes(changes: Iterable[Tuple[str, int]]):
+    timestamp = datetime.now(timezone.utc)
+    documents = [{"username": username, "timestamp": timestamp, "rating": rating} for username, rating in changes]
+    if documents:
+        await get_db()[RATING_HISTORY_COLLECTION].insert_many(documents, ordered=False)
+
+
+async def get_rating_history(username: str, points: int) -> List[dict]:
+    '''
+        Returns the rating curve of a user downsampled to at most `points` buckets of equal size.
+        Each bucket holds the rating at its end plus the lowest and highest rating within it.
+    '''
+
+    return await get_db()[RATING_HISTORY_COLLECTION].aggregate([
+        {"$match": {"username": username}},
+        {"$bucketAuto": {
+            "groupBy": "$timestamp",
+            "buckets": points,
+            "output": {
+                "timestamp": {"$max": "$timestamp"},
+                # $bucketAuto sorts by timestamp only, the latest rating is the greatest (timestamp, _id) pair:
+                # embedded documents compare field by field
+                "latest": {"$max": {"timestamp": "$timestamp", "_id": "$_id", "rating": "$rating"}},
+                "min_rating": {"$min": "$rating"},
+                "max_rating": {"$max": "$rating"},
+            },
+        }},
+        {"$project": {"_id": 0, "timestamp": 1, "rating": "$latest.rating", "min_rating": 1, "max_rating": 1}},
+    ]).to_list(length=None)
@@ -0,0 +1,158 @@
+import asyncio
+import time
+from typing import Dict, List, Optional, Set, Union
+
+from fastapi import WebSocket
+
+from core.config import SPECTATOR_DELAY, SPECTATOR_SAMPLE_INTERVAL
+from models.board_configuration import Match
+from services.database import get_db
+from services.match_events import match_events
+from services.protocol import Payload
+from services.websocket import ConnectionManager, manager
+
+# From this many spectators a match only gets its latest update every SPECTATOR_SAMPLE_INTERVAL seconds
+LARGE_AUDIENCE = 1000
+# Sends are started by chunks so that a large audience does not hold the event loop between two player updates
+FANOUT_CHUNK_SIZE = 500
+# Prefix of the event bus topics of the matches, "match:<match id>"
+MATCH_TOPIC = "match"
+
+
+class Audience:
+    __slots__ = ("sockets", "pending", "task")
+
+    def __init__(self):
+        self.sockets: Set[WebSocket] = set()
+        # (publication time, payload) pairs waiting to be sent
+        self.pending: List[tuple] = []
+        self.task: Optional[asyncio.Task] = None
+
+
+def sample(payloads: List[Payload]) -> List[Payload]:
+    '''
+        Keeps the messages without a match in order, and of the match updates only the last one, in full since the
+        spectators missed the deltas in between.
+    '''
+
+    last_update = max((i for i, payload in enumerate(payloads) if "match" in payload.message), default=None)
+    return [Payload(payload.message) if i == last_update else payload for i, payload in enumerate(payloads)
+            if i == last_update or "match" not in payload.message]
+
+
+class SpectatorHub:
+    '''
+        Per-match sets of spectator sockets.
+
+        Events are delivered to spectators from a task per match, after the players, so the size of the audience
+        never delays the players' updates. Each event is serialized once per encoding whatever the audience size.
+        Delivery can be delayed by SPECTATOR_DELAY seconds, and is sampled for audiences of LARGE_AUDIENCE or more.
+        Events are published on the event bus topic of the match, to which a worker subscribes while it holds
+        spectators of the match, so they reach the spectators whichever worker processed the action.
+    '''
+
+    def __init__(self, connections: ConnectionManager, delay: float = SPECTATOR_DELAY,
+                 sample_interval: float = SPECTATOR_SAMPLE_INTERVAL):
+        self.connections = connections
+        self.delay = delay
+        self.sample_interval = sample_interval
+        self.audiences: Dict[str, Audience] = {}
+        connections.disconnect_hooks.append(self.unsubscribe)
+        connections.topic_handlers[MATCH_TOPIC] = self.enqueue
+
+    async def subscribe(self, match_id: str, websocket: WebSocket):
+        await self.unsubscribe(websocket)
+        audience = self.audiences.get(match_id)
+        self.connections.active_connections[websocket].watching = match_id
+        if audience is None:
+            audience = self.audiences[match_id] = Audience()
+            audience.sockets.add(websocket)
+            await self.connections.subscribe_topic(f"{MATCH_TOPIC}:{match_id}")
+        else:
+            audience.sockets.add(websocket)
+
+    async def unsubscribe(self, websocket: WebSocket):
+        connection = self.connections.active_connections.get(websocket)
+        if connection is None or connection.watching is None:
+            return
+        match_id, connection.watching = connection.watching, None
+        audience = self.audiences.get(match_id)
+        if audience is None:
+            return
+        audience.sockets.discard(websocket)
+        if not audience.sockets:
+            if audience.task:
+                audience.task.cancel()
+            del self.audiences[match_id]
+            await self.connections.unsubscribe_topic(f"{MATCH_TOPIC}:{match_id}")
+
+    def audience_size(self, match_id: str) -> int:
+        audience = self.audiences.get(match_id)
+        return len(audience.sockets) if audience else 0
+
+    async def publish(self, match_id: str, message: Union[dict, Payload]):
+        await self.connections.publish_topic(f"{MATCH_TOPIC}:{match_id}", message)
+
+    async def enqueue(self, match_id: str, payload: Payload):
+        audience = self.audiences.get(match_id)
+        if audience is None:
+            return
+        audience.pending.append((time.monotonic(), payload))
+        if audience.task is None:
+            audience.task = asyncio.create_task(self.deliver(audience))
+
+    async def deliver(self, audience: Audience):
+        try:
+            while audience.pending:
+                if self.delay:
+                    await asyncio.sleep(max(audience.pending[0][0] + self.delay - time.monotonic(), 0))
+                now = time.monotonic()
+                ready = [payload for published, payload in audience.pending if published + self.delay <= now]
+                audience.pending = audience.pending[len(ready):]
+                large = len(audience.sockets) >= LARGE_AUDIENCE
+                for payload in sample(ready) if large else ready:
+                    await self.fan_out(audience, payload)
+                if large:
+                    await asyncio.sleep(self.sample_interval)
+        finally:
+            audience.task = None
+
+    async def fan_out(self, audience: Audience, payload: Payload):
+        sockets = list(audience.sockets)
+        for start in range(0, len(sockets), FANOUT_CHUNK_SIZE):
+            await asyncio.gather(*(self.connections.send_or_reap(payload, websocket)
+                                   for websocket in sockets[start:start + FANOUT_CHUNK_SIZE]), return_exceptions=True)
+
+
+spectators = SpectatorHub(manager)
+
+
+@manager.on("watch")
+async def watch(message: dict, websocket: WebSocket, username: str):
+    '''
+        {"type": "watch", "match_id": ...} subscribes the socket to the events of a started match, replacing the match
+        it was watching. The reply carries the current match and its version, from which the events apply.
+    '''
+
+    match_id = message.get("match_id")
+    # Subscribed before reading the match, so that no event is missed in between
+    await spectators.subscribe(match_id, websocket)
+    # The state and version of the snapshot are written together, the matches collection is only read for a match
+    # without events yet
+    snapshot = await match_events.snapshot(match_id)
+    if snapshot is not None:
+        version, match = snapshot
+    else:
+        version, match = 0, await get_db().matches.find_one({"_id": match_id})
+    if match is None or match.get("status") != "started":
+        await spectators.unsubscribe(websocket)
+        await manager.send_personal_message({"type": "error", "msg": "Match not found"}, websocket)
+        return
+    await manager.send_personal_message({"type": "watching", "match_id": match_id, "version": version,
+                                         "match": Match(**match).model_dump(by_alias=True)}, websocket)
+
+
+@manager.on("unwatch")
+async def unwatch(message: dict, websocket: WebSocket, username: str):
+    await spectators.unsubscribe(websocket)
+    await manager.send_personal_message({"type": "unwatched"}, websocket)
@@ -0,0 +1,136 @@
+from typing import Dict, Iterator, List, Sequence, Set, Tuple
+
+SWISS = "swiss"
+
+# Opponent of the player sitting a round out
+BYE = -1
+
+
+def swiss_rounds(participant_count: int) -> int:
+    '''
+        Enough rounds for a single player to be the only one winning them all.
+    '''
+
+    return max((participant_count - 1).bit_length(), 1)
+
+
+class PairingHistory:
+    __slots__ = ("opponents", "player1_balance", "had_bye")
+
+    def __init__(self, participant_count: int, rounds: Sequence[Sequence[int]]):
+        self.opponents: List[Set[int]] = [set() for _ in range(participant_count)]
+        # Times playing as player1 minus times playing as player2
+        self.player1_balance = [0] * participant_count
+        self.had_bye: Set[int] = set()
+        for pairings in rounds:
+            for i in range(0, len(pairings), 2):
+                player1, player2 = pairings[i], pairings[i + 1]
+                if player2 == BYE:
+                    self.had_bye.add(player1)
+                    continue
+                self.opponents[player1].add(player2)
+                self.opponents[player2].add(player1)
+                self.player1_balance[player1] += 1
+                self.player1_balance[player2] -= 1
+
+
+def nearest_first(index: int, count: int) -> Iterator[int]:
+    '''
+        Yields the indices from 0 to count, from the given one outwards: index, index + 1, index - 1, ...
+    '''
+
+    yield index
+    for distance in range(1, count):
+        if index + distance < count:
+            yield index + distance
+        if index - distance >= 0:
+            yield index - distance
+        if index + distance >= count and index - distance < 0:
+            return
+
+
+def pair_group(players: List[int], history: PairingHistory) -> Tuple[List[Tuple[int, int]], List[int]]:
+    '''
+        Pairs the upper half of a score group with its lower half, the i-th of each half together when possible,
+        without rematches. This is a bipartite matching, found with augmenting paths that try the closest
+        opponents first, so a rematch only moves the few pairings around it.
+
+        Returns:
+            (list, list): The pairs, and the players left unpaired, in standings order, who float to the next group.
+    '''
+
+    half = len(players) // 2
+    top, bottom = players[:half], players[half:]
+    top_of: Dict[int, int] = {}
+
+    def augment(t: int, visited: Set[int]) -> bool:
+        opponents = history.opponents[top[t]]
+        for b in nearest_first(min(t, len(bottom) - 1), len(bottom)):
+            if b in visited or bottom[b] in opponents:
+                continue
+            visited.add(b)
+            if b not in top_of or augment(top_of[b], visited):
+                top_of[b] = t
+                return True
+        return False
+
+    for t in range(len(top)):
+        augment(t, set())
+
+    paired = sorted((t, b) for b, t in top_of.items())
+    paired_players = {top[t] for t, _ in paired} | {bottom[b] for _, b in paired}
+    return [(top[t], bottom[b]) for t, b in paired], [player for player in players if player not in paired_players]
+
+
+def orient(pair: Tuple[int, int], history: PairingHistory) -> Tuple[int, int]:
+    '''
+        Makes player1 the one who played it less often, the better ranked one on a tie.
+    '''
+
+    higher, lower = pair
+    if history.player1_balance[lower] < history.player1_balance[higher]:
+        return lower, higher
+    return higher, lower
+
+
+def swiss_pairings(standings: List[int], scores: Sequence[float], rounds: Sequence[Sequence[int]]) -> List[int]:
+    '''
+        Pairs the next round of a Swiss tournament.
+
+        Players are paired within their score group, by the Dutch system (the upper half against the lower half),
+        avoiding rematches. Players left over float down to the next group. With an odd count, the lowest ranked
+        player who did not have one yet gets a bye.
+
+        Args:
+            standings (list): The participant indices, best ranked first (by score, then tie breaks).
+            scores (list): The score of each participant index.
+            rounds (list): The pairings of the previous rounds, in the returned format.
+
+        Returns:
+            list: The flat pairings [player1, player2, ...], the bye last as [player, BYE].
+    '''
+
+    history = PairingHistory(len(scores), rounds)
+    pool = list(standings)
+    bye = None
+    if len(pool) % 2:
+        bye = next((player for player in reversed(pool) if player not in history.had_bye), pool[-1])
+        pool.remove(bye)
+
+    pairs = []
+    floaters: List[int] = []
+    start = 0
+    while start < len(pool):
+        end = start
+        while end < len(pool) and scores[pool[end]] == scores[pool[start]]:
+            end += 1
+        group_pairs, floaters = pair_group(floaters + pool[start:end], history)
+        pairs += group_pairs
+        start = end
+    # Only rematches were left for the last players
+    pairs += [(floaters[i], floaters[i + 1]) for i in range(0, len(floaters), 2)]
+
+    pairings = [player for pair in pairs for player in orient(pair, history)]
+    if bye is not None:
+        pairings += [bye, BYE]
+    return pairings
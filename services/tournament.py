@@ -1,15 +1,36 @@
-from models.tournament import Tournament, CreateTournamentRequest, TournamentStats
+from models.tournament import Tournament, CreateTournamentRequest, TournamentStats, DEFAULT_TOURNAMENT_PARTICIPANTS
 from fastapi import HTTPException
-from typing import List
+from typing import List, Optional
+from pymongo import ASCENDING, ReturnDocument
 from services.database import get_db
-from services.game import create_started_match, get_current_game
+from services.game import create_started_matches
 from models.board_configuration import Match
-from services.websocket import manager as websocket_manager
+from services.tournament_events import LOBBY, tournament_hub
+from services.tournament_lobby import available_tournaments_cache
 from fastapi.encoders import jsonable_encoder
-from services.ai import ai_names
+from services.ai import ai_names, ai_rating
+from services.bracket import SINGLE_ELIMINATION, DOUBLE_ELIMINATION, bracket_layout, bracket_size, start_bracket, \
+    advance, resolve
+from services.rating import DEFAULT_RATING
+from services.swiss import SWISS, BYE, swiss_pairings, swiss_rounds
 
+ROUND_ROBIN = "round_robin"
+BRACKET_TYPES = (SINGLE_ELIMINATION, DOUBLE_ELIMINATION)
+TOURNAMENT_TYPES = (ROUND_ROBIN, SWISS, *BRACKET_TYPES)
 
-MAX_TOURNMENT_PARTICIPANTS = 4
+# Update pipeline stage maintaining the fields the available tournaments are queried on
+SLOT_FIELDS_STAGE = {"$set": {
+    "participant_count": {"$size": "$confirmed_participants"},
+    "has_open_slot": {"$and": ["$open", {"$eq": ["$status", "pending"]}, {"$lt": [
+        {"$size": "$participants"}, {"$ifNull": ["$max_participants", DEFAULT_TOURNAMENT_PARTICIPANTS]}]}]}
+}}
+
+
+def publish_tournament_event(tournament_id: str, participants: List[str], event: dict, lobby: bool = False):
+    event = {**event, "tournament_id": tournament_id}
+    tournament_hub.publish(tournament_id, event, participants)
+    if lobby:
+        tournament_hub.publish(LOBBY, event)
 
 
 async def get_current_tournament(username: str) -> Tournament:
@@ -22,25 +43,23 @@ async def get_current_tournament(username: str) -> Tournament:
     return None
 
 
-async def get_available_tournaments(username: str) -> List[Tournament]:
-    # Get all tournaments that are closed tournaments that the user is invited to OR open tournaments with less than 4 participants 
-    tournament_data = await get_db().tournaments.find({
-        "$and": [
-        {"status": "pending"},
-        {
-            "$or": [
-                {"participants": {"$in": [username]}},
-                {"$and": [
-                    {"open": True},
-                    {"$expr": {"$lt": [{"$size": "$participants"}, 4]}}
-                ]}
-            ]
-        }
-    ]
-    }).to_list(length=None)
-    if tournament_data:
-        return [Tournament(**tournament) for tournament in tournament_data]
-    return []
+async def backfill_tournament_slots():
+    '''
+        Sets participant_count and has_open_slot on the tournaments created before they were maintained, so that
+        the pending open ones are listed as available. Run at startup.
+    '''
+
+    await get_db().tournaments.update_many({"has_open_slot": {"$exists": False}}, [SLOT_FIELDS_STAGE])
+
+
+async def backfill_completed_games():
+    '''
+        Counts the games already played by the tournaments started before completed_games was maintained, from
+        their standings, so that their next rounds are created once. Run at startup.
+    '''
+
+    await get_db().tournaments.update_many({"completed_games": {"$exists": False}},
+                                           [{"$set": {"completed_games": {"$sum": "$stats.wins"}}}])
 
 
 async def get_concluded_tournaments(username: str) -> List[Tournament]:
@@ -54,14 +73,17 @@ async def get_concluded_tournaments(username: str) -> List[Tournament]:
 
 
 async def create_new_tournament(request: CreateTournamentRequest, owner: str):
+    if request.type not in TOURNAMENT_TYPES:
+        raise HTTPException(status_code=400, detail="Unknown tournament type")
     confirmed_participants = [owner]
     for participant in request.participants:
         if participant in ai_names:
             confirmed_participants.append(participant)
     if len(set(confirmed_participants).intersection(ai_names)) > 1:
         raise HTTPException(status_code=400, detail="Cannot have more than 1 AI players in a tournament")
+    participants = [owner] if (request.open and len(request.participants)==0 ) else request.participants
     new_tournament = Tournament(owner=owner, 
-                                participants= [owner] if (request.open and len(request.participants)==0 ) else request.participants,
+                                participants=participants,
                                 confirmed_participants=confirmed_participants,
                                 open=request.open,
                                 name=request.name,
@@ -69,10 +91,20 @@ async def create_new_tournament(request: CreateTournamentRequest, owner: str):
                                 status="pending",
                                 type=request.type,
                                 rounds_to_win=request.rounds_to_win,
-                                stats=[]
+                                stats=[],
+                                max_participants=request.max_participants,
+                                participant_count=len(confirmed_participants),
+                                has_open_slot=request.open and len(participants) < request.max_participants
                             )
     tournament_data = new_tournament.model_dump(by_alias=True)
     await get_db().tournaments.insert_one(tournament_data)
+    available_tournaments_cache.clear()
+    event = {"type": "tournament_created", "tournament_id": new_tournament.id, "tournament": tournament_data}
+    if new_tournament.open:
+        tournament_hub.publish(LOBBY, event)
+    else:
+        # Closed tournaments are only announced to the invited
+        tournament_hub.publish(new_tournament.id, event, participants)
     return new_tournament
 
 
@@ -87,93 +119,289 @@ async def get_tournament_id_from_owner_and_name(owner: str, name: str) -> Tourna
 
 
 async def add_participant_to_tournament(tournament_id: str, participant=str):
-    tournament = await get_db().tournaments.find_one({"_id": tournament_id})
+    '''
+        Joins a pending tournament in a single conditional update, which also tells whether it is now full: an
+        open tournament while it has a free place, a closed one when invited. Concurrent joins cannot overfill it,
+        and exactly one of them starts it. The same update maintains participant_count and has_open_slot.
+    '''
+
+    max_participants = {"$ifNull": ["$max_participants", DEFAULT_TOURNAMENT_PARTICIPANTS]}
+    tournament = await get_db().tournaments.find_one_and_update(
+        {
+            "_id": tournament_id,
+            "status": "pending",
+            "confirmed_participants": {"$ne": participant},
+            "$or": [
+                {"open": True, "participants": {"$ne": participant}},
+                {"open": False, "participants": participant}
+            ],
+            # Open tournaments are limited by their participants, closed ones by the invited who joined
+            "$expr": {"$lt": [{"$size": {"$cond": ["$open", "$participants", "$confirmed_participants"]}},
+                              max_participants]}
+        },
+        [
+            # Invited participants of a closed tournament are already in participants
+            {"$set": {
+                "participants": {"$cond": [{"$in": [{"$literal": participant}, "$participants"]}, "$participants",
+                                           {"$concatArrays": ["$participants", [{"$literal": participant}]]}]},
+                "confirmed_participants": {"$concatArrays": ["$confirmed_participants",
+                                                             [{"$literal": participant}]]}
+            }},
+            SLOT_FIELDS_STAGE
+        ],
+        return_document=ReturnDocument.AFTER
+    )
 
     if not tournament:
-        raise HTTPException(status_code=404, detail="No corresponding tournament found")
-    
-    is_open = tournament["open"]
-    participants = tournament["participants"]
-    confirmed_participants = tournament["confirmed_participants"]
-
-    if is_open:
-        #Join open tournament. Check that there are less than 4 participants and that participant is not already in participants.
-        #Finally, add participant to participants and confirmed_participants
-        if(len(participants) >= 4 or participant in participants):
+        tournament = await get_db().tournaments.find_one({"_id": tournament_id})
+        if not tournament:
+            raise HTTPException(status_code=404, detail="No corresponding tournament found")
+        elif tournament["open"] or tournament["status"] != "pending":
             raise HTTPException(status_code=400, detail="Cannot join tournament")
-        else:
-            await get_db().tournaments.update_one(
-                {"_id": tournament_id},
-                {
-                    "$push": {
-                        "participants": participant,
-                        "confirmed_participants": participant
-                    }
-                }
-            )
-    else:
-        #Join closed tournament. Check that participant is in participants (invited), then that participant is not already in confirmed_participants.
-        #Finally, add participant to confirmed_participants
-        if participant not in participants:
+        elif participant not in tournament["participants"]:
             raise HTTPException(status_code=400, detail="Not invited to tournament")
-        else:
-            if(participant in confirmed_participants):
-                raise HTTPException(status_code=400, detail="Already joined tournament")
-            else:
-                await get_db().tournaments.update_one(
-                    {"_id": tournament_id},
-                    {
-                        "$push": {
-                            "confirmed_participants": participant
-                        }
-                    }
-                )
-
-    tournament = await get_db().tournaments.find_one({"_id": tournament_id})
-    if len(tournament["confirmed_participants"]) == MAX_TOURNMENT_PARTICIPANTS:
+        elif participant in tournament["confirmed_participants"]:
+            raise HTTPException(status_code=400, detail="Already joined tournament")
+        raise HTTPException(status_code=400, detail="Cannot join tournament")
+
+    available_tournaments_cache.clear()
+    publish_tournament_event(tournament_id, tournament["confirmed_participants"], {
+        "type": "tournament_joined",
+        "confirmed_participants": tournament["confirmed_participants"],
+        "participant_count": tournament["participant_count"],
+        "has_open_slot": tournament["has_open_slot"]
+    }, lobby=tournament["open"])
+    if len(tournament["confirmed_participants"]) == tournament.get("max_participants", DEFAULT_TOURNAMENT_PARTICIPANTS):
         await start_tournament(tournament_id)
 
 
+def round_robin_schedule(participant_count: int) -> List[List[int]]:
+    '''
+        Pairs every participant with every other once, by the circle method: the first participant stays in place
+        while the others rotate by one position each round, and the i-th of the circle plays the i-th from the end.
+        With an odd count, the participant drawn against the added bye sits the round out.
+
+        Returns:
+            list: Per round, the flat indices of the players of each match, [player1, player2, player1, ...].
+    '''
+
+    slots = list(range(participant_count)) + ([None] if participant_count % 2 else [])
+    size = len(slots)
+    schedule = []
+    for round_index in range(size - 1):
+        circle = [slots[0]] + slots[1:][-round_index:] + slots[1:][:-round_index] if round_index else slots
+        pairings = []
+        for i in range(size // 2):
+            player1, player2 = circle[i], circle[size - 1 - i]
+            if player1 is None or player2 is None:
+                continue
+            # Alternates the side of the fixed participant
+            if i == 0 and round_index % 2:
+                player1, player2 = player2, player1
+            pairings += [player1, player2]
+        schedule.append(pairings)
+    return schedule
+
+
+def matches_per_round(participant_count: int) -> int:
+    return participant_count // 2
+
+
 async def start_tournament(tournament_id: str):
 
     tournament = await get_db().tournaments.find_one({"_id": tournament_id})
-    stats = [TournamentStats(username=participant, wins=0, losses=0, matches=0, points=0) for participant in tournament["confirmed_participants"]]
 
     if tournament:
-        await get_db().tournaments.update_one(
-            {"_id": tournament_id},
-            {"$set": {"status": "started", "stats": jsonable_encoder(stats)}}
-        )
+        stats = [TournamentStats(username=participant, wins=0, losses=0, matches=0, points=0) for participant in tournament["confirmed_participants"]]
+        fields = {"status": "started", "stats": jsonable_encoder(stats), "has_open_slot": False}
+        if tournament["type"] == "round_robin":
+            fields["schedule"] = round_robin_schedule(len(tournament["confirmed_participants"]))
+
+        elif tournament["type"] in BRACKET_TYPES:
+            seeding = await seed_participants(tournament["confirmed_participants"])
+            layout = bracket_layout(bracket_size(len(seeding)), tournament["type"] == DOUBLE_ELIMINATION)
+            slots = start_bracket(len(seeding), layout.double)
+            # Nobody plays yet, the byes are resolved before saving the bracket
+            writes, ready = resolve(layout, slots, range(len(slots)))
+            while writes:
+                for slot, value in writes.items():
+                    slots[slot] = value
+                writes, more_ready = resolve(layout, slots, list(writes))
+                ready += more_ready
+            fields.update(seeding=seeding, bracket=slots)
+        elif tournament["type"] == SWISS:
+            fields.update(seeding=await seed_participants(tournament["confirmed_participants"]), schedule=[])
+
+        await get_db().tournaments.update_one({"_id": tournament_id}, {"$set": fields})
+        available_tournaments_cache.clear()
+        publish_tournament_event(tournament_id, tournament["confirmed_participants"],
+                                 {"type": "tournament_started", "tournament_type": tournament["type"]},
+                                 lobby=tournament["open"])
 
         if tournament["type"] == "round_robin":
             await create_round_robin_tournament_round(tournament_id, 1)
+        elif tournament["type"] in BRACKET_TYPES:
+            await create_bracket_matches(tournament_id, fields["seeding"], slots, ready, tournament["rounds_to_win"])
+        elif tournament["type"] == SWISS:
+            await create_swiss_tournament_round(tournament_id, 1)
+
+
+async def seed_participants(participants: List[str]) -> List[str]:
+    '''
+        Orders the participants by decreasing rating, the earliest to join first among equal ratings.
+    '''
+
+    users = await get_db().users.find({"username": {"$in": participants}},
+                                      {"username": 1, "rating": 1}).to_list(length=None)
+    ratings = {user["username"]: user.get("rating", DEFAULT_RATING) for user in users}
+    ratings.update((name, rating) for name, rating in zip(ai_names, ai_rating) if name in participants)
+    return sorted(participants, key=lambda participant: -ratings.get(participant, DEFAULT_RATING))
+
+
+async def create_bracket_matches(tournament_id: str, seeding: List[str], slots: list, ready: List[int],
+                                 rounds_to_win: int):
+    if not ready:
+        return
+    matches = await create_started_matches(
+        [(seeding[slots[2 * match]], seeding[slots[2 * match + 1]]) for match in ready], rounds_to_win)
+    await get_db().tournaments.update_one(
+        {"_id": tournament_id},
+        {
+            "$push": {"match_ids": {"$each": [match.id for match in matches]}},
+            "$set": {f"bracket_matches.{match.id}": bracket_match for match, bracket_match in zip(matches, ready)}
+        }
+    )
+    publish_tournament_event(tournament_id, seeding,
+                             {"type": "tournament_matches", "round": None,
+                              "match_ids": [match.id for match in matches]})
+
+
+async def advance_bracket(tournament: dict, game_id: str, winner_username: str):
+    '''
+        Moves the players of a finished bracket match to their next matches, found in constant time from the
+        layout, and starts the matches that have both their players.
+
+        Each slot is set with its own atomic update: when the two matches feeding a match end together, only the
+        second update sees both players and creates it.
+    '''
+
+    seeding = tournament["seeding"]
+    layout = bracket_layout(bracket_size(len(seeding)), tournament["type"] == DOUBLE_ELIMINATION)
+    slots = tournament["bracket"]
+    match = tournament["bracket_matches"][game_id]
+    winner = slots[2 * match] if seeding[slots[2 * match]] == winner_username else slots[2 * match + 1]
+
+    writes, champion = advance(layout, slots, match, winner)
+    if champion is not None:
+        await end_tournament(tournament, seeding[champion])
+        return
+
+    while writes:
+        slots = (await get_db().tournaments.find_one_and_update(
+            {"_id": tournament["_id"]},
+            {"$set": {f"bracket.{slot}": value for slot, value in writes.items()}},
+            projection={"bracket": 1},
+            return_document=ReturnDocument.AFTER
+        ))["bracket"]
+        writes, ready = resolve(layout, slots, list(writes))
+        await create_bracket_matches(tournament["_id"], seeding, slots, ready, tournament["rounds_to_win"])
 
 
 async def create_round_robin_tournament_round(tournament_id: str, round: int):
+    '''
+        Creates the matches of a round (from 1) of the precomputed schedule, in a constant number of round trips
+        whatever the number of participants. The round is claimed first, so that it is only created once when its
+        last matches end together.
+    '''
+
+    if round < 1:
+        raise HTTPException(status_code=400, detail="No such round")
+    tournament = await get_db().tournaments.find_one_and_update(
+        {"_id": tournament_id, "round": {"$not": {"$gte": round}},
+         # Tournaments started before schedules were stored get theirs computed below
+         "$or": [{f"schedule.{round - 1}": {"$exists": True}}, {"schedule": {"$in": [None, []]}}]},
+        {"$set": {"round": round}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not tournament:
+        tournament = await get_db().tournaments.find_one({"_id": tournament_id}, {"round": 1})
+        if not tournament:
+            raise HTTPException(status_code=404, detail="No corresponding tournament found")
+        elif tournament.get("round", 0) >= round:
+            raise HTTPException(status_code=400, detail="Round already exists")
+        raise HTTPException(status_code=400, detail="No such round")
+
+    participants = tournament["confirmed_participants"]
+    schedule = tournament.get("schedule") or round_robin_schedule(len(participants))
+    if round > len(schedule):
+        raise HTTPException(status_code=400, detail="No such round")
+
+    pairings = schedule[round - 1]
+    matches = await create_started_matches(
+        [(participants[pairings[i]], participants[pairings[i + 1]]) for i in range(0, len(pairings), 2)],
+        tournament["rounds_to_win"])
+
+    await get_db().tournaments.update_one(
+        {"_id": tournament_id},
+        {
+            "$set": {
+                "match_ids": [match.id for match in matches]
+            }
+        }
+    )
+    publish_tournament_event(tournament_id, participants,
+                             {"type": "tournament_matches", "round": round,
+                              "match_ids": [match.id for match in matches]})
+
+
+async def create_swiss_tournament_round(tournament_id: str, round: int):
+    '''
+        Pairs the next round of a Swiss tournament from the standings, and appends it to the schedule. Players
+        are ranked by wins, then points, then seed. A bye counts as a win, but not as a scheduled game.
+    '''
+
     tournament = await get_db().tournaments.find_one({"_id": tournament_id})
     if not tournament:
         raise HTTPException(status_code=404, detail="No corresponding tournament found")
-    elif len(tournament['match_ids']) > round:
+    elif tournament.get("round", 0) >= round:
         raise HTTPException(status_code=400, detail="Round already exists")
-    
-    g1_participants = (tournament["confirmed_participants"][0], tournament["confirmed_participants"][round])
-    remaining_indices = [i for i in range(4) if i != 0 and i != round]
-    g2_participants = (tournament["confirmed_participants"][remaining_indices[0]], tournament["confirmed_participants"][remaining_indices[1]])
 
-    await create_started_match(g1_participants[0], g1_participants[1], tournament["rounds_to_win"])
-    await create_started_match(g2_participants[0], g2_participants[1], tournament["rounds_to_win"])
+    participants = tournament["confirmed_participants"]
+    stats = {stat["username"]: stat for stat in tournament["stats"]}
+    seeds = {participant: seed for seed, participant in enumerate(tournament["seeding"])}
+    scores = [stats[participant]["wins"] for participant in participants]
+    standings = sorted(range(len(participants)), key=lambda i: (-scores[i], -stats[participants[i]]["points"],
+                                                                 seeds[participants[i]]))
+    pairings = swiss_pairings(standings, scores, tournament["schedule"])
+
+    update = {"$set": {"round": round}, "$push": {"schedule": pairings},
+              "$inc": {"scheduled_games": len(pairings) // 2}}
+    array_filters = None
+    if pairings[-1] == BYE:
+        update["$inc"].update({"scheduled_games": len(pairings) // 2 - 1, "stats.$[bye].wins": 1})
+        array_filters = [{"bye.username": participants[pairings[-2]]}]
+    # Claims the round, the standings it was paired from can no longer change
+    result = await get_db().tournaments.update_one({"_id": tournament_id, "round": tournament.get("round", 0)}, update,
+                                                   array_filters=array_filters)
+    if result.modified_count == 0:
+        raise HTTPException(status_code=400, detail="Round already exists")
 
-    g1 = await get_current_game(g1_participants[0])
-    g2 = await get_current_game(g2_participants[0])
+    matches = await create_started_matches(
+        [(participants[pairings[i]], participants[pairings[i + 1]]) for i in range(0, len(pairings), 2)
+         if pairings[i + 1] != BYE],
+        tournament["rounds_to_win"])
 
     await get_db().tournaments.update_one(
         {"_id": tournament_id},
         {
             "$set": {
-                "match_ids": [g1.id, g2.id]
+                "match_ids": [match.id for match in matches]
             }
         }
     )
+    publish_tournament_event(tournament_id, participants,
+                             {"type": "tournament_matches", "round": round,
+                              "match_ids": [match.id for match in matches]})
 
 
 async def get_tournament_of_game(game_id: str):
@@ -187,44 +415,75 @@ async def update_tournament_of_game(game: Match, winner_username: str, loser_use
     tournament = await get_tournament_of_game(game.id)
     
     if tournament:
-        await update_tournament_stats(tournament, winner_username, loser_username, gained_points)
-        tournament = await get_db().tournaments.find_one({"_id": tournament.id})
+        tournament = await update_tournament_stats(tournament, winner_username, loser_username, gained_points)
 
-        total_games = sum(stat['wins'] for stat in tournament['stats'])
+        total_games = tournament.get('completed_games', 0)
+        publish_tournament_event(tournament['_id'], tournament['confirmed_participants'], {
+            "type": "tournament_match_finished",
+            "match_id": game.id,
+            "winner": winner_username,
+            "loser": loser_username,
+            "completed_games": total_games
+        })
 
         if tournament['type'] == "round_robin":
-            if total_games >= (len(tournament['confirmed_participants']) * (len(tournament['confirmed_participants']) - 1)) // 2:
+            participant_count = len(tournament['confirmed_participants'])
+            round_size = matches_per_round(participant_count)
+            if total_games >= (participant_count * (participant_count - 1)) // 2:
                 await end_tournament(tournament)
-            elif total_games % 2 == 0:
-                await create_round_robin_tournament_round(tournament['_id'], total_games // 2 + 1)
-
-
-async def update_tournament_stats(tournament: Tournament, winner_username: str, loser_username: str, gained_points: int):
-    winner_stats = next((stat for stat in tournament.stats if stat.username == winner_username), None)
-    if winner_stats:
-        winner_stats.wins += 1
-        winner_stats.matches += 1
-        winner_stats.points += gained_points
-    loser_stats = next((stat for stat in tournament.stats if stat.username == loser_username), None)
-    if loser_stats:
-        loser_stats.losses += 1
-        loser_stats.matches += 1
-
-    await get_db().tournaments.update_one(
+            elif total_games % round_size == 0:
+                await create_round_robin_tournament_round(tournament['_id'], total_games // round_size + 1)
+        elif tournament['type'] in BRACKET_TYPES:
+            await advance_bracket(tournament, game.id, winner_username)
+        elif tournament['type'] == SWISS:
+            if total_games >= tournament.get('scheduled_games', 0):
+                if tournament['round'] >= swiss_rounds(len(tournament['confirmed_participants'])):
+                    await end_tournament(tournament)
+                else:
+                    await create_swiss_tournament_round(tournament['_id'], tournament['round'] + 1)
+
+
+async def update_tournament_stats(tournament: Tournament, winner_username: str, loser_username: str,
+                                  gained_points: int) -> dict:
+    '''
+        Records a game in the standings with $inc on the winner and loser entries only, and counts it in
+        completed_games in the same atomic update.
+
+        Returns:
+            dict: The updated tournament, without its standings, schedule and participants.
+    '''
+
+    return await get_db().tournaments.find_one_and_update(
         {"_id": tournament.id},
-        {"$set": {"stats": jsonable_encoder(tournament.stats)}}
+        {"$inc": {
+            "stats.$[winner].wins": 1,
+            "stats.$[winner].matches": 1,
+            "stats.$[winner].points": gained_points,
+            "stats.$[loser].losses": 1,
+            "stats.$[loser].matches": 1,
+            "completed_games": 1
+        }},
+        array_filters=[{"winner.username": winner_username}, {"loser.username": loser_username}],
+        projection={"stats": 0, "schedule": 0, "participants": 0},
+        return_document=ReturnDocument.AFTER
     )
 
 
-async def end_tournament(tournament: Tournament):
+async def end_tournament(tournament: Tournament, winner_username: str = None):
     await get_db().tournaments.update_one(
         {"_id": tournament['_id']},
         {"$set": {"status": "finished"}}
     )
 
-    winner = max(tournament['stats'], key=lambda x: x["wins"])
-    if len([stat for stat in tournament['stats'] if stat["wins"] == winner["wins"]]) > 1:
-        winner = max([stat for stat in tournament['stats'] if stat["wins"] == winner["wins"]], key=lambda x: x["points"])
+    if winner_username:
+        winner = {"username": winner_username}
+    else:
+        stats = tournament.get('stats')
+        if stats is None:
+            stats = (await get_db().tournaments.find_one({"_id": tournament['_id']}, {"stats": 1}))['stats']
+        winner = max(stats, key=lambda x: x["wins"])
+        if len([stat for stat in stats if stat["wins"] == winner["wins"]]) > 1:
+            winner = max([stat for stat in stats if stat["wins"] == winner["wins"]], key=lambda x: x["points"])
 
     #Increment tournament wins stat for winner
     await get_db().users.update_one(
@@ -232,7 +491,5 @@ async def end_tournament(tournament: Tournament):
         {"$inc": {"stats.tournaments_won": 1}}
     )
 
-    for participant in tournament['confirmed_participants']:
-        websocket = await websocket_manager.get_user(participant)
-        if websocket:
-            await websocket_manager.send_personal_message({"type": "tournament_over", "winner": winner["username"]}, websocket)
\ No newline at end of file
+    publish_tournament_event(tournament['_id'], tournament['confirmed_participants'],
+                             {"type": "tournament_over", "winner": winner["username"]})
\ No newline at end of file
@@ -0,0 +1,177 @@
+import asyncio
+from typing import Dict, Iterable, Optional, Set
+
+from fastapi import WebSocket
+
+from models.tournament import Tournament
+from services.database import get_db
+from services.protocol import Payload
+from services.tournament_lobby import get_available_tournaments
+from services.websocket import ConnectionManager, manager
+
+# Topic of the sockets watching the list of available tournaments
+LOBBY = "lobby"
+# Prefix of the event bus topics of the tournaments and the lobby, "tournament:<topic>"
+TOURNAMENT_TOPIC = "tournament"
+# Events published on a topic within this delay are sent together, after the burst
+COALESCE_DELAY = 0.25
+# Events carrying the whole state of what they describe: of a burst, only the latest of each tournament is sent
+COALESCED_EVENTS = ("tournament_joined",)
+
+
+class Topic:
+    __slots__ = ("sockets", "pending", "participants", "task")
+
+    def __init__(self):
+        # Sockets of this worker subscribed to the topic
+        self.sockets: Set[WebSocket] = set()
+        # Events published by this worker and not sent yet, keyed so that a coalesced event replaces the previous
+        # one of its tournament
+        self.pending: Dict[object, dict] = {}
+        self.participants: Set[str] = set()
+        self.task: Optional[asyncio.Task] = None
+
+
+class TournamentHub:
+    '''
+        Pushes the events of the tournaments to their participants, wherever they are connected, and to the sockets
+        subscribed to them or to the lobby.
+
+        Events published on a topic are held for COALESCE_DELAY seconds, so that a burst of joins is sent as the
+        latest participants only. They are then sent to the participants, and published together on the event bus
+        topic "tournament:<topic>", to which a worker subscribes while it holds sockets subscribed to the topic.
+        Each event is serialized once per worker for all its recipients.
+    '''
+
+    def __init__(self, connections: ConnectionManager, delay: float = COALESCE_DELAY):
+        self.connections = connections
+        self.delay = delay
+        self.topics: Dict[str, Topic] = {}
+        self.subscriptions: Dict[WebSocket, Set[str]] = {}
+        connections.disconnect_hooks.append(self.unsubscribe_all)
+        connections.topic_handlers[TOURNAMENT_TOPIC] = self.deliver
+
+    async def subscribe(self, topic_id: str, websocket: WebSocket):
+        topic = self.topics.get(topic_id)
+        if topic is None:
+            topic = self.topics[topic_id] = Topic()
+        self.subscriptions.setdefault(websocket, set()).add(topic_id)
+        topic.sockets.add(websocket)
+        if len(topic.sockets) == 1:
+            await self.connections.subscribe_topic(f"{TOURNAMENT_TOPIC}:{topic_id}")
+
+    async def unsubscribe(self, topic_id: str, websocket: WebSocket):
+        topics = self.subscriptions.get(websocket)
+        if topics is not None:
+            topics.discard(topic_id)
+            if not topics:
+                del self.subscriptions[websocket]
+        topic = self.topics.get(topic_id)
+        if topic is None or websocket not in topic.sockets:
+            return
+        topic.sockets.discard(websocket)
+        self.forget_if_unused(topic_id, topic)
+        if not topic.sockets:
+            await self.connections.unsubscribe_topic(f"{TOURNAMENT_TOPIC}:{topic_id}")
+
+    async def unsubscribe_all(self, websocket: WebSocket):
+        for topic_id in list(self.subscriptions.get(websocket, ())):
+            await self.unsubscribe(topic_id, websocket)
+
+    def forget_if_unused(self, topic_id: str, topic: Topic):
+        if not topic.sockets and topic.task is None and self.topics.get(topic_id) is topic:
+            del self.topics[topic_id]
+
+    def subscriber_count(self, topic_id: str) -> int:
+        topic = self.topics.get(topic_id)
+        return len(topic.sockets) if topic else 0
+
+    def publish(self, topic_id: str, event: dict, participants: Iterable[str] = ()):
+        topic = self.topics.get(topic_id)
+        if topic is None:
+            topic = self.topics[topic_id] = Topic()
+        if event["type"] in COALESCED_EVENTS:
+            key = (event["type"], event.get("tournament_id"))
+            # Moved to the end, the state it carries is the latest
+            topic.pending.pop(key, None)
+        else:
+            key = object()
+        topic.pending[key] = event
+        topic.participants.update(participants)
+        if topic.task is None:
+            topic.task = asyncio.create_task(self.flush(topic_id, topic))
+
+    async def flush(self, topic_id: str, topic: Topic):
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            events, topic.pending = list(topic.pending.values()), {}
+            participants, topic.participants = topic.participants, set()
+            topic.task = None
+            self.forget_if_unused(topic_id, topic)
+
+        for event in events:
+            payload = Payload(event)
+            await asyncio.gather(*(self.connections.send_to_user(participant, payload) for participant in participants),
+                                 return_exceptions=True)
+        # The participants are listed so that their subscribed sockets do not receive the events twice
+        await self.connections.publish_topic(f"{TOURNAMENT_TOPIC}:{topic_id}",
+                                             {"events": events, "participants": sorted(participants)})
+
+    async def deliver(self, topic_id: str, envelope: Payload):
+        topic = self.topics.get(topic_id)
+        if topic is None:
+            return
+        participants = set(envelope.message["participants"])
+        connections = self.connections.active_connections
+        sockets = [websocket for websocket in topic.sockets
+                   if websocket in connections and connections[websocket].username not in participants]
+        for event in envelope.message["events"]:
+            payload = Payload(event)
+            await asyncio.gather(*(self.connections.send_or_reap(payload, websocket) for websocket in sockets),
+                                 return_exceptions=True)
+
+
+tournament_hub = TournamentHub(manager)
+
+
+@manager.on("tournament_subscribe")
+async def subscribe_tournament(message: dict, websocket: WebSocket, username: str):
+    '''
+        {"type": "tournament_subscribe", "tournament_id": ...} pushes the events of a tournament to the socket. The
+        reply carries the current tournament, to which the events apply.
+    '''
+
+    tournament_id = message.get("tournament_id")
+    # Subscribed before reading the tournament, so that no event is missed in between
+    await tournament_hub.subscribe(tournament_id, websocket)
+    tournament = await get_db().tournaments.find_one({"_id": tournament_id})
+    if tournament is None:
+        await tournament_hub.unsubscribe(tournament_id, websocket)
+        await manager.send_personal_message({"type": "error", "msg": "No corresponding tournament found"}, websocket)
+        return
+    await manager.send_personal_message({"type": "tournament_subscribed",
+                                         "tournament": Tournament(**tournament).model_dump(by_alias=True)}, websocket)
+
+
+@manager.on("tournament_unsubscribe")
+async def unsubscribe_tournament(message: dict, websocket: WebSocket, username: str):
+    await tournament_hub.unsubscribe(message.get("tournament_id"), websocket)
+
+
+@manager.on("lobby_subscribe")
+async def subscribe_lobby(message: dict, websocket: WebSocket, username: str):
+    '''
+        {"type": "lobby_subscribe"} pushes the creation, joins and start of the open tournaments to the socket. The
+        reply carries the first page of the tournaments available to the user.
+    '''
+
+    await tournament_hub.subscribe(LOBBY, websocket)
+    tournaments = await get_available_tournaments(username)
+    await manager.send_personal_message({"type": "lobby_subscribed", "tournaments": [
+        tournament.model_dump(by_alias=True) for tournament in tournaments]}, websocket)
+
+
+@manager.on("lobby_unsubscribe")
+async def unsubscribe_lobby(message: dict, websocket: WebSocket, username: str):
+    await tournament_hub.unsubscribe(LOBBY, websocket)
@@ -0,0 +1,40 @@
+from typing import List, Optional
+
+from cachetools import TTLCache
+from pymongo import ASCENDING
+
+from models.tournament import Tournament
+from services.database import get_db
+
+AVAILABLE_TOURNAMENTS_PAGE_SIZE = 50
+
+# Keyed by (username, after, limit). Cleared by every create, join and start of this worker, other workers' changes
+# show up within the TTL
+available_tournaments_cache = TTLCache(maxsize=4096, ttl=5)
+
+
+async def get_available_tournaments(username: str, after: Optional[str] = None,
+                                    limit: int = AVAILABLE_TOURNAMENTS_PAGE_SIZE) -> List[Tournament]:
+    '''
+        Lists the pending tournaments the user is invited to or that have a free place, by id. Pass the id of the
+        last tournament received as after to get the next page. Each branch of the query is served by an index.
+    '''
+
+    key = (username, after, limit)
+    tournaments = available_tournaments_cache.get(key)
+    if tournaments is not None:
+        return tournaments
+
+    query = {
+        "status": "pending",
+        "$or": [
+            {"participants": username},
+            {"has_open_slot": True}
+        ]
+    }
+    if after:
+        query["_id"] = {"$gt": after}
+    tournament_data = await get_db().tournaments.find(query).sort("_id", ASCENDING).limit(limit).to_list(length=None)
+    tournaments = [Tournament(**tournament) for tournament in tournament_data]
+    available_tournaments_cache[key] = tournaments
+    return tournaments
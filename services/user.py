@@ -1,6 +1,19 @@
-from models.user import UserInDB, UserOnline, UserInLeaderboard
+from typing import AsyncIterable, AsyncIterator, List, Optional, TypeVar
+
+from cachetools import TTLCache
+from models.user import UserInDB
+from pymongo import ASCENDING
 from services.database import get_db
 
+USERNAME_SEARCH_LIMIT = 10
+# Users listed with their presence are looked up by batches of this many usernames
+USER_BATCH_SIZE = 500
+
+T = TypeVar("T")
+
+# Type-ahead sends one request per keystroke, so hot prefixes are served from memory for a few seconds
+username_search_cache = TTLCache(maxsize=4096, ttl=5)
+
 
 async def get_user(username: str):
     user = await get_db().users.find_one({"username": username})
@@ -8,22 +21,66 @@ async def get_user(username: str):
         return UserInDB(**user)
 
 
+def normalize_username(username: str) -> str:
+    return username.lower()
+
+
 async def get_usernames_starting_with(query: str):
+    prefix = normalize_username(query)
+    usernames = username_search_cache.get(prefix)
+    if usernames is not None:
+        return usernames
+
+    # A range on the normalized field is an index scan on a literal prefix, so the query is never parsed as a regex
     cursor = get_db().users.find(
-        {"username": {"$regex": f"^{query}"}},
+        {"username_lower": {"$gte": prefix, "$lt": prefix + "\uffff"}},
         {"_id": 1, "username": 1}  # Include both _id and username fields
-    ).limit(10)
+    ).sort("username_lower", ASCENDING).limit(USERNAME_SEARCH_LIMIT)
     usernames = []
     async for user in cursor:
         usernames.append({"id": str(user["_id"]), "username": user["username"]})
+    username_search_cache[prefix] = usernames
     return usernames
 
 
-async def get_all_users():
-    users = await get_db().users.find().to_list(length=None)
-    return [UserOnline(**user) for user in users]
+def invalidate_username_search(username: str):
+    normalized = normalize_username(username)
+    for end in range(len(normalized) + 1):
+        username_search_cache.pop(normalized[:end], None)
+
+
+async def iter_users(after: Optional[str] = None, limit: Optional[int] = None):
+    # Keyset pagination on the unique username index: the next page starts after the last username received
+    query = {"username": {"$gt": after}} if after else {}
+    cursor = get_db().users.find(query, {"_id": 1, "username": 1}).sort("username", ASCENDING)
+    if limit:
+        cursor = cursor.limit(limit)
+    async for user in cursor:
+        yield user
+
+
+async def iter_online_users(online_usernames: AsyncIterable[str], limit: Optional[int] = None):
+    '''
+        Yields the users of the online usernames, which come in username order, looking them up by batches.
+    '''
+
+    count = 0
+    async for usernames in batched(online_usernames, min(limit, USER_BATCH_SIZE) if limit else USER_BATCH_SIZE):
+        cursor = get_db().users.find({"username": {"$in": usernames}}, {"_id": 1, "username": 1}) \
+            .sort("username", ASCENDING)
+        async for user in cursor:
+            yield user
+            count += 1
+            if limit and count >= limit:
+                return
 
 
-async def get_all_users_leaderboard():
-    users = await get_db().users.find().to_list(length=None)
-    return [UserInLeaderboard(**user) for user in users]
+async def batched(items: AsyncIterable[T], size: int) -> AsyncIterator[List[T]]:
+    batch = []
+    async for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -1,52 +1,327 @@
+import asyncio
 import json
-from core.config import SECRET_KEY, ALGORITHM
+import time
+from core.config import SECRET_KEY, ALGORITHM, WS_PING_INTERVAL, WS_IDLE_TIMEOUT
 from fastapi import WebSocket, HTTPException, status
 from jose import JWTError, jwt
-from typing import List, Dict
+from starlette.websockets import WebSocketDisconnect
+from typing import AsyncIterator, Awaitable, Callable, Iterable, List, Dict, Optional, Set, Union
+from services.event_bus import EventBus, create_event_bus
+from services.protocol import JSON, Payload, as_payload, decode_message, negotiate_subprotocol
 
 
-class ConnectionManager:
+# Upper bounds in milliseconds of the send latency histogram buckets
+SEND_LATENCY_BUCKETS = (1, 5, 10, 50, 100, 500, 1000)
+# A socket that does not accept the close frame within this delay is dropped anyway
+CLOSE_TIMEOUT = 5
+
+
+class ConnectionState:
+    __slots__ = ("username", "encoding", "deltas", "last_seen", "heartbeat", "watching")
+
+    def __init__(self, username: str, encoding: str, deltas: bool):
+        self.username = username
+        self.encoding = encoding
+        self.deltas = deltas
+        self.last_seen = time.monotonic()
+        # Whether the client takes part in the heartbeat, from its first ping or pong
+        self.heartbeat = False
+        # Id of the match the socket spectates
+        self.watching = None
+
+
+class ConnectionMetrics:
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
-        self.online_users: Dict[str, WebSocket] = {}
+        self.connections_opened = 0
+        self.connections_closed = 0
+        self.connections_reaped = 0
+        self.messages_in = 0
+        self.messages_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.send_errors = 0
+        self.send_latency_total = 0.0
+        self.send_latency_max = 0.0
+        self.send_latency_buckets = [0] * (len(SEND_LATENCY_BUCKETS) + 1)
+
+    def record_send(self, size: int, seconds: float):
+        self.messages_out += 1
+        self.bytes_out += size
+        self.send_latency_total += seconds
+        self.send_latency_max = max(self.send_latency_max, seconds)
+        milliseconds = seconds * 1000
+        bucket = next((i for i, bound in enumerate(SEND_LATENCY_BUCKETS) if milliseconds <= bound),
+                      len(SEND_LATENCY_BUCKETS))
+        self.send_latency_buckets[bucket] += 1
+
+    def snapshot(self, open_sockets: int, online_users: int) -> dict:
+        return {
+            "open_sockets": open_sockets,
+            "online_users": online_users,
+            "connections_opened": self.connections_opened,
+            "connections_closed": self.connections_closed,
+            "connections_reaped": self.connections_reaped,
+            "messages_in": self.messages_in,
+            "messages_out": self.messages_out,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "send_errors": self.send_errors,
+            "send_latency_avg_ms": self.send_latency_total * 1000 / self.messages_out if self.messages_out else 0,
+            "send_latency_max_ms": self.send_latency_max * 1000,
+            "send_latency_buckets_ms": {**{str(bound): count for bound, count in
+                                           zip(SEND_LATENCY_BUCKETS, self.send_latency_buckets)},
+                                        "inf": self.send_latency_buckets[-1]},
+        }
+
+
+class ConnectionManager:
+    '''
+        Registry of the open websockets. A user can be connected from several tabs or devices at once: messages
+        sent to them are fanned out to every socket, and they stay online until the last one closes.
+
+        Each socket negotiates its encoding (JSON or MessagePack), and whether it receives match updates as deltas,
+        through its subprotocol when connecting.
+
+        Clients opt in to the heartbeat by sending a ping. From then on they are sent a ping every WS_PING_INTERVAL
+        seconds, which they answer with a pong, and their socket is closed when nothing was received from it for
+        WS_IDLE_TIMEOUT seconds. The sockets of clients that only receive are reaped when a send to them fails, and
+        closed by the server when they miss its protocol-level pings.
+    '''
+
+    def __init__(self, event_bus: EventBus = None):
+        self.active_connections: Dict[WebSocket, ConnectionState] = {}
+        self.online_users: Dict[str, Set[WebSocket]] = {}
+        self.handlers: Dict[str, Callable[[dict, WebSocket, str], Awaitable[None]]] = {}
+        self.event_bus = event_bus or create_event_bus()
+        self.metrics = ConnectionMetrics()
+        self.heartbeat_task = None
+        # Called with each closed socket while its state is still registered
+        self.disconnect_hooks: List[Callable[[WebSocket], Awaitable[None]]] = []
+        # Called with the key and payload of the messages published on the topics "prefix:key" of their prefix
+        self.topic_handlers: Dict[str, Callable[[str, Payload], Awaitable[None]]] = {}
+
+    async def start(self):
+        await self.event_bus.start(self.deliver, self.deliver_topic)
+        self.heartbeat_task = asyncio.create_task(self.run_heartbeat())
+
+    async def stop(self):
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+        await self.event_bus.stop()
 
     async def connect(self, websocket: WebSocket, username: str):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-        self.online_users[username] = websocket
+        subprotocol, encoding, deltas = negotiate_subprotocol(websocket.scope.get("subprotocols"))
+        await websocket.accept(subprotocol=subprotocol)
+        self.active_connections[websocket] = ConnectionState(username, encoding, deltas)
+        self.metrics.connections_opened += 1
+        sockets = self.online_users.get(username)
+        if sockets is None:
+            self.online_users[username] = {websocket}
+            await self.event_bus.set_online(username)
+        else:
+            sockets.add(websocket)
 
-    def disconnect(self, websocket: WebSocket, username: str):
-        self.active_connections.remove(websocket)
-        if username in self.online_users:
+    async def disconnect(self, websocket: WebSocket, username: str):
+        for hook in self.disconnect_hooks:
+            await hook(websocket)
+        if self.active_connections.pop(websocket, None) is not None:
+            self.metrics.connections_closed += 1
+        sockets = self.online_users.get(username)
+        if sockets is None:
+            return
+        sockets.discard(websocket)
+        if not sockets:
             del self.online_users[username]
+            await self.event_bus.set_offline(username)
+
+    def get_user_sockets(self, username: str) -> Set[WebSocket]:
+        return self.online_users.get(username, set())
+
+    async def is_online(self, username: str) -> bool:
+        return await self.event_bus.is_online(username)
+
+    async def online_usernames(self) -> List[str]:
+        return await self.event_bus.online_usernames()
+
+    async def online_among(self, usernames: Iterable[str]) -> Set[str]:
+        return await self.event_bus.online_among(usernames)
+
+    def iter_online_usernames(self, after: Optional[str] = None) -> AsyncIterator[str]:
+        return self.event_bus.iter_online_usernames(after)
+
+    async def send_to_user(self, username: str, message: dict):
+        '''
+            Sends a message to a user wherever their websocket is connected, through the event bus.
+        '''
+
+        await self.event_bus.publish(username, message)
 
-    async def get_user(self, username: str):
-        return self.online_users.get(username)
+    async def publish_topic(self, topic: str, message: Union[dict, Payload]):
+        '''
+            Publishes a message to the sockets of every worker subscribed to the topic, through the event bus.
+        '''
 
-    async def send_personal_message(self, message: json, websocket: WebSocket):
-        await websocket.send_json(message)
+        await self.event_bus.publish_topic(topic, as_payload(message))
+
+    async def subscribe_topic(self, topic: str):
+        await self.event_bus.subscribe(topic)
+
+    async def unsubscribe_topic(self, topic: str):
+        await self.event_bus.unsubscribe(topic)
+
+    async def deliver_topic(self, topic: str, message: Union[dict, Payload]):
+        prefix, _, key = topic.partition(":")
+        handler = self.topic_handlers.get(prefix)
+        if handler is not None:
+            await handler(key, as_payload(message))
+
+    async def deliver(self, username: str, message: Union[dict, Payload]):
+        sockets = self.online_users.get(username)
+        if not sockets:
+            return
+        payload = as_payload(message)
+        if len(sockets) == 1:
+            await self.send_or_reap(payload, next(iter(sockets)))
+            return
+        await asyncio.gather(*(self.send_or_reap(payload, websocket) for websocket in list(sockets)),
+                             return_exceptions=True)
+
+    async def send_or_reap(self, payload: Payload, websocket: WebSocket):
+        '''
+            Sends a payload to a socket, and reaps the socket when the send fails: the failure is counted in the
+            metrics, and the connection is dead or half-open.
+        '''
+
+        try:
+            await self.send_payload(payload, websocket)
+        except Exception:
+            connection = self.active_connections.get(websocket)
+            if connection is not None:
+                await self.reap(websocket, connection.username)
+
+    async def send_payload(self, payload: Payload, websocket: WebSocket):
+        connection = self.active_connections.get(websocket)
+        if connection is None:
+            encoded = payload.encode(JSON)
+        else:
+            encoded = payload.encode(connection.encoding, connection.deltas)
+        start = time.perf_counter()
+        try:
+            if isinstance(encoded, bytes):
+                await websocket.send_bytes(encoded)
+            else:
+                await websocket.send_text(encoded)
+        except Exception:
+            self.metrics.send_errors += 1
+            raise
+        self.metrics.record_send(len(encoded), time.perf_counter() - start)
+
+    async def send_personal_message(self, message: Union[dict, Payload], websocket: WebSocket):
+        await self.send_payload(as_payload(message), websocket)
 
     async def broadcast(self, message: json):
-        for connection in self.active_connections:
-            await connection.send_json(message)
+        payload = Payload(message)
+        for connection in list(self.active_connections):
+            await self.send_payload(payload, connection)
+
+    def on(self, message_type: str):
+        '''
+            Registers the decorated coroutine as the handler of the client messages of the given type.
+        '''
+
+        def register(handler):
+            self.handlers[message_type] = handler
+            return handler
+
+        return register
+
+    async def receive(self, websocket: WebSocket) -> Union[str, bytes]:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        connection = self.active_connections.get(websocket)
+        if connection is not None:
+            connection.last_seen = time.monotonic()
+        data = message.get("text")
+        if data is None:
+            data = message.get("bytes")
+        self.metrics.messages_in += 1
+        self.metrics.bytes_in += len(data or "")
+        return data
+
+    async def run_heartbeat(self, interval: float = WS_PING_INTERVAL, idle_timeout: float = WS_IDLE_TIMEOUT):
+        ping = Payload({"type": "ping"})
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.heartbeat(ping, idle_timeout)
+            except Exception as error:
+                print(f"Websocket heartbeat failed: {error}")
+
+    async def heartbeat(self, ping: Payload, idle_timeout: float):
+        '''
+            Pings the sockets of the clients that take part in the heartbeat, and reaps those silent for longer than
+            idle_timeout. The other clients are checked with the protocol-level pings of the server, and their sockets
+            are reaped when a send to them fails.
+        '''
+
+        now = time.monotonic()
+        alive, idle = [], []
+        for websocket, connection in list(self.active_connections.items()):
+            if not connection.heartbeat:
+                continue
+            if now - connection.last_seen > idle_timeout:
+                idle.append((websocket, connection.username))
+            else:
+                alive.append(websocket)
+        await asyncio.gather(*(self.reap(websocket, username) for websocket, username in idle),
+                             *(self.send_or_reap(ping, websocket) for websocket in alive), return_exceptions=True)
+
+    async def reap(self, websocket: WebSocket, username: str):
+        '''
+            Closes a socket that stopped answering. Its receive loop ends with it, or never wakes up again when the
+            connection is half-open, so it is unregistered here in both cases.
+        '''
+
+        if websocket not in self.active_connections:
+            return
+        self.metrics.connections_reaped += 1
+        try:
+            await asyncio.wait_for(websocket.close(code=1001), CLOSE_TIMEOUT)
+        except Exception:
+            pass
+        await self.disconnect(websocket, username)
+
+    def stats(self) -> dict:
+        return self.metrics.snapshot(len(self.active_connections), len(self.online_users))
 
-    async def handle_message(self, message: str, websocket: WebSocket, username: str):
+    async def handle_message(self, message: Union[str, bytes], websocket: WebSocket, username: str):
         try:
-            json_decoded = json.loads(message)
+            connection = self.active_connections.get(websocket)
+            json_decoded = decode_message(message, connection.encoding if connection else JSON)
             message_type = json_decoded.get("type")
             message_content = json_decoded.get("msg")
 
             if message_type == "msg":
                 recipient = json_decoded.get("recipient")
-                if recipient in self.online_users:
-                    await self.send_personal_message({"type": "msg", "msg": f"{username} says: {message_content}"},
-                                                     self.online_users[recipient])
+                if await self.is_online(recipient):
+                    await self.send_to_user(recipient, {"type": "msg", "msg": f"{username} says: {message_content}"})
                 else:
                     await self.send_personal_message({"type": "error", "msg": f"User {recipient} is not online"}, websocket)
+            elif message_type == "pong":
+                # Receiving it already marked the socket as alive
+                if connection is not None:
+                    connection.heartbeat = True
+            elif message_type == "ping":
+                if connection is not None:
+                    connection.heartbeat = True
+                await self.send_personal_message({"type": "pong"}, websocket)
+            elif message_type in self.handlers:
+                await self.handlers[message_type](json_decoded, websocket, username)
             else:
                 await self.send_personal_message({"type": "error", "msg": "Unknown message type"}, websocket)
-        except json.JSONDecodeError:
-            await self.send_personal_message({"type": "error", "msg": "Invalid JSON format"}, websocket)
+        except ValueError as error:
+            await self.send_personal_message({"type": "error", "msg": str(error)}, websocket)
 
 
 manager = ConnectionManager()
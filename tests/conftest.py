@@ -12,6 +12,7 @@ from services.database import initialize_db_connection, create_indexes, get_db,
 from httpx import AsyncClient
 from services.auth import create_access_token
 from core.config import ACCESS_TOKEN_EXPIRE_MINUTES
+from services.tournament_lobby import available_tournaments_cache
 
 
 @pytest.fixture(scope="session")
@@ -42,8 +43,8 @@ async def clear_db():
     await db.matches.delete_many({"participants": "testuser"})
     await db.matches.delete_many({"participants": "testuser2"})
     await db.tournaments.delete_many({"owner": "testuser"})
-    await db.users.insert_one({"username": "testuser", "email": "testuser@testuser.com", "_id": default_id(), "rating": 1500, "password":'testpw'})
-    await db.users.insert_one({"username": "testuser2", "email": "testuser2@testuser.com", "_id": default_id(), "rating": 1500, "password":'testpw'})
+    await db.users.insert_one({"username": "testuser", "username_lower": "testuser", "email": "testuser@testuser.com", "_id": default_id(), "rating": 1500, "password":'testpw'})
+    await db.users.insert_one({"username": "testuser2", "username_lower": "testuser2", "email": "testuser2@testuser.com", "_id": default_id(), "rating": 1500, "password":'testpw'})
 
 
 async def clear_matches():
@@ -53,6 +54,7 @@ async def clear_matches():
 async def clear_tournaments():
     db = get_db()
     await db.tournaments.delete_many({})
+    available_tournaments_cache.clear()
 
 
 @pytest.fixture(scope="session")
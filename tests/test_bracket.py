@@ -0,0 +1,53 @@
+import random
+
+import pytest
+
+from services.bracket import BYE, advance, bracket_layout, bracket_size, resolve, seed_order, start_bracket
+
+
+def play_bracket(participant_count: int, double: bool, rng: random.Random):
+    layout = bracket_layout(bracket_size(participant_count), double)
+    slots = start_bracket(participant_count, double)
+    writes, ready = resolve(layout, slots, range(len(slots)))
+    losses = [0] * participant_count
+
+    def write(writes):
+        while writes:
+            for slot, value in writes.items():
+                assert slots[slot] is None
+                slots[slot] = value
+            writes, more_ready = resolve(layout, slots, list(writes))
+            ready.extend(more_ready)
+
+    write(writes)
+    played, champion = 0, None
+    while ready:
+        match = ready.pop(rng.randrange(len(ready)))
+        player1, player2 = slots[2 * match], slots[2 * match + 1]
+        assert BYE not in (player1, player2) and player1 != player2
+        winner = rng.choice((player1, player2))
+        losses[player2 if winner == player1 else player1] += 1
+        played += 1
+        writes, champion = advance(layout, slots, match, winner)
+        write(writes)
+    return champion, losses, played
+
+
+@pytest.mark.parametrize("double", [False, True])
+@pytest.mark.parametrize("participant_count", [2, 3, 5, 8, 13, 64])
+def test_bracket_eliminates_everybody_but_the_champion(participant_count, double):
+    rng = random.Random(participant_count)
+    for _ in range(10):
+        champion, losses, played = play_bracket(participant_count, double, rng)
+
+        assert champion is not None
+        assert losses[champion] < (2 if double else 1)
+        assert sorted(losses).count(2 if double else 1) == participant_count - 1
+        if not double:
+            assert played == participant_count - 1
+
+
+def test_best_seeds_get_the_byes_and_meet_last():
+    assert seed_order(8) == [0, 7, 3, 4, 1, 6, 2, 5]
+    slots = start_bracket(6, double=False)
+    assert slots[6:] == [0, BYE, 3, 4, 1, BYE, 2, 5]
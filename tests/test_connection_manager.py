@@ -0,0 +1,91 @@
+import pytest
+
+from services.event_bus import LocalEventBus
+from services.game_actions import game_command
+from services.protocol import Payload
+from services.websocket import ConnectionManager, manager as application_manager
+from tests.test_event_bus import FakeWebSocket
+
+
+class ClosableWebSocket(FakeWebSocket):
+    def __init__(self):
+        super().__init__()
+        self.close_code = None
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+@pytest.mark.anyio
+async def test_heartbeat_pings_live_sockets_and_reaps_idle_ones():
+    manager = ConnectionManager(LocalEventBus())
+    live, idle, receive_only = ClosableWebSocket(), ClosableWebSocket(), ClosableWebSocket()
+    await manager.connect(live, "alice")
+    await manager.connect(idle, "bob")
+    await manager.connect(receive_only, "carol")
+    for websocket in (live, idle):
+        manager.active_connections[websocket].heartbeat = True
+    manager.active_connections[idle].last_seen -= 120
+    manager.active_connections[receive_only].last_seen -= 120
+
+    await manager.heartbeat(Payload({"type": "ping"}), idle_timeout=60)
+
+    assert live.sent == [{"type": "ping"}] and live.close_code is None
+    assert idle.sent == [] and idle.close_code == 1001
+    # Never took part in the heartbeat
+    assert receive_only.sent == [] and receive_only.close_code is None
+    assert list(manager.active_connections) == [live, receive_only]
+    assert not await manager.is_online("bob")
+    stats = manager.stats()
+    assert stats["open_sockets"] == 2 and stats["online_users"] == 2
+    assert stats["connections_reaped"] == 1 and stats["connections_closed"] == 1
+    assert stats["messages_out"] == 1 and stats["bytes_out"] == len('{"type":"ping"}')
+
+
+@pytest.mark.anyio
+async def test_ping_is_answered_with_pong():
+    manager = ConnectionManager(LocalEventBus())
+    websocket = ClosableWebSocket()
+    await manager.connect(websocket, "alice")
+    await manager.handle_message('{"type": "ping"}', websocket, "alice")
+    await manager.handle_message('{"type": "pong"}', websocket, "alice")
+    assert websocket.sent == [{"type": "pong"}]
+    assert manager.active_connections[websocket].heartbeat
+
+
+@pytest.mark.anyio
+async def test_failing_game_command_replies_with_an_error():
+    @game_command("test_failing_command")
+    async def failing_command(username: str):
+        raise KeyError("board")
+
+    websocket = FakeWebSocket()
+    await application_manager.connect(websocket, "alice")
+    try:
+        await application_manager.handle_message('{"type": "test_failing_command", "id": "c1"}', websocket, "alice")
+    finally:
+        del application_manager.handlers["test_failing_command"]
+        await application_manager.disconnect(websocket, "alice")
+    assert websocket.sent == [{"id": "c1", "type": "error", "status": 500, "msg": "Internal server error"}]
+
+
+class BrokenWebSocket(ClosableWebSocket):
+    async def send_text(self, text):
+        raise ConnectionResetError("half-open")
+
+
+@pytest.mark.anyio
+async def test_socket_is_reaped_when_a_send_to_it_fails():
+    manager = ConnectionManager(LocalEventBus())
+    await manager.start()
+    broken, working = BrokenWebSocket(), ClosableWebSocket()
+    await manager.connect(broken, "alice")
+    await manager.connect(working, "alice")
+    try:
+        await manager.send_to_user("alice", {"type": "msg"})
+    finally:
+        await manager.stop()
+    assert working.sent == [{"type": "msg"}]
+    assert broken.close_code == 1001 and list(manager.active_connections) == [working]
+    stats = manager.stats()
+    assert stats["send_errors"] == 1 and stats["connections_reaped"] == 1
@@ -0,0 +1,197 @@
+import asyncio
+import json
+from unittest.mock import patch
+
+import pytest
+
+from services.event_bus import LocalEventBus, MongoEventBus, TOPIC, USER
+from services.websocket import ConnectionManager
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.scope = {"subprotocols": []}
+        self.sent = []
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+
+@pytest.mark.anyio
+async def test_local_bus_delivers_to_online_users_only():
+    manager = ConnectionManager(LocalEventBus())
+    await manager.start()
+    websocket = FakeWebSocket()
+    await manager.connect(websocket, "alice")
+    await manager.send_to_user("alice", {"type": "msg"})
+    await manager.send_to_user("bob", {"type": "msg"})
+    assert websocket.sent == [{"type": "msg"}]
+    assert await manager.is_online("alice") and not await manager.is_online("bob")
+
+    await manager.disconnect(websocket, "alice")
+    await manager.send_to_user("alice", {"type": "msg"})
+    assert websocket.sent == [{"type": "msg"}]
+    assert await manager.online_usernames() == []
+
+
+@pytest.mark.anyio
+async def test_presence_is_looked_up_for_the_given_usernames():
+    manager = ConnectionManager(LocalEventBus())
+    await manager.start()
+    for username in ["carol", "alice", "bob"]:
+        await manager.connect(FakeWebSocket(), username)
+    assert await manager.online_among(["alice", "dave"]) == {"alice"}
+    assert [username async for username in manager.iter_online_usernames("alice")] == ["bob", "carol"]
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def __aiter__(self):
+        return self.iterate()
+
+    async def iterate(self):
+        for document in self.documents:
+            yield document
+
+
+class FakeCollection:
+    def __init__(self):
+        self.documents = []
+        self.inserted = []
+
+    def find(self, query, projection=None):
+        (field, condition), = query.items()
+        return FakeCursor([document for document in self.documents if document[field] in condition["$in"]])
+
+    async def insert_many(self, documents, ordered=True):
+        self.inserted.extend(documents)
+
+
+@pytest.mark.anyio
+async def test_mongo_bus_batches_messages_per_worker():
+    presence, events = FakeCollection(), FakeCollection()
+    presence.documents = [{"username": "alice", "worker": "w1"}, {"username": "bob", "worker": "w1"},
+                          {"username": "carol", "worker": "w2"}, {"username": "carol", "worker": "w1"}]
+    bus = MongoEventBus()
+    subscriptions = FakeCollection()
+    subscriptions.documents = [{"topic": "match:1", "worker": "w2"}]
+    batch = [(USER, "alice", {"n": 1}, False), (USER, "carol", {"n": 2}, False), (USER, "bob", {"n": 3}, False),
+             (USER, "dave", {"n": 4}, False), (TOPIC, "match:1", {"n": 5}, False), (TOPIC, "match:2", {"n": 6}, False)]
+    with patch("services.event_bus.get_db", return_value={"presence": presence, "events": events,
+                                                          "topic_subscriptions": subscriptions}):
+        await bus.send_batch(batch)
+    assert {document["worker"]: document["messages"] for document in events.inserted} == {
+        "w1": [{"username": "alice", "payload": {"message": {"n": 1}, "delta": None}},
+               {"username": "carol", "payload": {"message": {"n": 2}, "delta": None}},
+               {"username": "bob", "payload": {"message": {"n": 3}, "delta": None}}],
+        "w2": [{"username": "carol", "payload": {"message": {"n": 2}, "delta": None}},
+               {"topic": "match:1", "payload": {"message": {"n": 5}, "delta": None}}],
+    }
+
+
+@pytest.mark.anyio
+async def test_mongo_bus_delivers_locally_and_to_the_other_workers_of_the_user():
+    delivered = []
+
+    async def deliver(username, message):
+        delivered.append((username, message))
+
+    bus = MongoEventBus()
+    bus.deliver, bus.pending_event = deliver, asyncio.Event()
+    bus.local.add("alice")
+    await bus.publish("alice", {"n": 1})
+    assert delivered == [("alice", {"n": 1})]
+    assert bus.pending == [(USER, "alice", {"n": 1}, True)]
+
+    presence, events = FakeCollection(), FakeCollection()
+    presence.documents = [{"username": "alice", "worker": bus.worker_id}, {"username": "alice", "worker": "w2"}]
+    with patch("services.event_bus.get_db", return_value={"presence": presence, "events": events}):
+        await bus.send_batch(bus.pending)
+    # Not delivered twice here
+    assert delivered == [("alice", {"n": 1})]
+    assert [(document["worker"], document["messages"]) for document in events.inserted] == [
+        ("w2", [{"username": "alice", "payload": {"message": {"n": 1}, "delta": None}}])]
+
+
+class FailingChangeStream:
+    def __init__(self, changes, resume_token):
+        self.changes = changes
+        self.resume_token = resume_token
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def __aiter__(self):
+        return self.iterate()
+
+    async def iterate(self):
+        for change in self.changes:
+            self.resume_token = {"after": change["fullDocument"]["messages"][0]["username"]}
+            yield change
+        raise ConnectionError("primary stepped down")
+
+
+class WatchedCollection:
+    def __init__(self, streams):
+        self.streams = streams
+        self.resumed_after = []
+
+    def watch(self, pipeline, resume_after=None):
+        self.resumed_after.append(resume_after)
+        return self.streams.pop(0)
+
+
+@pytest.mark.anyio
+async def test_mongo_bus_resumes_the_change_stream_after_a_failure():
+    delivered = []
+
+    async def deliver(username, message):
+        delivered.append(username)
+
+    def change(username):
+        return {"fullDocument": {"messages": [{"username": username, "payload": {"message": {}, "delta": None}}]}}
+
+    events = WatchedCollection([FailingChangeStream([change("alice")], {"start": 1}),
+                                FailingChangeStream([change("bob")], {"start": 2})])
+    bus = MongoEventBus()
+    bus.deliver = deliver
+    ready = asyncio.get_running_loop().create_future()
+    with patch("services.event_bus.get_db", return_value={"events": events}), \
+            patch("services.event_bus.CONSUME_RETRY_DELAY", 0):
+        task = asyncio.create_task(bus.consume(ready))
+        await ready
+        while len(events.resumed_after) < 3 and not task.done():
+            await asyncio.sleep(0)
+        task.cancel()
+    assert delivered == ["alice", "bob"]
+    assert events.resumed_after[:2] == [None, {"after": "alice"}]
+
+
+@pytest.mark.anyio
+async def test_every_session_of_a_user_receives_messages():
+    manager = ConnectionManager(LocalEventBus())
+    await manager.start()
+    first_tab, second_tab = FakeWebSocket(), FakeWebSocket()
+    await manager.connect(first_tab, "alice")
+    await manager.connect(second_tab, "alice")
+    await manager.send_to_user("alice", {"n": 1})
+    assert first_tab.sent == second_tab.sent == [{"n": 1}]
+
+    # Closing one tab keeps the user online and the other tab connected
+    await manager.disconnect(first_tab, "alice")
+    assert await manager.is_online("alice")
+    await manager.send_to_user("alice", {"n": 2})
+    assert first_tab.sent == [{"n": 1}]
+    assert second_tab.sent == [{"n": 1}, {"n": 2}]
+
+    await manager.disconnect(second_tab, "alice")
+    assert not await manager.is_online("alice")
+    assert not manager.active_connections and not manager.online_users
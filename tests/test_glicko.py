@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from services.glicko import rating_period_update, new_glicko_ratings_after_match, DEFAULT_RATING_DEVIATION, \
+    DEFAULT_VOLATILITY
+
+
+def test_rating_period_update_matches_glickman_example():
+    # Example from Glickman's "Example of the Glicko-2 system"
+    ratings = np.array([1500, 1400, 1550, 1700], dtype=np.float64)
+    deviations = np.array([200, 30, 100, 300], dtype=np.float64)
+    volatilities = np.full(4, 0.06)
+    fixed = np.array([False, True, True, True])
+
+    rating_period_update(ratings, deviations, volatilities, np.array([0, 0, 0]), np.array([1, 2, 3]),
+                         np.array([1.0, 0.0, 0.0]), fixed)
+
+    assert ratings[0] == pytest.approx(1464.06, abs=0.01)
+    assert deviations[0] == pytest.approx(151.52, abs=0.01)
+    assert volatilities[0] == pytest.approx(0.05999, abs=1e-5)
+    assert ratings[1:].tolist() == [1400, 1550, 1700]
+
+
+def test_idle_players_deviation_grows():
+    ratings = np.array([1500.0])
+    deviations = np.array([50.0])
+    volatilities = np.array([DEFAULT_VOLATILITY])
+    empty = np.array([], dtype=np.int64)
+
+    rating_period_update(ratings, deviations, volatilities, empty, empty, np.array([]), np.array([False]))
+
+    assert ratings[0] == 1500
+    assert deviations[0] > 50
+
+
+def test_new_glicko_ratings_after_match():
+    player = (1500, DEFAULT_RATING_DEVIATION, DEFAULT_VOLATILITY)
+    (winner_rating, winner_deviation, _), (loser_rating, loser_deviation, _) = \
+        new_glicko_ratings_after_match(player, player)
+
+    assert winner_rating > 1500 > loser_rating
+    assert winner_rating - 1500 == 1500 - loser_rating
+    assert winner_deviation < DEFAULT_RATING_DEVIATION
+    assert loser_deviation < DEFAULT_RATING_DEVIATION
+
+
+def test_fixed_opponent_is_not_updated():
+    _, ai = new_glicko_ratings_after_match((1500, 350, 0.06), (1800, 150, 0.06), loser_fixed=True)
+    assert ai == (1800, 150, 0.06)
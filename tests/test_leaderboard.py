@@ -0,0 +1,39 @@
+from services.leaderboard import Leaderboard
+
+
+def make_leaderboard(ratings):
+    leaderboard = Leaderboard()
+    leaderboard.loaded = True
+    for username, rating in ratings.items():
+        leaderboard.update(username, rating)
+    return leaderboard
+
+
+def test_position_and_top():
+    leaderboard = make_leaderboard({"a": 1500, "b": 1700, "c": 1600, "d": 1200})
+    assert leaderboard.top(2) == ["b", "c"]
+    assert leaderboard.position("b") == 1
+    assert leaderboard.position("a") == 3
+    assert leaderboard.position("d") == 4
+    assert leaderboard.position("missing") == 0
+
+
+def test_update_moves_user():
+    leaderboard = make_leaderboard({"a": 1500, "b": 1700, "c": 1600})
+    leaderboard.update("a", 1800)
+    assert leaderboard.top(3) == ["a", "b", "c"]
+    leaderboard.update("a", 1000)
+    assert leaderboard.top(3) == ["b", "c", "a"]
+    assert len(leaderboard.ranking) == 3
+
+
+def test_ties_are_broken_by_username():
+    leaderboard = make_leaderboard({"b": 1500, "a": 1500})
+    assert leaderboard.top(2) == ["a", "b"]
+    assert leaderboard.position("b") == 2
+
+
+def test_update_ignored_until_loaded():
+    leaderboard = Leaderboard()
+    leaderboard.update("a", 1500)
+    assert leaderboard.ranking == []
@@ -0,0 +1,82 @@
+import pytest
+from httpx import AsyncClient
+
+from models.board_configuration import Match
+from services.database import MATCH_EVENTS_COLLECTION, get_db
+from services.match_events import MatchEvents, changes_since, diff_match, update_payload
+from services.protocol import JSON, MSGPACK
+
+
+def make_match() -> Match:
+    return Match(player1="alice", player2="bob", status="started", rounds_to_win=1, turn=0, dice=[3, 5],
+                 available=[3, 5])
+
+
+def move(match: Match):
+    board = match.board_configuration.model_dump()
+    board["points"][0]["player2"] -= 1
+    board["points"][3]["player2"] += 1
+    match.board_configuration = board
+    match.available = [5]
+
+
+def test_diff_match_lists_changed_points():
+    match = make_match()
+    old = match.model_dump(by_alias=True)
+    move(match)
+    changes = diff_match(old, match.model_dump(by_alias=True))
+    assert changes["board_configuration"] == {"points": [[0, 0, 1], [3, 0, 1]]}
+    assert changes["available"] == [5]
+    assert "player1" not in changes and "dice" not in changes
+
+
+def test_delta_payloads_are_compact():
+    match = make_match()
+    old = match.model_dump(by_alias=True)
+    move(match)
+    state = match.model_dump(by_alias=True)
+    payload = update_payload("move_piece", state, 2, diff_match(old, state))
+    assert payload.delta["version"] == 2
+    assert payload.delta["changes"]["available"] == [5]
+    assert len(payload.encode(MSGPACK, deltas=True)) < 100
+    assert len(payload.encode(JSON, deltas=True)) * 5 < len(payload.encode(JSON))
+    assert update_payload("move_piece", state, 1, None).delta is None
+
+
+def test_changes_since_needs_every_missed_version():
+    log = {"version": 4, "history": [{"version": 1, "changes": None}, {"version": 2, "changes": {"turn": 1}},
+                                     {"version": 4, "changes": {"turn": 3}}, {"version": 3, "changes": {"turn": 2}}]}
+    log["history"].sort(key=lambda event: event["version"])
+    assert [event["version"] for event in changes_since(log, 1)] == [2, 3, 4]
+    assert changes_since(log, 4) == []
+    # The first version was a snapshot: it can only be caught up with the whole match
+    assert changes_since(log, 0) is None
+    assert changes_since(log, 5) is None
+    assert changes_since(None, 1) is None
+    # Version 3 not pushed yet
+    assert changes_since({"version": 4, "history": [log["history"][1], log["history"][3]]}, 1) is None
+
+
+@pytest.mark.anyio
+async def test_updates_from_two_workers_share_the_versions(client: AsyncClient):
+    match = make_match()
+    await get_db()[MATCH_EVENTS_COLLECTION].delete_many({"_id": match.id})
+    worker1, worker2 = MatchEvents(), MatchEvents()
+    first = await worker1.update("move_piece", match)
+    assert first.message["version"] == 1 and first.delta is None
+
+    move(match)
+    second = await worker2.update("move_piece", match)
+    assert second.delta["version"] == 2
+    assert second.delta["changes"]["board_configuration"] == {"points": [[0, 0, 1], [3, 0, 1]]}
+
+    match.turn = 1
+    third = await worker1.update("pass_turn", match)
+    # Diffed against the state sent by the other worker
+    assert third.delta["version"] == 3
+    assert "board_configuration" not in third.delta["changes"] and third.delta["changes"]["turn"] == 1
+
+    log = await worker2.log(match.id)
+    assert [event["version"] for event in changes_since(log, 1)] == [2, 3]
+    assert (await worker1.snapshot(match.id))[0] == 3
+    await get_db()[MATCH_EVENTS_COLLECTION].delete_many({"_id": match.id})
@@ -0,0 +1,122 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import pytest
+from httpx import AsyncClient
+
+from services.database import MATCHMAKING_COLLECTION, MATCHMAKING_TICKET_TTL, get_db
+from services.matchmaking import MatchmakingQueue, MongoMatchmakingBackend, WIDEN_INTERVAL
+
+
+def test_enqueue_pairs_players_in_neighbouring_bands():
+    queue = MatchmakingQueue()
+    assert queue.enqueue("alice", 1500, now=0) is None
+    waiting, new = queue.enqueue("bob", 1540, now=1)
+    assert (waiting.username, new.username) == ("alice", "bob")
+    assert "alice" not in queue and "bob" not in queue
+
+
+def test_enqueue_prefers_the_closest_rating():
+    queue = MatchmakingQueue()
+    queue.enqueue("alice", 1400, now=0)
+    queue.enqueue("carol", 1530, now=0)
+    waiting, _ = queue.enqueue("bob", 1480, now=1)
+    assert waiting.username == "carol"
+    assert "alice" in queue
+
+
+def test_distant_players_wait_until_the_search_widens():
+    queue = MatchmakingQueue()
+    queue.enqueue("alice", 1000, now=0)
+    assert queue.enqueue("bob", 1300, now=0) is None
+    assert queue.sweep(now=WIDEN_INTERVAL) == []
+    pairs = queue.sweep(now=5 * WIDEN_INTERVAL)
+    assert [(a.username, b.username) for a, b in pairs] == [("alice", "bob")]
+    assert queue.stats(now=5 * WIDEN_INTERVAL)["queue_depth"] == 0
+
+
+def test_cancel_removes_the_ticket():
+    queue = MatchmakingQueue()
+    queue.enqueue("alice", 1500, now=0)
+    assert queue.cancel("alice")
+    assert not queue.cancel("alice")
+    assert queue.enqueue("bob", 1500, now=1) is None
+    assert queue.band_keys == [1500 // 50]
+
+
+def test_stats():
+    queue = MatchmakingQueue()
+    queue.enqueue("alice", 1500, now=0)
+    queue.enqueue("bob", 1510, now=4)
+    queue.enqueue("carol", 2000, now=6)
+    stats = queue.stats(now=10)
+    assert stats["queue_depth"] == 1
+    assert stats["bands"] == {2000: 1}
+    assert stats["longest_wait"] == 4
+    assert stats["matches_made"] == 1
+    assert stats["average_wait"] == 2
+
+
+@pytest.mark.anyio
+async def test_mongo_backend_pairs_across_workers(client: AsyncClient):
+    await get_db()[MATCHMAKING_COLLECTION].delete_many({})
+    worker1, worker2 = MongoMatchmakingBackend(), MongoMatchmakingBackend()
+    assert await worker1.enqueue("mm_alice", 1500) is None
+    assert await worker2.is_queued("mm_alice")
+    waiting, new = await worker2.enqueue("mm_bob", 1520)
+    assert (waiting.username, new.username) == ("mm_alice", "mm_bob")
+    assert not await worker1.is_queued("mm_alice")
+
+
+@pytest.mark.anyio
+async def test_mongo_backend_never_matches_a_player_twice(client: AsyncClient):
+    await get_db()[MATCHMAKING_COLLECTION].delete_many({})
+    workers = [MongoMatchmakingBackend() for _ in range(4)]
+    for i in range(10):
+        await workers[0].enqueue(f"mm_waiting{i}", 1500)
+    results = await asyncio.gather(*(workers[i % 4].enqueue(f"mm_new{i}", 1500) for i in range(20)))
+    paired = [ticket.username for pair in results if pair for ticket in pair]
+    assert len(paired) == len(set(paired))
+    assert sum(1 for name in paired if name.startswith("mm_waiting")) == 10
+    await get_db()[MATCHMAKING_COLLECTION].delete_many({})
+
+
+@pytest.mark.anyio
+async def test_mongo_backend_sweep_does_not_pair_a_player_who_queued_again(client: AsyncClient):
+    await get_db()[MATCHMAKING_COLLECTION].delete_many({})
+    worker, other_worker = MongoMatchmakingBackend(), MongoMatchmakingBackend()
+    await worker.enqueue("mm_alice", 1500)
+    await worker.enqueue("mm_bob", 3000)
+    await get_db()[MATCHMAKING_COLLECTION].update_one({"_id": "mm_alice"}, {"$set": {"searched_bands": -1}})
+    await get_db()[MATCHMAKING_COLLECTION].update_one({"_id": "mm_bob"}, {"$set": {"rating": 1500}})
+    claim_opponent = worker.claim_opponent
+
+    async def claim_while_alice_queues_again(ticket, search_bands):
+        opponent = await claim_opponent(ticket, search_bands)
+        await other_worker.cancel("mm_alice")
+        await other_worker.enqueue("mm_alice", 1500)
+        return opponent
+
+    with patch.object(worker, "claim_opponent", claim_while_alice_queues_again):
+        assert await worker.sweep() == []
+    assert await worker.is_queued("mm_alice") and await worker.is_queued("mm_bob")
+    await get_db()[MATCHMAKING_COLLECTION].delete_many({})
+
+
+@pytest.mark.anyio
+async def test_mongo_backend_refreshes_the_tickets_of_connected_players(client: AsyncClient):
+    await get_db()[MATCHMAKING_COLLECTION].delete_many({})
+    worker = MongoMatchmakingBackend()
+    await worker.enqueue("mm_alice", 1500)
+    await worker.enqueue("mm_bob", 3000)
+    expiring = datetime.now(timezone.utc) - timedelta(seconds=MATCHMAKING_TICKET_TTL - 1)
+    await get_db()[MATCHMAKING_COLLECTION].update_many({}, {"$set": {"created_at": expiring}})
+
+    await worker.refresh(["mm_alice", "mm_carol"])
+
+    tickets = {document["_id"]: document["created_at"].replace(tzinfo=timezone.utc)
+               async for document in get_db()[MATCHMAKING_COLLECTION].find()}
+    assert tickets["mm_alice"] > expiring + timedelta(seconds=MATCHMAKING_TICKET_TTL / 2)
+    assert tickets["mm_bob"] < expiring + timedelta(seconds=1)
+    await get_db()[MATCHMAKING_COLLECTION].delete_many({})
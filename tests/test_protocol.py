@@ -0,0 +1,31 @@
+import msgpack
+
+from models.board_configuration import BoardConfiguration, Match
+from services.protocol import JSON, MSGPACK, Payload, decode_board, decode_match, encode_board, negotiate_subprotocol
+
+
+def test_board_round_trip():
+    board = BoardConfiguration().model_dump()
+    board["bar"] = {"player1": 1, "player2": 2}
+    packed = encode_board(board)
+    assert len(packed) == 26
+    assert decode_board(packed) == board
+
+
+def test_negotiate_subprotocol():
+    assert negotiate_subprotocol(["unknown", "backgammon.msgpack"]) == ("backgammon.msgpack", MSGPACK, False)
+    assert negotiate_subprotocol(["backgammon.json", "backgammon.msgpack"]) == ("backgammon.json", JSON, False)
+    assert negotiate_subprotocol(["backgammon.delta.json"]) == ("backgammon.delta.json", JSON, True)
+    assert negotiate_subprotocol(None) == (None, JSON, False)
+
+
+def test_payload_is_encoded_once_per_encoding():
+    match = Match(player1="alice", player2="bob", rounds_to_win=1).dict(by_alias=True)
+    payload = Payload({"type": "move_piece", "match": match})
+    packed = payload.encode(MSGPACK)
+    assert payload.encode(MSGPACK) is packed
+    assert len(packed) * 7 < len(payload.encode(JSON))
+
+    decoded = msgpack.unpackb(packed)
+    assert decoded["type"] == "move_piece"
+    assert decode_match(decoded["match"]) == match
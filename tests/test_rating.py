@@ -1,4 +1,8 @@
-from services.rating import new_ratings_after_match, MINIMUM_RATING
+import random
+
+import numpy as np
+
+from services.rating import new_ratings_after_match, batch_ratings_after_matches, MINIMUM_RATING, DEFAULT_RATING
 
 
 def test_new_ratings_after_match_normal_case():
@@ -33,3 +37,39 @@ def test_new_ratings_scaling():
 
     # Loser lost more rating when playing against a similarly rated opponent
     assert loser_rating1 - new_loser_rating1 > loser_rating2 - new_loser_rating2
+
+
+def test_batch_ratings_match_sequential_updates():
+    rng = random.Random(42)
+    players = 20
+    fixed = np.zeros(players, dtype=bool)
+    fixed[0] = True  # AI opponent with a constant rating
+    matches = [tuple(rng.sample(range(players), 2)) for _ in range(2000)]
+
+    expected = [DEFAULT_RATING] * players
+    expected[0] = 1800
+    expected_highest = list(expected)
+    for winner, loser in matches:
+        new_winner_rating, new_loser_rating = new_ratings_after_match(expected[winner], expected[loser])
+        if not fixed[winner]:
+            expected[winner] = new_winner_rating
+            expected_highest[winner] = max(expected_highest[winner], new_winner_rating)
+        if not fixed[loser]:
+            expected[loser] = new_loser_rating
+
+    ratings = np.full(players, DEFAULT_RATING, dtype=np.float64)
+    ratings[0] = 1800
+    winners = np.array([winner for winner, _ in matches])
+    losers = np.array([loser for _, loser in matches])
+    highest = batch_ratings_after_matches(winners, losers, ratings, fixed)
+
+    assert ratings.astype(int).tolist() == expected
+    assert highest.astype(int).tolist() == expected_highest
+
+
+def test_batch_ratings_without_matches():
+    ratings = np.full(3, DEFAULT_RATING, dtype=np.float64)
+    highest = batch_ratings_after_matches(np.array([], dtype=np.int64), np.array([], dtype=np.int64), ratings,
+                                          np.zeros(3, dtype=bool))
+    assert ratings.tolist() == [DEFAULT_RATING] * 3
+    assert highest.tolist() == [DEFAULT_RATING] * 3
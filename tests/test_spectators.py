@@ -0,0 +1,123 @@
+import pytest
+
+from services import spectators as spectators_module
+from services.event_bus import LocalEventBus
+from services.protocol import Payload
+from services.spectators import SpectatorHub, sample
+from services.websocket import ConnectionManager
+from tests.test_event_bus import FakeWebSocket
+
+
+class CountingPayload(Payload):
+    __slots__ = ("encodings",)
+
+    def __init__(self, message, delta=None):
+        super().__init__(message, delta)
+        self.encodings = 0
+
+    def encode(self, encoding, deltas=False):
+        if (encoding, deltas and self.delta is not None) not in self.encoded:
+            self.encodings += 1
+        return super().encode(encoding, deltas)
+
+
+async def started_hub(**options) -> SpectatorHub:
+    manager = ConnectionManager(LocalEventBus())
+    hub = SpectatorHub(manager, **options)
+    await manager.start()
+    return hub
+
+
+async def watch(hub, match_id, count):
+    sockets = []
+    for i in range(count):
+        websocket = FakeWebSocket()
+        await hub.connections.connect(websocket, f"spectator{i}")
+        await hub.subscribe(match_id, websocket)
+        sockets.append(websocket)
+    return sockets
+
+
+async def delivered(hub, match_id):
+    task = hub.audiences[match_id].task
+    if task is not None:
+        await task
+
+
+@pytest.mark.anyio
+async def test_events_are_serialized_once_for_the_whole_audience():
+    hub = await started_hub()
+    sockets = await watch(hub, "match", 50)
+    other = await watch(hub, "other", 1)
+    payload = CountingPayload({"type": "dice_roll", "result": [3, 4]})
+
+    await hub.publish("match", payload)
+    await delivered(hub, "match")
+
+    assert all(websocket.sent == [{"type": "dice_roll", "result": [3, 4]}] for websocket in sockets)
+    assert other[0].sent == []
+    assert payload.encodings == 1
+
+
+@pytest.mark.anyio
+async def test_closed_and_rewatching_sockets_leave_their_audience():
+    hub = await started_hub()
+    manager = hub.connections
+    first, second = await watch(hub, "match", 2)
+
+    await hub.subscribe("other", first)
+    await manager.disconnect(second, "spectator1")
+
+    assert "match" not in hub.audiences
+    # The worker only stays subscribed to the event bus topics of the matches it has spectators of
+    assert manager.event_bus.topics == {"match:other"}
+    assert hub.audience_size("other") == 1
+    assert manager.active_connections[first].watching == "other"
+
+
+@pytest.mark.anyio
+async def test_large_audiences_receive_the_latest_match_in_full(monkeypatch):
+    monkeypatch.setattr(spectators_module, "LARGE_AUDIENCE", 2)
+    hub = await started_hub(sample_interval=0)
+    sockets = await watch(hub, "match", 2)
+    header = {"type": "move_piece", "match_id": "match"}
+
+    await hub.publish("match", Payload({**header, "version": 1, "match": {"turn": 1}}, {**header, "changes": {"turn": 1}}))
+    await hub.publish("match", {"type": "in_game_msg", "msg": "gg"})
+    await hub.publish("match", Payload({**header, "version": 2, "match": {"turn": 2}}, {**header, "changes": {"turn": 2}}))
+    await delivered(hub, "match")
+
+    assert sockets[0].sent == [{"type": "in_game_msg", "msg": "gg"}, {**header, "version": 2, "match": {"turn": 2}}]
+
+
+def test_sample_keeps_other_messages_in_order():
+    chat, update = Payload({"type": "in_game_msg"}), Payload({"type": "move_piece", "match": {}}, {"changes": {}})
+
+    sampled = sample([update, chat, update])
+
+    assert sampled[0] is chat and sampled[1].message is update.message and sampled[1].delta is None
+    assert sample([chat]) == [chat]
+
+
+@pytest.mark.anyio
+async def test_watch_replies_with_the_state_of_the_snapshot(monkeypatch):
+    match = {"_id": "match", "player1": "alice", "player2": "bob", "rounds_to_win": 1, "status": "started",
+             "turn": 2}
+
+    async def snapshot(match_id):
+        return 7, match
+
+    def matches_read():
+        raise AssertionError("The match is read from its snapshot")
+
+    monkeypatch.setattr(spectators_module.match_events, "snapshot", snapshot)
+    monkeypatch.setattr(spectators_module, "get_db", matches_read)
+    websocket = FakeWebSocket()
+    await spectators_module.manager.connect(websocket, "spectator")
+    try:
+        await spectators_module.watch({"type": "watch", "match_id": "match"}, websocket, "spectator")
+    finally:
+        await spectators_module.manager.disconnect(websocket, "spectator")
+    reply, = websocket.sent
+    assert reply["type"] == "watching" and reply["version"] == 7
+    assert reply["match"]["turn"] == 2 and reply["match"]["_id"] == "match"
@@ -0,0 +1,48 @@
+import random
+
+from services.swiss import BYE, PairingHistory, swiss_pairings, swiss_rounds
+
+
+def play_swiss(participant_count: int, rng: random.Random):
+    scores = [0] * participant_count
+    rounds = []
+    for _ in range(swiss_rounds(participant_count)):
+        standings = sorted(range(participant_count), key=lambda player: (-scores[player], player))
+        pairings = swiss_pairings(standings, scores, rounds)
+        for i in range(0, len(pairings), 2):
+            player1, player2 = pairings[i], pairings[i + 1]
+            scores[player1 if player2 == BYE else rng.choice((player1, player2))] += 1
+        rounds.append(pairings)
+    return scores, rounds
+
+
+def test_swiss_rounds():
+    assert [swiss_rounds(count) for count in (2, 3, 4, 5, 8, 9, 1000)] == [1, 2, 2, 3, 3, 4, 10]
+
+
+def test_every_player_plays_once_per_round_without_rematches():
+    participant_count = 1000
+    scores, rounds = play_swiss(participant_count, random.Random(0))
+
+    pairs = set()
+    for pairings in rounds:
+        assert sorted(pairings) == list(range(participant_count))
+        pairs.update(frozenset(pairings[i:i + 2]) for i in range(0, len(pairings), 2))
+    assert len(pairs) == len(rounds) * participant_count // 2
+    assert sorted(scores)[-2:] == [9, 10]
+    assert all(abs(balance) <= 2 for balance in PairingHistory(participant_count, rounds).player1_balance)
+
+
+def test_byes_go_to_the_lowest_ranked_player_without_one():
+    scores, rounds = play_swiss(7, random.Random(1))
+
+    byes = [pairings[-2] for pairings in rounds]
+    assert all(pairings[-1] == BYE for pairings in rounds)
+    assert len(set(byes)) == len(byes)
+
+
+def test_players_are_paired_within_their_score_group():
+    scores = [2, 2, 2, 2, 1, 1, 0, 0]
+    pairings = swiss_pairings(list(range(8)), scores, [])
+
+    assert pairings == [0, 2, 1, 3, 4, 5, 6, 7]
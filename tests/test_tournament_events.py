@@ -0,0 +1,103 @@
+import pytest
+
+from services.event_bus import LocalEventBus
+from services.tournament_events import LOBBY, TournamentHub
+from services.websocket import ConnectionManager
+from tests.test_event_bus import FakeWebSocket
+
+
+async def started_hub() -> TournamentHub:
+    manager = ConnectionManager(LocalEventBus())
+    hub = TournamentHub(manager, delay=0)
+    await manager.start()
+    return hub
+
+
+async def connect(hub, username, *topics):
+    websocket = FakeWebSocket()
+    await hub.connections.connect(websocket, username)
+    for topic in topics:
+        await hub.subscribe(topic, websocket)
+    return websocket
+
+
+async def flushed(hub, topic_id):
+    topic = hub.topics.get(topic_id)
+    if topic is not None and topic.task is not None:
+        await topic.task
+
+
+@pytest.mark.anyio
+async def test_bursts_of_joins_are_coalesced():
+    hub = await started_hub()
+    watcher = await connect(hub, "watcher", "tournament", LOBBY)
+
+    for count in (2, 3, 4):
+        hub.publish("tournament", {"type": "tournament_joined", "tournament_id": "tournament",
+                                   "participant_count": count})
+    hub.publish("tournament", {"type": "tournament_started", "tournament_id": "tournament"})
+    await flushed(hub, "tournament")
+    hub.publish(LOBBY, {"type": "tournament_joined", "tournament_id": "other", "participant_count": 2})
+    await flushed(hub, LOBBY)
+
+    assert watcher.sent == [
+        {"type": "tournament_joined", "tournament_id": "tournament", "participant_count": 4},
+        {"type": "tournament_started", "tournament_id": "tournament"},
+        {"type": "tournament_joined", "tournament_id": "other", "participant_count": 2},
+    ]
+
+
+@pytest.mark.anyio
+async def test_participants_receive_each_event_once():
+    hub = await started_hub()
+    participant = await connect(hub, "alice", "tournament")
+    other_tab = await connect(hub, "alice")
+    watcher = await connect(hub, "bob", "tournament")
+
+    hub.publish("tournament", {"type": "tournament_over", "winner": "alice"}, ["alice", "carol"])
+    await flushed(hub, "tournament")
+
+    assert participant.sent == other_tab.sent == watcher.sent == [{"type": "tournament_over", "winner": "alice"}]
+
+
+@pytest.mark.anyio
+async def test_closed_sockets_are_unsubscribed():
+    hub = await started_hub()
+    websocket = await connect(hub, "alice", "tournament", LOBBY)
+
+    await hub.connections.disconnect(websocket, "alice")
+
+    assert hub.topics == {} and hub.subscriptions == {}
+    assert hub.connections.event_bus.topics == set()
+    hub.publish("tournament", {"type": "tournament_started"})
+    await flushed(hub, "tournament")
+    assert hub.topics == {} and websocket.sent == []
+
+
+class SharedTopicsBus(LocalEventBus):
+    '''
+        Local bus whose topics are shared with the other buses of the list, as the workers share the Mongo bus.
+    '''
+
+    def __init__(self, buses: list):
+        super().__init__()
+        self.buses = buses
+        buses.append(self)
+
+    async def publish_topic(self, topic, message):
+        for bus in self.buses:
+            await LocalEventBus.publish_topic(bus, topic, message)
+
+
+@pytest.mark.anyio
+async def test_subscribers_of_other_workers_receive_the_events():
+    buses = []
+    workers = [TournamentHub(ConnectionManager(SharedTopicsBus(buses)), delay=0) for _ in range(2)]
+    for hub in workers:
+        await hub.connections.start()
+    watcher = await connect(workers[1], "watcher", LOBBY)
+
+    workers[0].publish(LOBBY, {"type": "tournament_created", "tournament_id": "tournament"})
+    await flushed(workers[0], LOBBY)
+
+    assert watcher.sent == [{"type": "tournament_created", "tournament_id": "tournament"}]
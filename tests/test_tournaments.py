@@ -1,8 +1,10 @@
+import asyncio
 import pytest
 from httpx import AsyncClient
 from services.database import get_db
 from tests.conftest import clear_tournaments, clear_matches
-from services.tournament import create_new_tournament, add_participant_to_tournament, start_tournament, create_round_robin_tournament_round, get_tournament_of_game, update_tournament_of_game, update_tournament_stats, end_tournament
+from services.tournament_lobby import available_tournaments_cache, get_available_tournaments
+from services.tournament import create_new_tournament, add_participant_to_tournament, start_tournament, create_round_robin_tournament_round, get_tournament_of_game, update_tournament_of_game, update_tournament_stats, end_tournament, round_robin_schedule, backfill_tournament_slots, backfill_completed_games
 from models.tournament import CreateTournamentRequest, Tournament, JoinTournamentRequest
 from models.board_configuration import Match
 from unittest.mock import AsyncMock, patch
@@ -149,6 +151,42 @@ async def test_available_tournaments(client: AsyncClient, token: str):
     received_tournament = Tournament(**data[0])
     assert tournament == received_tournament
 
+@pytest.mark.anyio
+async def test_available_tournaments_are_paged_and_hide_full_ones():
+    await clear_tournaments()
+    await clear_matches()
+    request = CreateTournamentRequest(name="test", open=True, participants=[], rounds_to_win=1, type="round_robin",
+                                      max_participants=2)
+    for owner in ["owner1", "owner2", "owner3"]:
+        await create_new_tournament(request, owner=owner)
+
+    first_page = await get_available_tournaments("newuser", limit=2)
+    second_page = await get_available_tournaments("newuser", after=first_page[-1].id, limit=2)
+    assert [tournament.owner for tournament in first_page + second_page] == ["owner1", "owner2", "owner3"]
+    assert all(tournament.has_open_slot and tournament.participant_count == 1 for tournament in first_page)
+
+    await add_participant_to_tournament(first_page[0].id, "newuser")
+
+    tournament = await get_db().tournaments.find_one({"_id": first_page[0].id})
+    assert tournament["participant_count"] == 2 and not tournament["has_open_slot"]
+    available = await get_available_tournaments("newuser", limit=2)
+    assert [tournament.owner for tournament in available] == ["owner2", "owner3"]
+
+@pytest.mark.anyio
+async def test_tournaments_created_before_slot_fields_are_listed_after_backfill():
+    await clear_tournaments()
+    request = CreateTournamentRequest(name="test", open=True, participants=[], rounds_to_win=1, type="round_robin")
+    tournament = await create_new_tournament(request, owner="owner1")
+    await get_db().tournaments.update_one({"_id": tournament.id}, {"$unset": {
+        "participant_count": "", "has_open_slot": "", "max_participants": ""}})
+    assert await get_available_tournaments("newuser") == []
+
+    await backfill_tournament_slots()
+    available_tournaments_cache.clear()
+    available = await get_available_tournaments("newuser")
+    assert [tournament.owner for tournament in available] == ["owner1"]
+    assert available[0].participant_count == 1 and available[0].has_open_slot
+
 @pytest.mark.anyio
 async def test_add_participant_to_open_tournament():
     await clear_tournaments()
@@ -205,6 +243,25 @@ async def test_add_participant_to_full_open_tournament():
         await add_participant_to_tournament(tournament["_id"], "newuser")
     assert exc_info.value.status_code == 400
 
+@pytest.mark.anyio
+async def test_concurrent_joins_do_not_overfill_the_tournament():
+    await clear_tournaments()
+    await clear_matches()
+    await create_new_tournament(mock_request_data.model_copy(update={"max_participants": 64}), owner="testuser")
+    tournament = await get_db().tournaments.find_one({"owner": "testuser"})
+
+    results = await asyncio.gather(*(add_participant_to_tournament(tournament["_id"], f"joiner{i}")
+                                     for i in range(300)), return_exceptions=True)
+
+    assert sum(result is None for result in results) == 63
+    assert all(result is None or isinstance(result, HTTPException) and result.status_code == 400
+               for result in results)
+    tournament = await get_db().tournaments.find_one({"owner": "testuser"})
+    assert len(tournament["participants"]) == len(tournament["confirmed_participants"]) == 64
+    assert tournament["status"] == "started"
+    assert tournament["round"] == 1 and len(tournament["match_ids"]) == 32
+    assert await get_db().matches.count_documents({}) == 32
+
 @pytest.mark.anyio
 async def test_add_participant_to_closed_tournament_not_invited():
     await clear_tournaments()
@@ -279,6 +336,116 @@ async def test_create_round_robin_tournament_round():
     assert g2_p1_2 != g2_p2_2
 
 
+@pytest.mark.parametrize("participant_count", [2, 3, 4, 5, 8, 64, 65])
+def test_round_robin_schedule(participant_count):
+    schedule = round_robin_schedule(participant_count)
+
+    assert len(schedule) == (participant_count if participant_count % 2 else participant_count - 1)
+    pairs = set()
+    for pairings in schedule:
+        assert len(pairings) == participant_count // 2 * 2
+        assert len(set(pairings)) == len(pairings)
+        pairs.update(frozenset(pairings[i:i + 2]) for i in range(0, len(pairings), 2))
+    assert len(pairs) == participant_count * (participant_count - 1) // 2
+
+
+@pytest.mark.anyio
+async def test_odd_round_robin_tournament_with_byes():
+    await clear_tournaments()
+    await clear_matches()
+    await create_new_tournament(mock_request_data.model_copy(update={"max_participants": 5}), owner="testuser")
+    tournament = await get_db().tournaments.find_one({"owner": "testuser"})
+    tournament_id = tournament["_id"]
+    for participant in ["testuser2", "testuser3", "testuser4", "testuser5"]:
+        await add_participant_to_tournament(tournament_id, participant)
+
+    tournament = await get_db().tournaments.find_one({"owner": "testuser"})
+    assert tournament["status"] == "started"
+    assert len(tournament["schedule"]) == 5
+    assert tournament["round"] == 1
+    assert len(tournament["match_ids"]) == 2
+
+    played = set()
+    for round in range(1, 6):
+        tournament = await get_tournament_as_class_object("testuser")
+        assert tournament.round == round
+        for match_id in tournament.match_ids:
+            match = await get_match_as_class_object(match_id)
+            played.add(frozenset((match.player1, match.player2)))
+            await get_db().matches.update_one({"_id": match_id}, {"$set": {"status": "won_player_1"}})
+            await update_tournament_of_game(match, match.player1, match.player2, 1)
+
+    assert len(played) == 10
+    tournament = await get_db().tournaments.find_one({"owner": "testuser"})
+    assert tournament["status"] == "finished"
+
+    with pytest.raises(HTTPException) as exc_info:
+        await create_round_robin_tournament_round(tournament_id, 5)
+    assert exc_info.value.status_code == 400
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("tournament_type, matches_played", [("single_elimination", 4), ("double_elimination", 8)])
+async def test_elimination_tournament(tournament_type, matches_played):
+    await clear_tournaments()
+    await clear_matches()
+    request = mock_request_data.model_copy(update={"max_participants": 5, "type": tournament_type})
+    await create_new_tournament(request, owner="testuser")
+    tournament = await get_db().tournaments.find_one({"owner": "testuser"})
+    tournament_id = tournament["_id"]
+    for participant in ["testuser2", "testuser3", "testuser4", "testuser5"]:
+        await add_participant_to_tournament(tournament_id, participant)
+
+    tournament = await get_tournament_as_class_object("testuser")
+    assert tournament.status == "started"
+    assert len(tournament.seeding) == 5
+    # The three best seeds get a bye, the second and third seeds then meet right away
+    first_matches = [await get_match_as_class_object(match_id) for match_id in tournament.match_ids]
+    assert {frozenset((match.player1, match.player2)) for match in first_matches} == {
+        frozenset(tournament.seeding[3:]), frozenset(tournament.seeding[1:3])}
+
+    played = set()
+    while tournament.status == "started":
+        match_id = next(match_id for match_id in tournament.match_ids if match_id not in played)
+        match = await get_match_as_class_object(match_id)
+        played.add(match_id)
+        await get_db().matches.update_one({"_id": match_id}, {"$set": {"status": "won_player_1"}})
+        await update_tournament_of_game(match, match.player1, match.player2, 1)
+        tournament = await get_tournament_as_class_object("testuser")
+
+    assert len(played) == matches_played
+    assert tournament.status == "finished"
+
+
+@pytest.mark.anyio
+async def test_swiss_tournament():
+    await clear_tournaments()
+    await clear_matches()
+    request = mock_request_data.model_copy(update={"max_participants": 5, "type": "swiss"})
+    await create_new_tournament(request, owner="testuser")
+    tournament = await get_db().tournaments.find_one({"owner": "testuser"})
+    tournament_id = tournament["_id"]
+    for participant in ["testuser2", "testuser3", "testuser4", "testuser5"]:
+        await add_participant_to_tournament(tournament_id, participant)
+
+    played = set()
+    for round in range(1, 4):
+        tournament = await get_tournament_as_class_object("testuser")
+        assert tournament.status == "started" and tournament.round == round
+        assert len(tournament.schedule) == round and len(tournament.match_ids) == 2
+        for match_id in tournament.match_ids:
+            match = await get_match_as_class_object(match_id)
+            played.add(frozenset((match.player1, match.player2)))
+            await get_db().matches.update_one({"_id": match_id}, {"$set": {"status": "won_player_1"}})
+            await update_tournament_of_game(match, match.player1, match.player2, 1)
+
+    tournament = await get_tournament_as_class_object("testuser")
+    assert len(played) == 6
+    assert tournament.status == "finished"
+    # Two games and a bye per round
+    assert sum(stat.wins for stat in tournament.stats) == 9
+
+
 async def setup_basic_tournament():
     await clear_tournaments()
     await create_new_tournament(mock_request_data, owner="testuser")
@@ -368,6 +535,8 @@ async def test_update_tournament_stats():
     assert tournament.stats[1].losses == 1
 
     await update_tournament_stats(tournament, "testuser", "testuser3", 5)
+    tournament = await get_tournament_as_class_object("testuser")
+    assert tournament.completed_games == 2
     assert tournament.stats[0].wins == 2
     assert tournament.stats[0].matches == 2
     assert tournament.stats[0].points == 7
@@ -406,6 +575,7 @@ async def test_update_tournament_of_game():
     assert tot_l_after == 1
     assert tot_m_after == 2
     assert tot_p_after == 3
+    assert tournament.completed_games == 1
 
     await get_db().matches.update_one({"player1": m2.player1}, {"$set": {"status": "won_player_1"}})
     await update_tournament_of_game(m2, m2.player1, m2.player2, 4)
@@ -418,9 +588,39 @@ async def test_update_tournament_of_game():
     assert tot_w_after == 2
     assert tot_l_after == 2
     assert tot_m_after == 4
+    assert tournament.completed_games == 2
     assert tot_p_after == 7
 
     m1_id_new, m2_id_new = tournament.match_ids
     assert m1_id != m1_id_new
     assert m2_id != m2_id_new
-    assert m1_id_new != m2_id_new
\ No newline at end of file
+    assert m1_id_new != m2_id_new
+
+
+@pytest.mark.anyio
+async def test_completed_games_are_backfilled_from_the_standings():
+    await clear_tournaments()
+    await clear_matches()
+
+    await create_new_tournament(mock_request_data, owner="testuser")
+    tournament = await get_db().tournaments.find_one({"owner": "testuser"})
+    for participant in ["testuser2", "testuser3", "testuser4"]:
+        await add_participant_to_tournament(tournament["_id"], participant)
+    tournament = await get_tournament_as_class_object("testuser")
+    await update_tournament_stats(tournament, "testuser", "testuser2", 1)
+    await update_tournament_stats(tournament, "testuser3", "testuser4", 1)
+    await get_db().tournaments.update_one({"_id": tournament.id}, {"$unset": {"completed_games": ""}})
+
+    await backfill_completed_games()
+    tournament = await get_tournament_as_class_object("testuser")
+    assert tournament.completed_games == 2
+
+
+@pytest.mark.anyio
+async def test_closed_tournaments_are_announced_to_the_invited():
+    await clear_tournaments()
+    with patch("services.tournament.tournament_hub") as hub:
+        tournament = await create_new_tournament(mock_request_data_closed, owner="testuser")
+    (topic_id, event, participants), = [call.args for call in hub.publish.call_args_list]
+    assert topic_id == tournament.id and event["type"] == "tournament_created"
+    assert participants == mock_request_data_closed.participants
@@ -1,5 +1,9 @@
+from datetime import datetime, timezone
+
 import pytest
 from httpx import AsyncClient
+from services.database import get_db, RATING_HISTORY_COLLECTION
+from services.rating_history import record_rating_changes
 
 
 @pytest.mark.anyio
@@ -14,12 +18,40 @@ async def test_get_users(client: AsyncClient, token: str):
     assert response.status_code == 200
     assert isinstance(response.json(), list)
 
+@pytest.mark.anyio
+async def test_get_users_paginated(client: AsyncClient, token: str):
+    response = await client.get("/users", params={"limit": 1}, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    first_page = response.json()
+    assert len(first_page) == 1
+    assert set(first_page[0].keys()) == {"_id", "username", "online"}
+
+    response = await client.get("/users", params={"limit": 1, "after": first_page[0]["username"]}, headers={"Authorization": f"Bearer {token}"})
+    second_page = response.json()
+    assert len(second_page) <= 1
+    if second_page:
+        assert second_page[0]["username"] > first_page[0]["username"]
+
+    response = await client.get("/users", params={"online_only": True}, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert all(user["online"] for user in response.json())
+
 @pytest.mark.anyio
 async def test_search_usernames(client: AsyncClient, token: str):
     response = await client.get("/users/search", params={"query": "test"}, headers={"Authorization": f"Bearer {token}"})
     assert response.status_code == 200
     assert isinstance(response.json(), list)
 
+@pytest.mark.anyio
+async def test_search_usernames_case_insensitive_and_literal(client: AsyncClient, token: str):
+    response = await client.get("/users/search", params={"query": "TestUser"}, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert "testuser" in [user["username"] for user in response.json()]
+
+    response = await client.get("/users/search", params={"query": "te.t"}, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert response.json() == []
+
 @pytest.mark.anyio
 async def test_get_top5_and_me(client: AsyncClient, token: str):
     response = await client.get("/users/top5_and_me", headers={"Authorization": f"Bearer {token}"})
@@ -45,10 +77,44 @@ async def test_get_top5_and_me_google(client: AsyncClient, token: str):
     assert data[-1]["username"] == "testuser"
     assert "position" in data[-1]
 
+@pytest.mark.anyio
+async def test_get_leaderboard_etag(client: AsyncClient, token: str):
+    response = await client.get("/users/leaderboard", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert isinstance(response.json(), list)
+    assert response.json()[0]["position"] == 1
+    etag = response.headers["ETag"]
+
+    response = await client.get("/users/leaderboard", headers={"Authorization": f"Bearer {token}", "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
 @pytest.mark.anyio
 async def test_get_user_rating(client: AsyncClient, token: str):
     response = await client.get("/users/get_user_rating", params={"username": "testuser"}, headers={"Authorization": f"Bearer {token}"})
     assert response.status_code == 200
     assert isinstance(response.json(), int)
     response = await client.get("/users/get_user_rating", params={"username": "not_existing_user"}, headers={"Authorization": f"Bearer {token}"})
-    assert response.status_code == 404
\ No newline at end of file
+    assert response.status_code == 404
+
+@pytest.mark.anyio
+async def test_get_user_rating_history(client: AsyncClient, token: str):
+    await get_db()[RATING_HISTORY_COLLECTION].delete_many({"username": "testuser"})
+    await record_rating_changes([("testuser", 1510)])
+    await record_rating_changes([("testuser", 1525)])
+    response = await client.get("/users/rating_history", params={"username": "testuser", "points": 1}, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data) == 1
+    assert data[0]["rating"] == 1525
+    assert data[0]["min_rating"] == 1510
+    assert data[0]["max_rating"] == 1525
+
+@pytest.mark.anyio
+async def test_rating_history_takes_the_latest_of_equal_timestamps(client: AsyncClient, token: str):
+    await get_db()[RATING_HISTORY_COLLECTION].delete_many({"username": "testuser"})
+    timestamp = datetime.now(timezone.utc)
+    for rating in (1525, 1490):
+        await get_db()[RATING_HISTORY_COLLECTION].insert_one({"username": "testuser", "timestamp": timestamp, "rating": rating})
+    response = await client.get("/users/rating_history", params={"username": "testuser", "points": 1}, headers={"Authorization": f"Bearer {token}"})
+    assert response.json()[0]["rating"] == 1490
@@ -29,4 +29,14 @@ def test_websocket_endpoint_no_token():
     with TestClient(app) as client:
         with pytest.raises(WebSocketDisconnect):
             with client.websocket_connect("/ws") as websocket:
-                websocket.receive_text()
\ No newline at end of file
+                websocket.receive_text()
+
+def test_websocket_game_commands(token: str):
+    with TestClient(app) as client:
+        with client.websocket_connect(f"/ws?token={token}") as websocket:
+            websocket.send_json({"type": "pass_turn", "id": "c1"})
+            resp = websocket.receive_json()
+            assert resp == {"id": "c1", "type": "error", "status": 400, "msg": "No ongoing game found"}
+            websocket.send_json({"type": "move", "id": "c2", "board": "not a board"})
+            resp = websocket.receive_json()
+            assert resp["id"] == "c2" and resp["type"] == "error" and resp["status"] == 422